@@ -1,257 +1,199 @@
+import sys
+
 import pygame
-print(pygame.__version__)
+from assets import SpriteAtlas
+from engine import game_status, get_legal_moves, load_fen, move_piece, piece_at, side_to_move
+from profiler import FrameProfiler
+from renderer import BoardRenderer
 
 # Constants
 WIDTH, HEIGHT = 600, 600
 ROWS, COLS = 8, 8
 SQUARE_SIZE = WIDTH // COLS
+MIN_SQUARE_SIZE = 20
+END_MESSAGE_TIME = 3000  # milliseconds
+PROFILE_FILE = "profile.jsonl"  # where F4 writes the frame profile
 
 # Load piece images
 PIECE_IMAGES = {}
+atlas = None
 
 def load_images():
-    pieces = ["wp", "wr", "wn", "wb", "wq", "wk", "bp", "br", "bn", "bb", "bq", "bk"]
-    for piece in pieces:
-        try:
-            image = pygame.image.load(f"{piece}.png")
-            scale_factor = 3.8
-            size = int(SQUARE_SIZE * scale_factor)
-            PIECE_IMAGES[piece] = pygame.transform.scale(image, (size, size))
-        except Exception as e:
-            print(f"Failed to load {piece}.png: {e}")
+    # Sprites come from the cached atlas (assets.py), one square in size
+    global atlas
+    if atlas is None:
+        atlas = SpriteAtlas()
+    PIECE_IMAGES.update(atlas.load(SQUARE_SIZE))
+
+def resize(width, height):
+    # Fit the board to a resized window; only the atlas is rescaled
+    global WIN, WIDTH, HEIGHT, SQUARE_SIZE
+    SQUARE_SIZE = max(min(width, height) // COLS, MIN_SQUARE_SIZE)
+    WIDTH = HEIGHT = SQUARE_SIZE * COLS
+    WIN = pygame.display.get_surface()
+    load_images()
+    renderer.resize(PIECE_IMAGES, SQUARE_SIZE)
 
 # Colors
 WHITE = (240, 240, 240)
 GRAY = (100, 100, 100)
 SELECTED_BORDER_COLOR = (255, 0, 0)  # Red for selected pieces
 
-pygame.init()
-WIN = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Quantum Chess")
-
-board = [
-    ["br", "bn", "bb", "bq", "bk", "bb", "bn", "br"],
-    ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
-    ["", "", "", "", "", "", "", ""],
-    ["", "", "", "", "", "", "", ""],
-    ["", "", "", "", "", "", "", ""],
-    ["", "", "", "", "", "", "", ""],
-    ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
-    ["wr", "wn", "wb", "wq", "wk", "wb", "wn", "wr"]
-]
+WIN = None  # created in main() so importing this module has no side effects
+renderer = None
 
 selected_piece = None
 selected_pos = None
-turn = 'white'
+selected_moves = []  # legal destinations of the selected piece, found when it is selected
+turn = 'white'  # follows the engine's side to move, see main()
+profile = FrameProfiler()  # F3 turns it on, see profiler.py
+_profile_panel = [None, None]  # [overlay lines, their surface]
 
 def get_square_from_pos(x, y):
     return y // SQUARE_SIZE, x // SQUARE_SIZE
 
-def highlight_moves(win, moves):
-    for move in moves:
-        pygame.draw.rect(win, (0, 255, 0), (move[1] * SQUARE_SIZE, move[0] * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE), 5)
-
-def get_possible_moves(piece, row, col):
-    moves = []
-
-    if piece == "wp":
-        if row > 0 and board[row - 1][col] == "":
-            moves.append((row - 1, col))
-        if row == 6 and board[row - 2][col] == "" and board[row - 1][col] == "":
-            moves.append((row - 2, col))
-        if row > 0 and col > 0 and board[row - 1][col - 1] != "" and board[row - 1][col - 1][0] == 'b':
-            moves.append((row - 1, col - 1))
-        if row > 0 and col < 7 and board[row - 1][col + 1] != "" and board[row - 1][col + 1][0] == 'b':
-            moves.append((row - 1, col + 1))
-
-    elif piece == "bp":
-        if row < 7 and board[row + 1][col] == "":
-            moves.append((row + 1, col))
-        if row == 1 and board[row + 2][col] == "" and board[row + 1][col] == "":
-            moves.append((row + 2, col))
-        if row < 7 and col > 0 and board[row + 1][col - 1] != "" and board[row + 1][col - 1][0] == 'w':
-            moves.append((row + 1, col - 1))
-        if row < 7 and col < 7 and board[row + 1][col + 1] != "" and board[row + 1][col + 1][0] == 'w':
-            moves.append((row + 1, col + 1))
-
-    elif piece in ["wr", "br"]:
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-        for dr, dc in directions:
-            r, c = row, col
-            while True:
-                r += dr
-                c += dc
-                if 0 <= r < ROWS and 0 <= c < COLS:
-                    if board[r][c] == "":
-                        moves.append((r, c))
-                    elif board[r][c][0] != piece[0]:
-                        moves.append((r, c))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
-    elif piece in ["wb", "bb"]:
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-        for dr, dc in directions:
-            r, c = row, col
-            while True:
-                r += dr
-                c += dc
-                if 0 <= r < ROWS and 0 <= c < COLS:
-                    if board[r][c] == "":
-                        moves.append((r, c))
-                    elif board[r][c][0] != piece[0]:
-                        moves.append((r, c))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
-    elif piece in ["wq", "bq"]:
-        moves.extend(get_possible_moves(piece[0] + "r", row, col))
-        moves.extend(get_possible_moves(piece[0] + "b", row, col))
-
-    elif piece in ["wn", "bn"]:
-        directions = [(-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2)]
-        for dr, dc in directions:
-            r, c = row + dr, col + dc
-            if 0 <= r < ROWS and 0 <= c < COLS:
-                if board[r][c] == "" or board[r][c][0] != piece[0]:
-                    moves.append((r, c))
-
-    elif piece in ["wk", "bk"]:
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
-        for dr, dc in directions:
-            r, c = row + dr, col + dc
-            if 0 <= r < ROWS and 0 <= c < COLS:
-                if board[r][c] == "" or board[r][c][0] != piece[0]:
-                    moves.append((r, c))
-
-    return moves
-
-def draw_board(win, board):
-    win.fill(WHITE)
+def draw_board(win, overlays=()):
+    # Describe the frame; the renderer redraws only what changed and returns
+    # the rects to push to the display
+    highlights = selected_moves if selected_piece else ()
+    cells = []
     for row in range(ROWS):
         for col in range(COLS):
-            if (row + col) % 2 == 1:
-                pygame.draw.rect(win, GRAY, (col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-
-            piece = board[row][col]
-            if piece != "":
-                win.blit(PIECE_IMAGES[piece], (col * SQUARE_SIZE, row * SQUARE_SIZE))
-
+            borders = []
             if selected_pos == (row, col):
-                pygame.draw.rect(win, SELECTED_BORDER_COLOR, (col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE), 5)
-
-def find_king(color):
-    for r in range(ROWS):
-        for c in range(COLS):
-            piece = board[r][c]
-            if piece == f"{color[0]}k":
-                return r, c
-    return None
-
-def is_king_in_check(color):
-    king_pos = find_king(color)
-    if not king_pos:
-        return False
-    for r in range(ROWS):
-        for c in range(COLS):
-            piece = board[r][c]
-            if piece != "" and piece[0] != color[0]:
-                moves = get_possible_moves(piece, r, c)
-                if king_pos in moves:
-                    return True
-    return False
-
-def has_legal_moves(color):
-    for r in range(ROWS):
-        for c in range(COLS):
-            piece = board[r][c]
-            if piece != "" and piece[0] == color[0]:
-                moves = get_possible_moves(piece, r, c)
-                for move in moves:
-                    orig_piece = board[move[0]][move[1]]
-                    board[move[0]][move[1]] = piece
-                    board[r][c] = ""
-                    in_check = is_king_in_check(color)
-                    board[r][c] = piece
-                    board[move[0]][move[1]] = orig_piece
-                    if not in_check:
-                        return True
-    return False
-
-def draw_end_message(text):
-    font = pygame.font.SysFont(None, 64)
-    msg_surface = font.render(text, True, (255, 0, 0))
+                borders.append((SELECTED_BORDER_COLOR, 5))
+            if (row, col) in highlights:
+                borders.append(((0, 255, 0), 5))
+            cells.append((piece_at(row, col) or None, (), tuple(borders)))
+    return renderer.render(win, cells, list(overlays))
+
+def profile_overlay():
+    # The profiler's panel in the top left corner, a new surface only when
+    # its lines change
+    lines = profile.overlay()
+    if _profile_panel[0] is not lines:
+        _profile_panel[0] = lines
+        _profile_panel[1] = renderer.panel(lines) if lines else None
+    return (_profile_panel[1], (0, 0)) if _profile_panel[1] is not None else None
+
+def end_message_overlay(text):
+    msg_surface = renderer.text(text, 64, (255, 0, 0), font=None, bold=False)
     rect = msg_surface.get_rect(center=(WIDTH // 2, HEIGHT // 2))
-    WIN.blit(msg_surface, rect)
-    pygame.display.update()
-    pygame.time.delay(3000)
-
-def main():
-    global selected_piece, selected_pos, turn
+    return msg_surface, rect.topleft
+
+def main(profile_path=None):
+    # profile_path: profile from the start and write the frames there on exit
+    global WIN, renderer, selected_piece, selected_pos, selected_moves, turn
+    print(pygame.__version__)
+    pygame.init()
+    WIN = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
+    pygame.display.set_caption("Quantum Chess")
     run = True
     clock = pygame.time.Clock()
     load_images()
+    renderer = BoardRenderer(PIECE_IMAGES, SQUARE_SIZE, WHITE, GRAY)
+    end_message = None
+    end_time = 0
+    turn = side_to_move()  # a FEN start position may have Black to move
+    if profile_path is not None:
+        profile.start()
 
     while run:
+        if profile.active:
+            profile.frame()
         clock.tick(60)
-        draw_board(WIN, board)
-
-        if selected_piece:
-            moves = get_possible_moves(selected_piece, selected_pos[0], selected_pos[1])
-            highlight_moves(WIN, moves)
+        if profile.active:
+            profile.phase("logic")
+        overlays = []
 
         # Display "Check!" if king is under threat
-        if is_king_in_check(turn):
-            font = pygame.font.SysFont(None, 48)
-            check_surface = font.render("Check!", True, (255, 0, 0))
-            WIN.blit(check_surface, (WIDTH // 2 - 60, HEIGHT - 40))
-
-        pygame.display.update()
-
+        status = game_status()
+        if status.in_check(turn):
+            check_surface = renderer.text("Check!", 48, (255, 0, 0), font=None, bold=False)
+            overlays.append((check_surface, (WIDTH // 2 - 60, HEIGHT - 40)))
+
+        # The end message stays up for END_MESSAGE_TIME while events keep
+        # being handled, then the game closes
+        if end_message is not None:
+            overlays.append(end_message_overlay(end_message))
+            if pygame.time.get_ticks() >= end_time:
+                run = False
+        panel = profile_overlay() if profile.active else None
+        if panel is not None:
+            overlays.append(panel)
+
+        if profile.active:
+            profile.phase("render")
+        rects = draw_board(WIN, overlays)
+        if profile.active:
+            profile.phase("flip")
+        if rects:
+            pygame.display.update(rects)
+
+        if profile.active:
+            profile.phase("events")
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 run = False
-            elif event.type == pygame.MOUSEBUTTONDOWN:
+            elif event.type == pygame.VIDEORESIZE:
+                resize(event.w, event.h)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                if profile.active:
+                    profile.stop()
+                else:
+                    profile.start()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                print(f"profile: {profile.export(PROFILE_FILE)} frames written to {PROFILE_FILE}")
+            elif event.type == pygame.MOUSEBUTTONDOWN and end_message is None:
                 x, y = event.pos
                 row, col = get_square_from_pos(x, y)
+                if row >= ROWS or col >= COLS:
+                    continue  # margin of a resized window
 
                 if selected_piece is None:
-                    piece = board[row][col]
+                    piece = piece_at(row, col)
                     if piece != "" and ((turn == 'white' and piece[0] == 'w') or (turn == 'black' and piece[0] == 'b')):
                         selected_piece = piece
                         selected_pos = (row, col)
+                        selected_moves = get_legal_moves(piece, row, col)
                 else:
-                    moves = get_possible_moves(selected_piece, selected_pos[0], selected_pos[1])
-                    if (row, col) in moves:
-                        board[row][col] = selected_piece
-                        board[selected_pos[0]][selected_pos[1]] = ""
-                        turn = 'black' if turn == 'white' else 'white'
+                    if (row, col) in selected_moves:
+                        move_piece(selected_pos, (row, col))
+                        turn = side_to_move()
                     selected_piece = None
 
-        # Victory check
-        all_pieces = [p for row_ in board for p in row_]
-        if "wk" not in all_pieces:
-            draw_end_message("Black wins!")
-            run = False
-        elif "bk" not in all_pieces:
-            draw_end_message("White wins!")
-            run = False
-
-        # Checkmate
-        if is_king_in_check(turn):
-            if not has_legal_moves(turn):
-                winner = 'White' if turn == 'black' else 'Black'
-                draw_end_message(f"Checkmate! {winner} wins!")
-                run = False
+        if profile.active:
+            profile.phase("logic")
+        if end_message is not None:
+            continue
 
+        # Victory check
+        status = game_status()
+        if status.winner is not None:
+            if not status.has_king('white'):
+                end_message = "Black wins!"
+            elif not status.has_king('black'):
+                end_message = "White wins!"
+            else:
+                end_message = f"Checkmate! {'White' if status.winner == 'w' else 'Black'} wins!"
+        elif status.stalemate:
+            end_message = "Stalemate!"
+
+        if end_message is not None:
+            end_time = pygame.time.get_ticks() + END_MESSAGE_TIME
+
+    if profile_path is not None:
+        print(f"profile: {profile.export(profile_path)} frames written to {profile_path}")
     pygame.quit()
 
 if __name__ == "__main__":
-    main()
+    # python Chess.py [--profile PATH] ["<FEN>"]
+    args = sys.argv[1:]
+    profile_path = None
+    if len(args) > 1 and args[0] == "--profile":
+        profile_path = args[1]
+        args = args[2:]
+    if args:
+        load_fen(" ".join(args))
+    main(profile_path)
 
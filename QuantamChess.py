@@ -1,27 +1,50 @@
 
-import pygame
-import random
+import sys
 
-print(pygame.__version__)
+import pygame
+from assets import SpriteAtlas
+from engine import (allowed_moves, current_position, game_status, get_legal_moves, load_fen, load_state, measure,
+                    move_piece, piece_at, play_move, position_key, quantum, quantum_squares, side_to_move, split,
+                    split_targets)
+from montecarlo import expected_score
+from analysis import AnalysisWorker
+from book import open_book
+from position import move_to_uci, square_name
+from profiler import FrameProfiler
+from server import GameClient, ghosts_of
+from renderer import BoardRenderer
+from tablebase import best_move, describe
 
 # Constants
 WIDTH, HEIGHT = 600, 600
 ROWS, COLS = 8, 8
 SQUARE_SIZE = WIDTH // COLS
+MIN_SQUARE_SIZE = 20
+COMPUTER_TIME = 1.0  # seconds per computer move
+HINT_TIME = 1.0
+SEARCH_WORKERS = 1  # processes per computer search, see parallel_search.py
+MESSAGE_TIME = 3000  # milliseconds a timed message stays up
+PROFILE_FILE = "profile.jsonl"  # where F4 writes the frame profile
 
 # Load piece images
 PIECE_IMAGES = {}
+atlas = None
 
 def load_images():
-    pieces = ["wp", "wr", "wn", "wb", "wq", "wk", "bp", "br", "bn", "bb", "bq", "bk"]
-    for piece in pieces:
-        try:
-            image = pygame.image.load(f"{piece}.png")
-            scale_factor = 3.8
-            size = int(SQUARE_SIZE * scale_factor)
-            PIECE_IMAGES[piece] = pygame.transform.scale(image, (size, size))
-        except Exception as e:
-            print(f"Failed to load {piece}.png: {e}")
+    # Sprites come from the cached atlas (assets.py), one square in size
+    global atlas
+    if atlas is None:
+        atlas = SpriteAtlas()
+    PIECE_IMAGES.update(atlas.load(SQUARE_SIZE))
+
+def resize(width, height):
+    # Fit the board to a resized window; only the atlas is rescaled
+    global WIN, WIDTH, HEIGHT, SQUARE_SIZE
+    SQUARE_SIZE = max(min(width, height) // COLS, MIN_SQUARE_SIZE)
+    WIDTH = HEIGHT = SQUARE_SIZE * COLS
+    WIN = pygame.display.get_surface()
+    load_images()
+    renderer.resize(PIECE_IMAGES, SQUARE_SIZE)
 
 # Colors
 WHITE = (240, 240, 240)
@@ -29,21 +52,10 @@ GRAY = (100, 100, 100)
 SELECTED_BORDER_COLOR = (255, 0, 0)  # Red for selected pieces
 GREEN = (0, 255, 0)
 BLUE = (0, 0, 255)
+PURPLE = (160, 0, 255)  # split squares picked so far
 
-pygame.init()
-WIN = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Quantum Chess")
-
-board = [
-    ["br", "bn", "bb", "bq", "bk", "bb", "bn", "br"],
-    ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
-    ["", "", "", "", "", "", "", ""],
-    ["", "", "", "", "", "", "", ""],
-    ["", "", "", "", "", "", "", ""],
-    ["", "", "", "", "", "", "", ""],
-    ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
-    ["wr", "wn", "wb", "wq", "wk", "wb", "wn", "wr"]
-]
+WIN = None  # created in main() so importing this module has no side effects
+renderer = None
 
 selected_piece = None
 selected_pos = None
@@ -52,313 +64,417 @@ quantum_mode = False
 quantum_moves = []
 quantum_piece = None
 quantum_positions = []
-
-quantum_board = {}  # {(r, c): [(piece, color), ...]} for superposed states
+computer_color = None  # 'black' when playing against the computer, the opponent's color online
+client = None  # GameClient when playing on a server (server.py)
+hint_move = None
+message = None  # (text, expiry in pygame ticks) of the timed overlay
+profile = FrameProfiler()  # F3 turns it on, see profiler.py
+_profile_panel = [None, None]  # [overlay lines, their surface]
 
 
 def get_square_from_pos(x, y):
     return y // SQUARE_SIZE, x // SQUARE_SIZE
 
-def highlight_moves(win, moves):
-    for move in moves:
-        pygame.draw.rect(win, GREEN, (move[1] * SQUARE_SIZE, move[0] * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE), 5)
-
-def get_possible_moves(piece, row, col):
-    moves = []
-    color = piece[0]
-    opponent = 'b' if color == 'w' else 'w'
-
-    if piece[1] == 'p':
-        direction = -1 if color == 'w' else 1
-        start_row = 6 if color == 'w' else 1
-        if 0 <= row + direction < 8 and board[row + direction][col] == "":
-            moves.append((row + direction, col))
-        if row == start_row and board[row + direction][col] == "" and board[row + 2 * direction][col] == "":
-            moves.append((row + 2 * direction, col))
-        for dc in [-1, 1]:
-            nr, nc = row + direction, col + dc
-            if 0 <= nr < 8 and 0 <= nc < 8:
-                if board[nr][nc] != "" and board[nr][nc][0] == opponent:
-                    moves.append((nr, nc))
-
-    elif piece[1] == 'r':
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1)]
-        for dr, dc in directions:
-            r, c = row, col
-            while True:
-                r += dr
-                c += dc
-                if 0 <= r < 8 and 0 <= c < 8:
-                    if board[r][c] == "":
-                        moves.append((r, c))
-                    elif board[r][c][0] == opponent:
-                        moves.append((r, c))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
-    elif piece[1] == 'b':
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-        for dr, dc in directions:
-            r, c = row, col
-            while True:
-                r += dr
-                c += dc
-                if 0 <= r < 8 and 0 <= c < 8:
-                    if board[r][c] == "":
-                        moves.append((r, c))
-                    elif board[r][c][0] == opponent:
-                        moves.append((r, c))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
-    elif piece[1] == 'q':
-        moves.extend(get_possible_moves(color + 'r', row, col))
-        moves.extend(get_possible_moves(color + 'b', row, col))
-
-    elif piece[1] == 'n':
-        deltas = [(-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2)]
-        for dr, dc in deltas:
-            r, c = row + dr, col + dc
-            if 0 <= r < 8 and 0 <= c < 8:
-                if board[r][c] == "" or board[r][c][0] == opponent:
-                    moves.append((r, c))
-
-    elif piece[1] == 'k':
-        directions = [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
-        for dr, dc in directions:
-            r, c = row + dr, col + dc
-            if 0 <= r < 8 and 0 <= c < 8:
-                if board[r][c] == "" or board[r][c][0] == opponent:
-                    moves.append((r, c))
-
-    return moves
+def own_piece_at(row, col):
+    # Piece of the side to move on (row, col), classical or superposed
+    piece = piece_at(row, col)
+    if piece == "":
+        piece = quantum_squares().get((row, col), ("", 0))[0]
+    if piece != "" and ((turn == 'white' and piece[0] == 'w') or (turn == 'black' and piece[0] == 'b')):
+        return piece
+    return None
 
 # (The beginning remains unchanged up to draw_board...)
 
-def draw_instructions(win):
-    font = pygame.font.SysFont("Arial", 28, bold=True)
-    instructions = [
-        "Press ENTER to start playing",
-        "Press Q to enter quantum mode",
-        "In quantum mode, click two possible moves",
-        "Press M to collapse to one location"
-    ]
-    
-    total_height = len(instructions) * 40
+_moves_cache = [None, []]  # [(piece, square, position key), destinations]
+
+def selected_moves():
+    # Legal destinations of the selected piece, recomputed only when the
+    # selection or the position changes
+    if selected_pos is None:
+        return []
+    cache_key = (selected_piece, selected_pos, quantum_mode, position_key())
+    if _moves_cache[0] != cache_key:
+        _moves_cache[0] = cache_key
+        if quantum_mode:
+            _moves_cache[1] = split_targets(selected_pos[0], selected_pos[1])
+        else:
+            _moves_cache[1] = get_legal_moves(selected_piece, selected_pos[0], selected_pos[1])
+    return _moves_cache[1]
+
+INSTRUCTIONS = [
+    "Press ENTER to start playing",
+    "Press C to play against the computer",
+    "Press H for a hint",
+    "Press Q to enter quantum mode",
+    "In quantum mode, click a piece and two squares",
+    "Click a ghost and press M to measure it"
+]
+
+def instruction_overlays():
+    total_height = len(INSTRUCTIONS) * 40
     start_y = (HEIGHT - total_height) // 2  # Center vertically
 
-    for i, line in enumerate(instructions):
-        text = font.render(line, True, (0, 0, 0))  # ⬛ Black text
+    overlays = []
+    for i, line in enumerate(INSTRUCTIONS):
+        text = renderer.text(line, 28, (0, 0, 0))  # ⬛ Black text
         text_rect = text.get_rect(center=(WIDTH // 2, start_y + i * 40))  # Center horizontally
-        win.blit(text, text_rect)
+        overlays.append((text, text_rect.topleft))
+    return overlays
 
 
-def draw_board(win, board, show_instructions=False):
-    win.fill(WHITE)
-    for row in range(ROWS):
-        for col in range(COLS):
-            if (row + col) % 2 == 1:
-                pygame.draw.rect(win, GRAY, (col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+def message_overlay(text):
+    surface = renderer.text(text, 40, (255, 0, 0))
+    return surface, surface.get_rect(center=(WIDTH // 2, HEIGHT // 2)).topleft
 
-            if (row, col) in quantum_board:
-                for piece in quantum_board[(row, col)]:
-                    ghost_surface = PIECE_IMAGES[piece].copy()
-                    ghost_surface.set_alpha(128)  # 👻 Transparent piece
-                    win.blit(ghost_surface, (col * SQUARE_SIZE, row * SQUARE_SIZE))
-            elif board[row][col] != "":
-                win.blit(PIECE_IMAGES[board[row][col]], (col * SQUARE_SIZE, row * SQUARE_SIZE))
 
-            if selected_pos == (row, col):
-                pygame.draw.rect(win, SELECTED_BORDER_COLOR, (col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE), 5)
+def profile_overlay():
+    # The profiler's panel in the top left corner, a new surface only when
+    # its lines change
+    lines = profile.overlay()
+    if _profile_panel[0] is not lines:
+        _profile_panel[0] = lines
+        _profile_panel[1] = renderer.panel(lines) if lines else None
+    return (_profile_panel[1], (0, 0)) if _profile_panel[1] is not None else None
+
 
-    if show_instructions:
-        draw_instructions(win)
+def draw_board(win, show_instructions=False, highlights=(), messages=()):
+    # Describe the frame; the renderer redraws only what changed and returns
+    # the rects to push to the display
+    hint_squares = ()
+    if hint_move is not None:
+        hint_squares = (hint_move & 63, (hint_move >> 6) & 63)
 
+    ghosts = quantum_squares()
+    cells = []
+    for row in range(ROWS):
+        for col in range(COLS):
+            borders = []
+            if selected_pos == (row, col):
+                borders.append((SELECTED_BORDER_COLOR, 5))
+            if (row, col) in highlights:
+                borders.append((GREEN, 5))
+            if row * COLS + col in hint_squares:
+                borders.append((BLUE, 5))
+            if (row, col) in quantum_positions:
+                borders.append((PURPLE, 5))
+
+            if (row, col) in ghosts:
+                cells.append((None, (ghosts[(row, col)],), tuple(borders)))  # 👻 Transparent pieces
+            else:
+                cells.append((piece_at(row, col) or None, (), tuple(borders)))
+
+    overlays = instruction_overlays() if show_instructions else []
     if quantum_mode:  # 🔮 Show quantum banner
-        font = pygame.font.SysFont("Arial", 24, bold=True)
-        text = font.render("Quantum Mode Active", True, (0, 0, 255))
-        win.blit(text, (WIDTH // 2 - text.get_width() // 2, HEIGHT - 30))
-
-    
-
-def is_in_check(color):
-    king_pos = None
-    opponent_color = 'b' if color == 'w' else 'w'
-    for r in range(8):
-        for c in range(8):
-            if board[r][c] == color + 'k':
-                king_pos = (r, c)
-                break
-        if king_pos:
-            break
-
-    for r in range(8):
-        for c in range(8):
-            if board[r][c] != '' and board[r][c][0] == opponent_color:
-                moves = get_possible_moves(board[r][c], r, c)
-                if king_pos in moves:
-                    return True
-    return False
-
-def has_any_moves(color):
-    for r in range(8):
-        for c in range(8):
-            if board[r][c] != '' and board[r][c][0] == color:
-                moves = get_possible_moves(board[r][c], r, c)
-                for move in moves:
-                    # Try the move
-                    saved = board[move[0]][move[1]]
-                    board[move[0]][move[1]] = board[r][c]
-                    board[r][c] = ''
-                    in_check = is_in_check(color)
-                    board[r][c] = board[move[0]][move[1]]
-                    board[move[0]][move[1]] = saved
-                    if not in_check:
-                        return True
-    return False
-
-def show_message(win, text):
-    font = pygame.font.SysFont("Arial", 40, bold=True)
-    surface = font.render(text, True, (255, 0, 0))
-    rect = surface.get_rect(center=(WIDTH // 2, HEIGHT // 2))
-    win.blit(surface, rect)
-    pygame.display.update()
-    pygame.time.wait(3000)
-
-def main():
-    global selected_piece, selected_pos, turn, quantum_mode, quantum_moves, quantum_piece, quantum_positions
+        text = renderer.text("Quantum Mode Active", 24, (0, 0, 255))
+        overlays.append((text, (WIDTH // 2 - text.get_width() // 2, HEIGHT - 30)))
+    for text in messages:
+        overlays.append(message_overlay(text))
+    panel = profile_overlay() if profile.active else None
+    if panel is not None:
+        overlays.append(panel)
+    return renderer.render(win, cells, overlays)
+
+# Moves, splits and measurements are played locally, or sent to the server
+# when connected; the server answers with the new state
+
+def submit_move(from_pos, to_pos):
+    if client is None:
+        move_piece(from_pos, to_pos)
+    else:
+        from_sq = from_pos[0] * COLS + from_pos[1]
+        client.send(op="move", move=square_name(from_sq) + square_name(to_pos[0] * COLS + to_pos[1]))
+
+def submit_split(from_pos, targets):
+    if client is None:
+        split(from_pos, targets)
+    else:
+        client.send(op="split", **{"from": square_name(from_pos[0] * COLS + from_pos[1]),
+                                   "to": [square_name(row * COLS + col) for row, col in targets]})
+
+def submit_measure(row, col):
+    if client is None:
+        measure(row, col)
+    else:
+        client.send(op="measure", square=square_name(row * COLS + col))
+
+def known_move(book):
+    # (move, source, tablebase outcome) from the opening book, or else from
+    # the tablebases, or None. Both only know classical positions, and the
+    # tablebases are only probed when the book has no move.
+    if quantum:
+        return None
+    moves = allowed_moves()
+    move = book.choose(current_position()) if book is not None else None
+    if move is not None and move in moves:
+        return move, "book", None
+    found = best_move(current_position(), moves)
+    if found is not None:
+        return found[0], "tablebase", found[1:]
+    return None
+
+def show_message(text, duration=MESSAGE_TIME):
+    # Timed overlay drawn by the main loop, so the game keeps running
+    global message
+    message = (text, pygame.time.get_ticks() + duration)
+
+def main(server=None, game_id=None, profile_path=None, workers=SEARCH_WORKERS):
+    # server: (host, port) to play online, joining game_id or opening a game.
+    # profile_path: profile from the start and write the frames there on exit.
+    # workers: processes the computer searches with
+    global WIN, selected_piece, selected_pos, turn, quantum_mode, quantum_moves, quantum_piece, quantum_positions, \
+        computer_color, hint_move, message, renderer, client
+    if server is not None:
+        client = GameClient(*server)
+        if game_id is None:
+            client.send(op="new", rules="quantum")
+        else:
+            client.send(op="join", game=game_id)
+    worker = None  # AnalysisWorker, started the first time the engine has to search
+    book = open_book()  # book.bin next to this file, if one has been built
+    print(pygame.__version__)
+    pygame.init()
+    WIN = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
+    pygame.display.set_caption("Quantum Chess")
     run = True
     clock = pygame.time.Clock()
     load_images()
+    renderer = BoardRenderer(PIECE_IMAGES, SQUARE_SIZE, WHITE, GRAY)
     game_started = False
+    game_over = False
+    thinking = False
+    last_key = position_key()
+    if profile_path is not None:
+        profile.start()
 
     while run:
+        if profile.active:
+            profile.frame()
         clock.tick(60)
-        draw_board(WIN, board, show_instructions=not game_started)
-        if game_started and selected_piece:
-            moves = get_possible_moves(selected_piece, selected_pos[0], selected_pos[1])
-            highlight_moves(WIN, moves)
-
-        if game_started:
-            # 🛡 Check if a king has been removed from the board
-            white_king_exists = any(board[r][c] == 'wk' for r in range(8) for c in range(8))
-            black_king_exists = any(board[r][c] == 'bk' for r in range(8) for c in range(8))
-
-            if not white_king_exists:
-                show_message(WIN, "Black Wins!")
-                pygame.time.wait(3000)
-                run = False
-                continue
-            elif not black_king_exists:
-                show_message(WIN, "White Wins!")
-                pygame.time.wait(3000)
-                run = False
-                continue
-
-            # ♟ Classic check/checkmate logic
-            if is_in_check('w'):
-                if not has_any_moves('w'):
-                    show_message(WIN, "Black Wins!")
-                    pygame.time.wait(3000)
-                    run = False
-                elif selected_piece is None:
-                    show_message(WIN, "White King in Check!")
-            elif is_in_check('b'):
-                if not has_any_moves('b'):
-                    show_message(WIN, "White Wins!")
-                    pygame.time.wait(3000)
+        if profile.active:
+            profile.phase("logic")
+        messages = []
+        if game_started and not game_over:
+            # Cached per position, so this is free on frames where nothing moved
+            status = game_status()
+            if status.winner == 'w':
+                show_message("White Wins!")
+                game_over = True
+            elif status.winner == 'b':
+                show_message("Black Wins!")
+                game_over = True
+            elif status.stalemate:
+                show_message("Stalemate!")
+                game_over = True
+            elif status.in_check('w'):
+                if selected_piece is None:
+                    messages.append("White King in Check!")
+            elif status.in_check('b'):
+                if selected_piece is None:
+                    messages.append("Black King in Check!")
+
+            if game_over and worker is not None:
+                worker.cancel()
+
+        if message is not None:
+            if pygame.time.get_ticks() < message[1]:
+                messages.append(message[0])
+            else:
+                message = None
+                if game_over:
                     run = False
-                elif selected_piece is None:
-                    show_message(WIN, "Black King in Check!")
-
-
-
-        pygame.display.update()
 
+        highlights = selected_moves() if game_started and selected_piece else ()
+        if profile.active:
+            profile.phase("render")
+        rects = draw_board(WIN, show_instructions=not game_started, highlights=highlights, messages=messages)
+        if profile.active:
+            profile.phase("flip")
+        if rects:
+            pygame.display.update(rects)
+        if profile.active:
+            profile.phase("logic")
+
+        # The server's state replaces the local one after every action
+        for reply in client.poll() if client is not None else ():
+            if reply is None:
+                show_message("Disconnected")
+                game_over = True
+            elif reply["op"] == "error":
+                show_message(reply["message"], 1500)
+            elif reply["op"] == "state":
+                load_state(reply["fen"], ghosts_of(reply))
+                computer_color = 'black' if reply["color"] == 'white' else 'white'
+                game_started = True
+                waiting = "" if reply["opponent"] else ", waiting for an opponent"
+                pygame.display.set_caption(f"Quantum Chess - game {reply['game']}, you play {reply['color']}{waiting}")
+
+        # Engine results arrive here; the search itself runs on the worker
+        for _, kind, result in worker.poll() if worker is not None else ():
+            pygame.display.set_caption(f"Quantum Chess - depth {result.depth}, {result.nps} nodes/s")
+            if kind == "move":
+                thinking = False
+                if result.move is not None:
+                    play_move(result.move)
+                    print(f"computer: {move_to_uci(result.move)} depth {result.depth} score {result.score} "
+                          f"nodes {result.nodes} nps {result.nps}")
+                else:
+                    # No classical move left, but a superposed piece can
+                    # always be measured
+                    own_ghosts = [pos for pos in quantum_squares() if own_piece_at(*pos)]
+                    if own_ghosts:
+                        measure(*own_ghosts[0])
+                turn = side_to_move()
+            elif kind == "hint":
+                hint_move = result.move
+                if quantum:
+                    # The search sees only the classical board; average the
+                    # evaluation over how the ghosts could collapse
+                    expectation = expected_score(current_position(), quantum)
+                    pygame.display.set_caption(f"Quantum Chess - depth {result.depth}, expected "
+                                               f"{expectation.mean / 100:+.2f} ± {expectation.stderr / 100:.2f} "
+                                               f"over {expectation.samples} collapses")
+
+        if client is None and game_started and not game_over and turn == computer_color and not thinking:
+            known = known_move(book)
+            if known is not None:
+                move, source, outcome = known
+                play_move(move)
+                print(f"computer: {move_to_uci(move)} from {source}" + (f", {describe(outcome)}" if outcome else ""))
+                turn = side_to_move()
+            else:
+                if worker is None:
+                    worker = AnalysisWorker(workers)
+                worker.submit("move", current_position(), COMPUTER_TIME, allowed_moves())
+                thinking = True
+
+        if profile.active:
+            profile.phase("events")
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 run = False
+            elif event.type == pygame.VIDEORESIZE:
+                resize(event.w, event.h)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                if profile.active:
+                    profile.stop()
+                else:
+                    profile.start()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                print(f"profile: {profile.export(PROFILE_FILE)} frames written to {PROFILE_FILE}")
             elif event.type == pygame.KEYDOWN:
-                if not game_started and event.key == pygame.K_RETURN:
+                if not game_started and client is not None:
+                    continue  # the game starts when the server sends it
+                elif not game_started and event.key == pygame.K_RETURN:
+                    game_started = True
+                elif not game_started and event.key == pygame.K_c:
+                    computer_color = 'black'
                     game_started = True
+                elif game_over or turn == computer_color:
+                    continue
+                elif event.key == pygame.K_h and game_started:
+                    known = known_move(book)
+                    if known is not None:
+                        hint_move, source, outcome = known
+                        if outcome is not None:
+                            pygame.display.set_caption(f"Quantum Chess - tablebase: {describe(outcome)}")
+                    else:
+                        if worker is None:
+                            worker = AnalysisWorker(workers)
+                        worker.submit("hint", current_position(), HINT_TIME, allowed_moves())
                 elif event.key == pygame.K_q:
                     quantum_mode = not quantum_mode
-                    if not quantum_mode:
-                        quantum_moves = []
-                        quantum_piece = None
-                        quantum_positions = []
-                        selected_piece = None
-                        selected_pos = None
-                elif event.key == pygame.K_m and quantum_piece and len(quantum_positions) == 2:
-                    chosen = random.choice(quantum_positions)
-                    board[chosen[0]][chosen[1]] = quantum_piece
-                    for pos in quantum_positions:
-                        if pos != chosen:
-                            board[pos[0]][pos[1]] = ""
-                        if pos in quantum_board:
-                            del quantum_board[pos]
                     quantum_piece = None
                     quantum_positions = []
                     selected_piece = None
-                    quantum_mode = False
-                    turn = 'black' if turn == 'white' else 'white'
+                    selected_pos = None
+                elif event.key == pygame.K_m and selected_piece and selected_pos in quantum_squares():
+                    submit_measure(selected_pos[0], selected_pos[1])
+                    selected_piece = None
+                    selected_pos = None
 
             elif event.type == pygame.MOUSEBUTTONDOWN:
-                if not game_started:
+                if not game_started or game_over or turn == computer_color:
                     continue
 
                 x, y = event.pos
                 row, col = get_square_from_pos(x, y)
+                if row >= ROWS or col >= COLS:
+                    continue  # margin of a resized window
 
                 if quantum_mode:
                     if not quantum_piece:
-                        if board[row][col] != "" and ((turn == 'white' and board[row][col][0] == 'w') or (turn == 'black' and board[row][col][0] == 'b')):
-                            quantum_piece = board[row][col]
+                        piece = own_piece_at(row, col)
+                        if piece is not None:
+                            quantum_piece = piece
                             selected_pos = (row, col)
-                            selected_piece = board[row][col]
-
-                            valid_moves = get_possible_moves(quantum_piece, selected_pos[0], selected_pos[1])
-                            if len(valid_moves) == 1:
-                                only_pos = valid_moves[0]
-                                board[selected_pos[0]][selected_pos[1]] = ""
-                                board[only_pos[0]][only_pos[1]] = quantum_piece
+                            selected_piece = piece
+                            if len(selected_moves()) < 2:  # nowhere to split to
                                 quantum_piece = None
-                                quantum_positions = []
                                 selected_piece = None
                                 selected_pos = None
-                                quantum_mode = False
-                                turn = 'black' if turn == 'white' else 'white'
                     else:
-                        valid_moves = get_possible_moves(quantum_piece, selected_pos[0], selected_pos[1])
+                        valid_moves = selected_moves()
                         if (row, col) not in quantum_positions and (row, col) in valid_moves:
                             quantum_positions.append((row, col))
-                            board[row][col] = quantum_piece
-                            quantum_board[(row, col)] = [quantum_piece]
                             if len(quantum_positions) == 2:
-                                board[selected_pos[0]][selected_pos[1]] = ""
+                                submit_split(selected_pos, quantum_positions)
+                                quantum_piece = None
+                                quantum_positions = []
                                 selected_piece = None
                                 selected_pos = None
+                                quantum_mode = False
                 else:
                     if selected_piece is None:
-                        piece = board[row][col]
-                        if piece != "" and ((turn == 'white' and piece[0] == 'w') or (turn == 'black' and piece[0] == 'b')):
+                        piece = own_piece_at(row, col)
+                        if piece is not None:
                             selected_piece = piece
                             selected_pos = (row, col)
                     else:
-                        moves = get_possible_moves(selected_piece, selected_pos[0], selected_pos[1])
+                        moves = selected_moves()
                         if (row, col) in moves:
-                            board[row][col] = selected_piece
-                            board[selected_pos[0]][selected_pos[1]] = ""
-                            turn = 'black' if turn == 'white' else 'white'
+                            submit_move(selected_pos, (row, col))
                         selected_piece = None
 
+        if profile.active:
+            profile.phase("logic")
+        turn = side_to_move()
+
+        key = position_key()
+        if key != last_key:
+            # Anything still being searched is about the old position
+            last_key = key
+            if worker is not None:
+                worker.cancel()
+            thinking = False
+            hint_move = None
+
+    if profile_path is not None:
+        print(f"profile: {profile.export(profile_path)} frames written to {profile_path}")
+    if worker is not None:
+        worker.close()
+    if client is not None:
+        client.close()
+    if book is not None:
+        book.close()
     pygame.quit()
 
 if __name__ == "__main__":
-    main()
+    # python QuantamChess.py [--profile PATH] [--workers N] ["<FEN>"]
+    # python QuantamChess.py [--profile PATH] --connect host:port [game]
+    args = sys.argv[1:]
+    profile_path = None
+    workers = SEARCH_WORKERS
+    while len(args) > 1 and args[0] in ("--profile", "--workers"):
+        if args[0] == "--profile":
+            profile_path = args[1]
+        else:
+            workers = int(args[1])
+        args = args[2:]
+    if len(args) > 1 and args[0] == "--connect":
+        host, port = args[1].rsplit(":", 1)
+        main((host, int(port)), int(args[2]) if len(args) > 2 else None, profile_path)
+    else:
+        if args:
+            load_fen(" ".join(args))
+        main(profile_path=profile_path, workers=workers)
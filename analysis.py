@@ -0,0 +1,108 @@
+# Background analysis worker
+#
+# Searches run in a separate process so the pygame loop never competes with
+# them for the interpreter. The GUI submits a job with a snapshot of the
+# position and polls for results once per frame. Submitting a new job or
+# calling cancel() stops the running search at its next node check, and
+# results of cancelled jobs are dropped. The worker keeps one Searcher for
+# its lifetime, so the transposition table carries over between moves. With
+# workers > 1 it is a ParallelSearcher (parallel_search.py) whose helper
+# processes the worker starts itself.
+
+import atexit
+import multiprocessing
+import queue
+
+from parallel_search import ParallelSearcher
+from search import Searcher
+
+
+class _JobStop:
+    # Stop flag for one job, shaped like threading.Event for Searcher
+    __slots__ = ("cancelled", "job_id")
+
+    def __init__(self, cancelled, job_id):
+        self.cancelled = cancelled
+        self.job_id = job_id
+
+    def is_set(self):
+        return self.cancelled.value >= self.job_id
+
+
+def _run(jobs, results, cancelled, workers):
+    searcher = Searcher() if workers == 1 else ParallelSearcher(workers)
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            job_id, kind, position, time_limit, root_moves = job
+            stop = _JobStop(cancelled, job_id)
+            if stop.is_set():
+                continue
+            result = searcher.search(position, time_limit, stop=stop, root_moves=root_moves)
+            if not stop.is_set():
+                results.put((job_id, kind, result))
+    finally:
+        if workers > 1:
+            searcher.close()
+
+
+class AnalysisWorker:
+    def __init__(self, workers=1):
+        # The child only searches and never touches pygame, so it can be
+        # forked after pygame.init(). workers is the number of processes
+        # per search.
+        self.jobs = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.cancelled = multiprocessing.Value('q', 0, lock=False)  # highest cancelled job id
+        self.job_id = 0
+        self.pending = False
+        # A daemon process may not start the search helpers; without daemon,
+        # close() has to run even if the game dies, before multiprocessing
+        # waits for its children at exit
+        self.process = multiprocessing.Process(target=_run, args=(self.jobs, self.results, self.cancelled, workers),
+                                               name="analysis", daemon=workers == 1)
+        self.process.start()
+        if workers > 1:
+            atexit.register(self.close)
+
+    def submit(self, kind, position, time_limit, root_moves=None):
+        # Search a copy of position for time_limit seconds, optionally only
+        # over root_moves; kind is passed back with the result. Returns the
+        # job id.
+        self.cancel()
+        self.job_id += 1
+        self.pending = True
+        self.jobs.put((self.job_id, kind, position.copy(), time_limit, root_moves))
+        return self.job_id
+
+    def cancel(self):
+        # Abandon the current job, e.g. because the position changed
+        if self.pending:
+            self.cancelled.value = self.job_id
+            self.pending = False
+
+    def busy(self):
+        return self.pending
+
+    def poll(self):
+        # Finished, non-cancelled jobs as (job_id, kind, SearchResult)
+        finished = []
+        while True:
+            try:
+                job_id, kind, result = self.results.get_nowait()
+            except queue.Empty:
+                return finished
+            if job_id == self.job_id and self.pending:
+                self.pending = False
+                finished.append((job_id, kind, result))
+
+    def close(self):
+        if self.process.exitcode is not None:
+            return
+        self.cancel()
+        self.jobs.put(None)
+        self.process.join(1.0)
+        if self.process.is_alive():
+            self.process.terminate()
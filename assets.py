@@ -0,0 +1,90 @@
+# Piece sprite atlas
+#
+# The twelve piece images are decoded and scaled once per square size into a
+# single atlas surface. The atlas is cached on disk as raw RGBA, keyed by the
+# square size and a hash of the source files, so later starts read one file
+# and decode nothing. The decoded sources are kept after the first build, so
+# resizing the window to a new size rescales them without loading the images
+# again.
+
+import hashlib
+import os
+
+import pygame
+
+PIECES = ["wp", "wr", "wn", "wb", "wq", "wk", "bp", "br", "bn", "bb", "bq", "bk"]
+
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(ASSET_DIR, ".sprite_cache")
+
+# pygame.image.tobytes/frombytes are 2.1.3+; older versions only have the
+# tostring/fromstring names
+_to_bytes = getattr(pygame.image, "tobytes", None) or pygame.image.tostring
+_from_bytes = getattr(pygame.image, "frombytes", None) or pygame.image.fromstring
+
+
+class SpriteAtlas:
+    def __init__(self, asset_dir=ASSET_DIR, cache_dir=CACHE_DIR):
+        self.asset_dir = asset_dir
+        self.cache_dir = cache_dir
+        self.sources = None  # decoded source images, only once a size had to be built
+        self.digest = self._source_digest()
+        self.surface = None
+        self.square_size = 0
+
+    def _source_digest(self):
+        digest = hashlib.sha1()
+        for piece in PIECES:
+            with open(os.path.join(self.asset_dir, f"{piece}.png"), "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()[:16]
+
+    def _cache_path(self, square_size):
+        return os.path.join(self.cache_dir, f"atlas-{square_size}-{self.digest}.rgba")
+
+    def _build(self, square_size):
+        if self.sources is None:
+            self.sources = {piece: pygame.image.load(os.path.join(self.asset_dir, f"{piece}.png")) for piece in PIECES}
+        atlas = pygame.Surface((square_size * len(PIECES), square_size), pygame.SRCALPHA)
+        for i, piece in enumerate(PIECES):
+            sprite = pygame.transform.smoothscale(self.sources[piece], (square_size, square_size))
+            atlas.blit(sprite, (i * square_size, 0))
+        return atlas
+
+    def _read_cache(self, square_size):
+        width, height = square_size * len(PIECES), square_size
+        try:
+            with open(self._cache_path(square_size), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) != width * height * 4:
+            return None
+        return _from_bytes(data, (width, height), "RGBA")
+
+    def _write_cache(self, square_size, atlas):
+        # Best effort: a read-only checkout just rebuilds every start
+        path = self._cache_path(square_size)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for name in os.listdir(self.cache_dir):
+                if name.startswith("atlas-") and not name.endswith(f"-{self.digest}.rgba"):
+                    os.remove(os.path.join(self.cache_dir, name))
+            with open(path + ".tmp", "wb") as f:
+                f.write(_to_bytes(atlas, "RGBA"))
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+    def load(self, square_size):
+        # {piece: sprite} for one square size, each sprite a view into the atlas
+        atlas = self._read_cache(square_size)
+        if atlas is None:
+            atlas = self._build(square_size)
+            self._write_cache(square_size, atlas)
+        if pygame.display.get_surface() is not None:
+            atlas = atlas.convert_alpha()  # match the display format so blits need no conversion
+        self.surface = atlas
+        self.square_size = square_size
+        return {piece: atlas.subsurface((i * square_size, 0, square_size, square_size))
+                for i, piece in enumerate(PIECES)}
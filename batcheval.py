@@ -0,0 +1,289 @@
+# Vectorized evaluation of many boards at once (needs NumPy)
+#
+#   python batcheval.py games.qcg [--every 1]      score every ply of an archive
+#   python batcheval.py --bench 4096               boards/s against evaluation.evaluate
+#
+# Boards are an (N, 64) int8 array of piece indices, -1 for empty squares,
+# which is Position.squares stacked. Every term is computed for all N boards
+# with array operations, no Python loop over boards or pieces:
+#
+#   material + piece-square tables   the score of evaluation.evaluate,
+#                                    tapered by game phase
+#   mobility                         squares each knight, bishop, rook and
+#                                    queen attacks that its own side does not
+#                                    occupy, slider rays cut at the first piece
+#   king safety                      a bonus per pawn shielding the king and a
+#                                    penalty per enemy piece near it, scaled by
+#                                    the enemy's remaining non-pawn material
+#
+# Scores are centipawns from the side to move's point of view, like
+# evaluation.evaluate. montecarlo.py scores its collapse samples here.
+
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+from bitboard import BISHOP, KING, KNIGHT, PAWN, QUEEN, ROOK
+from evaluation import EG_SCORES, MG_SCORES, PIECE_PHASE, PIECE_VALUES, TOTAL_PHASE, evaluate
+from gamefile import COLLAPSE, SPLIT, GameFile, apply_words
+from notation import START_FEN, parse_fen
+from quantum import QuantumState
+
+# MG_TABLE/EG_TABLE[index, sq] from White's side and PHASE_TABLE[index]; the
+# extra last entry is for empty squares, which index it as -1
+MG_TABLE = np.zeros((13, 64), dtype=np.int32)
+MG_TABLE[:12] = np.reshape(MG_SCORES, (12, 64))
+EG_TABLE = np.zeros((13, 64), dtype=np.int32)
+EG_TABLE[:12] = np.reshape(EG_SCORES, (12, 64))
+PHASE_TABLE = np.array(PIECE_PHASE + [0], dtype=np.int32)
+SQUARE_INDEX = np.arange(64)
+
+MOBILITY_WEIGHTS = [0] * 6
+MOBILITY_WEIGHTS[KNIGHT] = 4
+MOBILITY_WEIGHTS[BISHOP] = 5
+MOBILITY_WEIGHTS[ROOK] = 2
+MOBILITY_WEIGHTS[QUEEN] = 1
+
+SHIELD_BONUS = 12        # per own pawn in front of the king
+ATTACKER_WEIGHTS = [0] * 6
+ATTACKER_WEIGHTS[KNIGHT] = 2
+ATTACKER_WEIGHTS[BISHOP] = 2
+ATTACKER_WEIGHTS[ROOK] = 3
+ATTACKER_WEIGHTS[QUEEN] = 5
+ATTACKER_PENALTY = 8     # per attacker weight unit within two squares of the king
+FULL_MATERIAL = 2 * PIECE_VALUES[KNIGHT] + 2 * PIECE_VALUES[BISHOP] + 2 * PIECE_VALUES[ROOK] + PIECE_VALUES[QUEEN]
+
+
+# Bitboard shifts as (shift, mask of squares a shift may land on). Square 0
+# is a8, so north is a right shift by 8 and east a left shift by 1.
+_FILE_A = sum(1 << sq for sq in range(0, 64, 8))
+_FILE_H = _FILE_A << 7
+_ALL = (1 << 64) - 1
+NORTH, SOUTH = (-8, _ALL), (8, _ALL)
+EAST, WEST = (1, _ALL ^ _FILE_A), (-1, _ALL ^ _FILE_H)
+NORTH_EAST, NORTH_WEST = (-7, _ALL ^ _FILE_A), (-9, _ALL ^ _FILE_H)
+SOUTH_EAST, SOUTH_WEST = (9, _ALL ^ _FILE_A), (7, _ALL ^ _FILE_H)
+DIAGONALS = (NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST)
+STRAIGHTS = (NORTH, SOUTH, EAST, WEST)
+# Knight jumps as (shift, mask)
+_FILES_AB = _FILE_A | _FILE_A << 1
+_FILES_GH = _FILE_H | _FILE_H >> 1
+KNIGHT_JUMPS = [(-15, _ALL ^ _FILE_A), (-17, _ALL ^ _FILE_H), (15, _ALL ^ _FILE_H), (17, _ALL ^ _FILE_A),
+                (-6, _ALL ^ _FILES_AB), (-10, _ALL ^ _FILES_GH), (10, _ALL ^ _FILES_AB), (6, _ALL ^ _FILES_GH)]
+
+
+def _shift(bitboards, shift):
+    if shift > 0:
+        return bitboards << np.uint64(shift)
+    return bitboards >> np.uint64(-shift)
+
+
+def _slide(sliders, empty, direction):
+    # Squares attacked along one direction by every slider in sliders,
+    # stopping at (and including) the first occupied square: a Kogge-Stone
+    # fill, three shifts for up to seven steps
+    shift, mask = direction
+    mask = np.uint64(mask)
+    open_squares = empty & mask
+    sliders = sliders | (open_squares & _shift(sliders, shift))
+    open_squares = open_squares & _shift(open_squares, shift)
+    sliders = sliders | (open_squares & _shift(sliders, 2 * shift))
+    open_squares = open_squares & _shift(open_squares, 2 * shift)
+    sliders = sliders | (open_squares & _shift(sliders, 4 * shift))
+    return _shift(sliders, shift) & mask
+
+
+if hasattr(np, "bitwise_count"):
+    popcount = np.bitwise_count
+else:
+    _BYTE_COUNTS = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+    def popcount(bitboards):
+        return _BYTE_COUNTS[bitboards[..., None].view(np.uint8)].sum(axis=-1)
+
+
+def _chebyshev(a, b):
+    return max(abs(a // 8 - b // 8), abs(a % 8 - b % 8))
+
+
+# KING_ZONE[sq]: squares within two of a king on sq
+KING_ZONE = np.array([sum(1 << to for to in range(64) if _chebyshev(sq, to) <= 2) for sq in range(64)],
+                     dtype=np.uint64)
+# SHIELD[color, sq]: the three squares in front of a king of color on sq
+SHIELD = np.array([[sum(1 << to for to in range(64) if to // 8 == sq // 8 + ahead and abs(to % 8 - sq % 8) <= 1)
+                    for sq in range(64)] for ahead in (-1, 1)], dtype=np.uint64)
+# Non-pawn material per piece kind
+PIECE_MATERIAL = np.array([0 if kind in (PAWN, KING) else PIECE_VALUES[kind] for kind in range(6)], dtype=np.int32)
+
+
+def pack(positions):
+    # (N, 64) int8 boards and (N,) turns of a sequence of Positions
+    positions = list(positions)
+    boards = np.frombuffer(b"".join(position.squares.tobytes() for position in positions), dtype=np.int8)
+    return boards.reshape(len(positions), 64), np.array([position.turn for position in positions], dtype=np.int8)
+
+
+def material(boards):
+    # Tapered material plus piece-square score from White's side
+    mg = MG_TABLE[boards, SQUARE_INDEX].sum(axis=1)
+    eg = EG_TABLE[boards, SQUARE_INDEX].sum(axis=1)
+    phase = np.minimum(PHASE_TABLE[boards].sum(axis=1), TOTAL_PHASE)
+    return (mg * phase + eg * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+
+
+def bitboards(boards):
+    # (N, 12) uint64 bitboards per piece index, bit sq set for a piece on sq
+    one_hot = boards[:, None, :] == np.arange(12, dtype=np.int8)[None, :, None]
+    packed = np.packbits(one_hot, axis=2, bitorder="little")
+    return packed.view("<u8")[:, :, 0].astype(np.uint64)
+
+
+def mobility(boards, pieces=None):
+    # Weighted count of the squares each side's knights, bishops, rooks and
+    # queens attack that are not held by that side, from White's side. Each
+    # kind counts a square once, however many of its pieces attack it.
+    # pieces is bitboards(boards) when the caller has it already.
+    if pieces is None:
+        pieces = bitboards(boards)
+    sides = [np.bitwise_or.reduce(pieces[:, color * 6:color * 6 + 6], axis=1) for color in (0, 1)]
+    empty = ~(sides[0] | sides[1])
+    scores = np.zeros(len(boards), dtype=np.int32)
+    for color, sign in ((0, 1), (1, -1)):
+        base = color * 6
+        free = ~sides[color]
+        knights = pieces[:, base + KNIGHT]
+        attacks = np.zeros(len(boards), dtype=np.uint64)
+        for shift, mask in KNIGHT_JUMPS:
+            attacks |= _shift(knights, shift) & np.uint64(mask)
+        scores += sign * MOBILITY_WEIGHTS[KNIGHT] * popcount(attacks & free).astype(np.int32)
+        queens = pieces[:, base + QUEEN]
+        for kind, directions in ((BISHOP, DIAGONALS), (ROOK, STRAIGHTS)):
+            own = pieces[:, base + kind]
+            attacks = np.zeros(len(boards), dtype=np.uint64)
+            queen_attacks = np.zeros(len(boards), dtype=np.uint64)
+            for direction in directions:
+                attacks |= _slide(own, empty, direction)
+                queen_attacks |= _slide(queens, empty, direction)
+            scores += sign * MOBILITY_WEIGHTS[kind] * popcount(attacks & free).astype(np.int32)
+            scores += sign * MOBILITY_WEIGHTS[QUEEN] * popcount(queen_attacks & free).astype(np.int32)
+    return scores
+
+
+def king_safety(boards, pieces=None):
+    # Shield bonus minus nearby attackers for both kings, from White's side,
+    # each scaled by how much non-pawn material the other side has left.
+    # Boards missing a king (quantum captures) score 0 for that side.
+    if pieces is None:
+        pieces = bitboards(boards)
+    counts = popcount(pieces).astype(np.int32)                 # (N, 12)
+    score = np.zeros(len(boards), dtype=np.float64)
+    for color, sign in ((0, 1), (1, -1)):
+        kings = boards == color * 6 + KING
+        king_sq = kings.argmax(axis=1)
+        shield = popcount(SHIELD[color][king_sq] & pieces[:, color * 6 + PAWN]).astype(np.int32)
+        enemy = (color ^ 1) * 6
+        zone = KING_ZONE[king_sq]
+        attackers = sum(ATTACKER_WEIGHTS[kind] * popcount(zone & pieces[:, enemy + kind]).astype(np.int32)
+                        for kind in (KNIGHT, BISHOP, ROOK, QUEEN))
+        phase = np.minimum(counts[:, enemy:enemy + 6] @ PIECE_MATERIAL, FULL_MATERIAL) / FULL_MATERIAL
+        score += sign * kings.any(axis=1) * phase * (SHIELD_BONUS * shield - ATTACKER_PENALTY * attackers)
+    return np.rint(score).astype(np.int32)
+
+
+def evaluate_boards(boards, turn):
+    # Score of every board for its side to move; turn is a scalar or (N,)
+    pieces = bitboards(boards)
+    scores = material(boards) + mobility(boards, pieces) + king_safety(boards, pieces)
+    return np.where(np.asarray(turn) == 1, -scores, scores)
+
+
+# Archives
+
+def archive_scores(path, every=1):
+    # (game number, result, scores from White's side at the start and after
+    # every `every` plies) for each game in a .qcg archive. Quantum games are
+    # scored on their classical board.
+    with GameFile(path) as games:
+        for number, game in enumerate(games):
+            position = parse_fen(game.fen)
+            state = QuantumState()
+            boards = [position.squares.tobytes()]
+            for ply, (start, end) in enumerate(_plies(game.words), 1):
+                apply_words(position, state, game.words[start:end])
+                if ply % every == 0:
+                    boards.append(position.squares.tobytes())
+            boards = np.frombuffer(b"".join(boards), dtype=np.int8).reshape(len(boards), 64)
+            yield number, game.result, evaluate_boards(boards, 0)
+
+
+def _plies(words):
+    # (start, end) word ranges of successive plies: any quantum events, then
+    # the move or NULL_MOVE that ends the turn
+    start = i = 0
+    while i < len(words):
+        word = words[i]
+        i += 1
+        if word >> 12 == SPLIT:
+            i += (word >> 6) & 63
+        elif word >> 12 != COLLAPSE:
+            yield start, i
+            start = i
+
+
+def bench(count, seed=0):
+    # Random playouts from the start, scored one at a time and in one batch
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        position = parse_fen(START_FEN)
+        for _ in range(rng.randrange(1, 80)):
+            moves = position.legal_moves()
+            if not moves:
+                break
+            position.make_move(rng.choice(moves))
+        positions.append(position.copy())
+
+    start = time.perf_counter()
+    single = [evaluate(position) for position in positions]
+    single_time = time.perf_counter() - start
+    start = time.perf_counter()
+    boards, turns = pack(positions)
+    packed_time = time.perf_counter() - start
+    start = time.perf_counter()
+    base = np.where(turns == 1, -material(boards), material(boards))
+    material_time = time.perf_counter() - start
+    start = time.perf_counter()
+    evaluate_boards(boards, turns)
+    full_time = time.perf_counter() - start
+    assert list(base) == single, "material terms differ from evaluation.evaluate"
+    print(f"{count} boards: evaluate() {count / single_time:,.0f}/s, pack {count / packed_time:,.0f}/s, "
+          f"material+PST {count / material_time:,.0f}/s, all terms {count / full_time:,.0f}/s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score many boards at once")
+    parser.add_argument("archive", nargs="?", help="a .qcg game archive (see gamefile.py)")
+    parser.add_argument("--every", type=int, default=1, help="score every n-th ply")
+    parser.add_argument("--bench", type=int, metavar="BOARDS")
+    args = parser.parse_args(argv)
+    if args.bench:
+        bench(args.bench)
+        return 0
+    if not args.archive:
+        parser.error("an archive or --bench is needed")
+    start = time.perf_counter()
+    boards = 0
+    for number, result, scores in archive_scores(args.archive, args.every):
+        boards += len(scores)
+        print(f"{number:6} {result:8} {len(scores):4} boards  final {scores[-1]:+6}  "
+              f"min {scores.min():+6}  max {scores.max():+6}")
+    elapsed = time.perf_counter() - start
+    print(f"{boards} boards in {elapsed:.2f}s, {boards / elapsed:,.0f}/s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,465 @@
+# Bitboard move generation shared by Chess.py and QuantamChess.py
+#
+# Squares are numbered row * 8 + col, matching the board grid, so square 0 is
+# the top-left corner as drawn (a8) and square 63 is the bottom-right (h1).
+# Every piece type of every color gets one 64-bit int with a bit set for each
+# square it stands on.
+
+PIECES = ["wp", "wr", "wn", "wb", "wq", "wk", "bp", "br", "bn", "bb", "bq", "bk"]
+PIECE_INDEX = {piece: i for i, piece in enumerate(PIECES)}
+COLOR_INDEX = {'w': 0, 'b': 1}
+# Offsets into PIECES; black pieces are the same offsets plus 6
+PAWN, ROOK, KNIGHT, BISHOP, QUEEN, KING = range(6)
+
+ROWS, COLS = 8, 8
+
+# (row, col) for every square, used to turn bitboards back into move lists
+SQUARE_COORDS = [(sq // COLS, sq % COLS) for sq in range(64)]
+
+
+def bit(row, col):
+    return 1 << (row * COLS + col)
+
+
+def lsb_index(bb):
+    return (bb & -bb).bit_length() - 1
+
+
+def msb_index(bb):
+    return bb.bit_length() - 1
+
+
+def iter_squares(bb):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def bitboard_to_coords(bb):
+    moves = []
+    while bb:
+        low = bb & -bb
+        moves.append(SQUARE_COORDS[low.bit_length() - 1])
+        bb ^= low
+    return moves
+
+
+# Precomputed leaper attack tables
+
+def _leaper_table(deltas):
+    table = []
+    for sq in range(64):
+        row, col = SQUARE_COORDS[sq]
+        attacks = 0
+        for dr, dc in deltas:
+            r, c = row + dr, col + dc
+            if 0 <= r < ROWS and 0 <= c < COLS:
+                attacks |= bit(r, c)
+        table.append(attacks)
+    return table
+
+
+KNIGHT_ATTACKS = _leaper_table([(-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2)])
+KING_ATTACKS = _leaper_table([(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)])
+# White pawns move up the board (towards row 0), black pawns move down
+PAWN_ATTACKS = [_leaper_table([(-1, -1), (-1, 1)]), _leaper_table([(1, -1), (1, 1)])]
+
+
+# Slider rays. Directions that increase the square index find their first
+# blocker with the lowest set bit, the others with the highest set bit.
+
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+
+def _ray_table(dr, dc):
+    table = []
+    for sq in range(64):
+        row, col = SQUARE_COORDS[sq]
+        ray = 0
+        r, c = row + dr, col + dc
+        while 0 <= r < ROWS and 0 <= c < COLS:
+            ray |= bit(r, c)
+            r += dr
+            c += dc
+        table.append(ray)
+    return table
+
+
+def _is_positive(dr, dc):
+    return dr * COLS + dc > 0
+
+
+ROOK_RAYS = [(_ray_table(dr, dc), _is_positive(dr, dc)) for dr, dc in ROOK_DIRECTIONS]
+BISHOP_RAYS = [(_ray_table(dr, dc), _is_positive(dr, dc)) for dr, dc in BISHOP_DIRECTIONS]
+
+
+def _ray_attacks(rays, sq, occupied):
+    attacks = 0
+    for table, positive in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if positive:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= table[blocker]
+        attacks |= ray
+    return attacks
+
+
+# BETWEEN[a][b]: squares strictly between a and b when they share a rank,
+# file or diagonal, otherwise 0. Used for check blocks and pin rays.
+
+def _between_table():
+    table = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        row, col = SQUARE_COORDS[sq]
+        for dr, dc in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            between = 0
+            r, c = row + dr, col + dc
+            while 0 <= r < ROWS and 0 <= c < COLS:
+                table[sq][r * COLS + c] = between
+                between |= bit(r, c)
+                r += dr
+                c += dc
+    return table
+
+
+BETWEEN = _between_table()
+
+
+# Magic-style lookups: the attack set of a slider only depends on the
+# occupancy of its rays minus the last square of each ray, so that masked
+# occupancy is used directly as a dict key. Tables fill lazily from the ray
+# walk above and hold at most 102400 rook and 5248 bishop entries.
+
+def _relevant_mask(rays, sq):
+    mask = 0
+    for table, positive in rays:
+        ray = table[sq]
+        if ray:
+            last = ray.bit_length() - 1 if positive else (ray & -ray).bit_length() - 1
+            mask |= ray ^ (1 << last)
+    return mask
+
+
+ROOK_MASKS = [_relevant_mask(ROOK_RAYS, sq) for sq in range(64)]
+BISHOP_MASKS = [_relevant_mask(BISHOP_RAYS, sq) for sq in range(64)]
+_ROOK_TABLES = [{} for _ in range(64)]
+_BISHOP_TABLES = [{} for _ in range(64)]
+
+
+def rook_attacks(sq, occupied):
+    key = occupied & ROOK_MASKS[sq]
+    attacks = _ROOK_TABLES[sq].get(key)
+    if attacks is None:
+        attacks = _ROOK_TABLES[sq][key] = _ray_attacks(ROOK_RAYS, sq, key)
+    return attacks
+
+
+def bishop_attacks(sq, occupied):
+    key = occupied & BISHOP_MASKS[sq]
+    attacks = _BISHOP_TABLES[sq].get(key)
+    if attacks is None:
+        attacks = _BISHOP_TABLES[sq][key] = _ray_attacks(BISHOP_RAYS, sq, key)
+    return attacks
+
+
+def queen_attacks(sq, occupied):
+    return rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+
+
+class Bitboards:
+    __slots__ = ("pieces", "occupied", "occupancy")
+
+    def __init__(self):
+        self.pieces = [0] * len(PIECES)
+        self.occupied = [0, 0]  # white, black
+        self.occupancy = 0
+
+    @classmethod
+    def from_grid(cls, grid):
+        bitboards = cls()
+        for row in range(ROWS):
+            for col in range(COLS):
+                if grid[row][col] != "":
+                    bitboards.put(row * COLS + col, grid[row][col])
+        return bitboards
+
+    def put(self, sq, piece):
+        mask = 1 << sq
+        self.pieces[PIECE_INDEX[piece]] |= mask
+        self.occupied[COLOR_INDEX[piece[0]]] |= mask
+        self.occupancy |= mask
+
+    def remove(self, sq, piece):
+        mask = ~(1 << sq)
+        self.pieces[PIECE_INDEX[piece]] &= mask
+        self.occupied[COLOR_INDEX[piece[0]]] &= mask
+        self.occupancy &= mask
+
+    def piece_at(self, sq):
+        mask = 1 << sq
+        if self.occupancy & mask:
+            for index, pieces in enumerate(self.pieces):
+                if pieces & mask:
+                    return PIECES[index]
+        return ""
+
+    def king_square(self, color):
+        # The king bitboard is the tracked king location; with duplicate kings
+        # (quantum copies) the first one in row-major order is returned
+        kings = self.pieces[color * 6 + KING]
+        if not kings:
+            return None
+        return (kings & -kings).bit_length() - 1
+
+
+def pawn_pushes(color, sq, occupancy):
+    if color == 0:
+        if sq < 8:
+            return 0
+        one = 1 << (sq - 8)
+        if one & occupancy:
+            return 0
+        if 48 <= sq < 56 and not (1 << (sq - 16)) & occupancy:
+            return one | (1 << (sq - 16))
+        return one
+    if sq >= 56:
+        return 0
+    one = 1 << (sq + 8)
+    if one & occupancy:
+        return 0
+    if 8 <= sq < 16 and not (1 << (sq + 16)) & occupancy:
+        return one | (1 << (sq + 16))
+    return one
+
+
+def _pawn_moves(bitboards, color, sq):
+    return pawn_pushes(color, sq, bitboards.occupancy) | (PAWN_ATTACKS[color][sq] & bitboards.occupied[color ^ 1])
+
+
+def _knight_moves(bitboards, color, sq):
+    return KNIGHT_ATTACKS[sq] & ~bitboards.occupied[color]
+
+
+def _bishop_moves(bitboards, color, sq):
+    return bishop_attacks(sq, bitboards.occupancy) & ~bitboards.occupied[color]
+
+
+def _rook_moves(bitboards, color, sq):
+    return rook_attacks(sq, bitboards.occupancy) & ~bitboards.occupied[color]
+
+
+def _queen_moves(bitboards, color, sq):
+    occupancy = bitboards.occupancy
+    return (rook_attacks(sq, occupancy) | bishop_attacks(sq, occupancy)) & ~bitboards.occupied[color]
+
+
+def _king_moves(bitboards, color, sq):
+    return KING_ATTACKS[sq] & ~bitboards.occupied[color]
+
+
+# piece -> (generator, color index), so dispatch is a single dict lookup
+_MOVE_GENERATORS = {}
+for _piece in PIECES:
+    _MOVE_GENERATORS[_piece] = ({
+        'p': _pawn_moves, 'n': _knight_moves, 'b': _bishop_moves,
+        'r': _rook_moves, 'q': _queen_moves, 'k': _king_moves,
+    }[_piece[1]], COLOR_INDEX[_piece[0]])
+
+
+def piece_moves(bitboards, piece, sq):
+    # Pseudo-legal destinations for piece on sq, as a bitboard
+    generator, color = _MOVE_GENERATORS[piece]
+    return generator(bitboards, color, sq)
+
+
+# Attack queries. Every test is cast outward from the target square: a square
+# is attacked by a knight if a knight stands a knight's jump away, by a rook
+# or queen if one is the first blocker on a rook ray, and so on.
+
+def attackers_to(bitboards, sq, by_color):
+    pieces = bitboards.pieces
+    base = by_color * 6
+    occupancy = bitboards.occupancy
+    attackers = (PAWN_ATTACKS[by_color ^ 1][sq] & pieces[base + PAWN]) \
+        | (KNIGHT_ATTACKS[sq] & pieces[base + KNIGHT]) \
+        | (KING_ATTACKS[sq] & pieces[base + KING])
+    rooks = pieces[base + ROOK] | pieces[base + QUEEN]
+    if rooks:
+        attackers |= rook_attacks(sq, occupancy) & rooks
+    bishops = pieces[base + BISHOP] | pieces[base + QUEEN]
+    if bishops:
+        attackers |= bishop_attacks(sq, occupancy) & bishops
+    return attackers
+
+
+def is_square_attacked(bitboards, sq, by_color, occupancy=None):
+    # occupancy can be overridden, e.g. to look through a king that is moving
+    if occupancy is None:
+        occupancy = bitboards.occupancy
+    pieces = bitboards.pieces
+    base = by_color * 6
+    if KNIGHT_ATTACKS[sq] & pieces[base + KNIGHT]:
+        return True
+    if PAWN_ATTACKS[by_color ^ 1][sq] & pieces[base + PAWN]:
+        return True
+    if KING_ATTACKS[sq] & pieces[base + KING]:
+        return True
+    rooks = pieces[base + ROOK] | pieces[base + QUEEN]
+    if rooks and rook_attacks(sq, occupancy) & rooks:
+        return True
+    bishops = pieces[base + BISHOP] | pieces[base + QUEEN]
+    if bishops and bishop_attacks(sq, occupancy) & bishops:
+        return True
+    return False
+
+
+def is_king_attacked(bitboards, color):
+    king_sq = bitboards.king_square(color)
+    if king_sq is None:
+        return False
+    return is_square_attacked(bitboards, king_sq, color ^ 1)
+
+
+# Legal move generation. Checkers and pins are worked out once per position:
+# in check, non-king moves must capture the checker or block its ray (and
+# only the king may move out of a double check); a pinned piece may only
+# move along the ray between its king and the pinner.
+
+def _pins(bitboards, color, king_sq):
+    pieces = bitboards.pieces
+    them = (color ^ 1) * 6
+    own = bitboards.occupied[color]
+    occupancy = bitboards.occupancy
+    pins = {}
+    snipers = (rook_attacks(king_sq, 0) & (pieces[them + ROOK] | pieces[them + QUEEN])) \
+        | (bishop_attacks(king_sq, 0) & (pieces[them + BISHOP] | pieces[them + QUEEN]))
+    while snipers:
+        low = snipers & -snipers
+        snipers ^= low
+        sniper = low.bit_length() - 1
+        between = BETWEEN[king_sq][sniper] & occupancy
+        if between and not between & (between - 1) and between & own:
+            pins[between.bit_length() - 1] = BETWEEN[king_sq][sniper] | low
+    return pins
+
+
+def _legal_context(bitboards, color):
+    # (king square, mask non-king moves must land in, pins), or None when
+    # the side has no single king and moves have to be tried one by one
+    kings = bitboards.pieces[color * 6 + KING]
+    if not kings or kings & (kings - 1):
+        return None
+    king_sq = kings.bit_length() - 1
+    checkers = attackers_to(bitboards, king_sq, color ^ 1)
+    if not checkers:
+        target = -1
+    elif checkers & (checkers - 1):
+        target = 0
+    else:
+        target = checkers | BETWEEN[king_sq][checkers.bit_length() - 1]
+    return king_sq, target, _pins(bitboards, color, king_sq)
+
+
+def _king_destinations(bitboards, color, king_sq):
+    destinations = KING_ATTACKS[king_sq] & ~bitboards.occupied[color]
+    occupancy = bitboards.occupancy ^ (1 << king_sq)
+    legal = 0
+    while destinations:
+        low = destinations & -destinations
+        destinations ^= low
+        if not is_square_attacked(bitboards, low.bit_length() - 1, color ^ 1, occupancy):
+            legal |= low
+    return legal
+
+
+def _leaves_king_safe(bitboards, piece, sq, to_sq):
+    # Slow path: play the move on the bitboards and look for check
+    color = COLOR_INDEX[piece[0]]
+    captured = bitboards.piece_at(to_sq)
+    if captured:
+        bitboards.remove(to_sq, captured)
+    bitboards.remove(sq, piece)
+    bitboards.put(to_sq, piece)
+    safe = not is_king_attacked(bitboards, color)
+    bitboards.remove(to_sq, piece)
+    bitboards.put(sq, piece)
+    if captured:
+        bitboards.put(to_sq, captured)
+    return safe
+
+
+def _filter_by_trial(bitboards, piece, sq, destinations):
+    legal = 0
+    while destinations:
+        low = destinations & -destinations
+        destinations ^= low
+        if _leaves_king_safe(bitboards, piece, sq, low.bit_length() - 1):
+            legal |= low
+    return legal
+
+
+def _legal_destinations(bitboards, piece, sq, context):
+    king_sq, target, pins = context
+    if sq == king_sq:
+        return _king_destinations(bitboards, COLOR_INDEX[piece[0]], king_sq)
+    if not target:
+        return 0
+    return piece_moves(bitboards, piece, sq) & target & pins.get(sq, -1)
+
+
+def legal_piece_moves(bitboards, piece, sq):
+    # Legal destinations for piece on sq, as a bitboard
+    color = COLOR_INDEX[piece[0]]
+    context = _legal_context(bitboards, color)
+    if context is None:
+        return _filter_by_trial(bitboards, piece, sq, piece_moves(bitboards, piece, sq))
+    return _legal_destinations(bitboards, piece, sq, context)
+
+
+def _own_pieces(bitboards, color):
+    base = color * 6
+    for index in range(base, base + 6):
+        pieces = bitboards.pieces[index]
+        while pieces:
+            low = pieces & -pieces
+            pieces ^= low
+            yield PIECES[index], low.bit_length() - 1
+
+
+def legal_moves(bitboards, color):
+    # [(from square, destination bitboard), ...] for every piece that can move
+    context = _legal_context(bitboards, color)
+    moves = []
+    for piece, sq in _own_pieces(bitboards, color):
+        if context is None:
+            destinations = _filter_by_trial(bitboards, piece, sq, piece_moves(bitboards, piece, sq))
+        else:
+            destinations = _legal_destinations(bitboards, piece, sq, context)
+        if destinations:
+            moves.append((sq, destinations))
+    return moves
+
+
+def has_any_legal_move(bitboards, color):
+    context = _legal_context(bitboards, color)
+    if context is None:
+        for piece, sq in _own_pieces(bitboards, color):
+            if _filter_by_trial(bitboards, piece, sq, piece_moves(bitboards, piece, sq)):
+                return True
+        return False
+    # The king first: it is the only piece that can answer a double check
+    king_sq = context[0]
+    if _king_destinations(bitboards, color, king_sq):
+        return True
+    if not context[1]:
+        return False
+    for piece, sq in _own_pieces(bitboards, color):
+        if sq != king_sq and _legal_destinations(bitboards, piece, sq, context):
+            return True
+    return False
@@ -0,0 +1,256 @@
+# Opening book: position hash -> weighted moves, memory-mapped
+#
+#   python book.py build games.pgn [more.pgn|.qcg|.jsonl ...] -o book.bin --plies 20 --min-count 2
+#   python book.py merge a.bin b.bin -o book.bin
+#   python book.py probe book.bin ["<FEN>"]
+#
+# The file is a 16-byte header (magic "QCB1", version u16, reserved u16,
+# entry count u32, reserved u32) and then the entries, sorted by key and
+# then move, stored column by column: every Zobrist key (u64), every move
+# (u16), every weight (u16), little-endian. Book maps the file and bisects
+# the key column in place, so opening a book costs nothing and a probe reads
+# about log2(entries) keys. Building and merging stream the entries; only
+# the move and weight columns of the book being written are buffered.
+#
+# Keys are Position.hash, which covers the classical board only; callers skip
+# the book while quantum ghosts are on the board.
+
+import argparse
+import bisect
+import heapq
+import mmap
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+
+from gamefile import COLLAPSE, GameFile, SPLIT, pgn_records, selfplay_records
+from notation import START_FEN, parse_fen
+from position import NULL_MOVE, move_to_uci
+
+MAGIC = b"QCB1"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+ENTRY_SIZE = 12
+MAX_WEIGHT = 0xFFFF
+
+_SWAP = sys.byteorder != "little"
+
+DEFAULT_BOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")
+
+
+class Book:
+    def __init__(self, path):
+        self.keys = self.moves = self.weights = None
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            self.file.close()
+            raise ValueError(f"{path} is not an opening book")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.count, _ = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION or size != HEADER.size + self.count * ENTRY_SIZE:
+            self.close()
+            raise ValueError(f"{path} is not an opening book")
+        view = memoryview(self.map)
+        moves_at = HEADER.size + self.count * 8
+        self.keys = view[HEADER.size:moves_at].cast('Q')
+        self.moves = view[moves_at:moves_at + self.count * 2].cast('H')
+        self.weights = view[moves_at + self.count * 2:].cast('H')
+        if _SWAP:
+            self.keys, self.moves, self.weights = (_swapped(array(code, column))
+                                                   for code, column in zip("QHH", (self.keys, self.moves, self.weights)))
+        view.release()
+
+    def __len__(self):
+        return self.count
+
+    def probe(self, key):
+        # [(move, weight)] stored for key, in move order
+        keys = self.keys
+        i = bisect.bisect_left(keys, key)
+        end = i
+        while end < self.count and keys[end] == key:
+            end += 1
+        return list(zip(self.moves[i:end], self.weights[i:end]))
+
+    def choose(self, position, rng=random):
+        # A book move for position picked with probability proportional to
+        # its weight, or None when the position is not in the book. Moves
+        # whose source square does not hold a piece of the side to move
+        # (a hash collision) are skipped.
+        moves = [(move, weight) for move, weight in self.probe(position.hash)
+                 if weight and position.squares[move & 63] >= 0 and position.squares[move & 63] // 6 == position.turn]
+        if not moves:
+            return None
+        pick = rng.random() * sum(weight for _, weight in moves)
+        for move, weight in moves:
+            pick -= weight
+            if pick < 0:
+                return move
+        return moves[-1][0]
+
+    def entries(self):
+        # Every (key, move, weight) in file order
+        return zip(self.keys, self.moves, self.weights)
+
+    def close(self):
+        for column in (self.keys, self.moves, self.weights):
+            if isinstance(column, memoryview):
+                column.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _swapped(column):
+    column.byteswap()
+    return column
+
+
+def open_book(path=DEFAULT_BOOK):
+    # The book at path, or None if there is none
+    try:
+        return Book(path)
+    except (OSError, ValueError):
+        return None
+
+
+def write_book(path, entries):
+    # Write sorted (key, move, weight) entries; returns the entry count.
+    # The file is written under a temporary name and renamed into place.
+    temporary = path + ".tmp"
+    moves = array('H')
+    weights = array('H')
+    keys = array('Q')
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        for key, move, weight in entries:
+            keys.append(key)
+            moves.append(move)
+            weights.append(min(weight, MAX_WEIGHT))
+            if len(keys) == 4096:
+                f.write(_column(keys))
+                keys = array('Q')
+        f.write(_column(keys))
+        f.write(_column(moves))
+        f.write(_column(weights))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(moves), 0))
+    os.replace(temporary, path)
+    return len(moves)
+
+
+def _column(values):
+    if _SWAP:
+        values.byteswap()
+    return values.tobytes()
+
+
+def _records(path):
+    # (words, fen) for every game in a PGN, .qcg or selfplay.py JSONL file
+    if path.endswith(".qcg"):
+        with GameFile(path) as games:
+            for game in games:
+                yield game.words, game.fen
+    else:
+        records = selfplay_records(path) if path.endswith((".jsonl", ".json")) else pgn_records(path)
+        for words, _, fen, _ in records:
+            yield words, fen
+
+
+def count_moves(paths, plies=20):
+    # {(key, move): games} over the first plies moves of every game. A game
+    # is only followed up to its first quantum event.
+    counts = {}
+    for path in paths:
+        for words, fen in _records(path):
+            position = parse_fen(fen or START_FEN)
+            for move in words[:plies]:
+                if move >> 12 in (SPLIT, COLLAPSE) or move == NULL_MOVE:
+                    break
+                entry = (position.hash, move)
+                counts[entry] = counts.get(entry, 0) + 1
+                position.make_move(move)
+    return counts
+
+
+def build_book(path, sources, plies=20, min_count=1):
+    counts = count_moves(sources, plies)
+    return write_book(path, ((key, move, weight) for (key, move), weight in sorted(counts.items())
+                             if weight >= min_count))
+
+
+def merge_books(path, sources):
+    # Merge books into path, adding the weights of moves found in several;
+    # all of them are streamed, none is loaded whole
+    books = [Book(source) for source in sources]
+
+    def merged():
+        current = None
+        weight = 0
+        for key, move, entry_weight in heapq.merge(*(book.entries() for book in books)):
+            if (key, move) != current:
+                if current is not None:
+                    yield current + (weight,)
+                current = (key, move)
+                weight = 0
+            weight += entry_weight
+        if current is not None:
+            yield current + (weight,)
+
+    try:
+        return write_book(path, merged())
+    finally:
+        for book in books:
+            book.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build, merge and probe opening books")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from PGN, .qcg or selfplay JSONL games")
+    build.add_argument("sources", nargs="+")
+    build.add_argument("-o", "--out", default=DEFAULT_BOOK)
+    build.add_argument("--plies", type=int, default=20, help="book depth in plies")
+    build.add_argument("--min-count", type=int, default=1, help="drop moves played in fewer games")
+    merge = commands.add_parser("merge", help="merge books, adding weights")
+    merge.add_argument("sources", nargs="+")
+    merge.add_argument("-o", "--out", default=DEFAULT_BOOK)
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("fen", nargs="?", default=START_FEN)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.command == "build":
+        count = build_book(args.out, args.sources, args.plies, args.min_count)
+        print(f"{count} entries written to {args.out} in {time.perf_counter() - start:.2f}s")
+    elif args.command == "merge":
+        count = merge_books(args.out, args.sources)
+        print(f"{count} entries written to {args.out} in {time.perf_counter() - start:.2f}s")
+    else:
+        position = parse_fen(args.fen)
+        with Book(args.book) as book:
+            moves = book.probe(position.hash)
+            repeats = 10000
+            start = time.perf_counter()
+            for _ in range(repeats):
+                book.probe(position.hash)
+            elapsed = time.perf_counter() - start
+            total = sum(weight for _, weight in moves) or 1
+            for move, weight in sorted(moves, key=lambda entry: -entry[1]):
+                print(f"{move_to_uci(move):6} {weight:6} {100 * weight / total:5.1f}%")
+            print(f"{len(book)} entries, probe {elapsed / repeats * 1e6:.1f}us", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
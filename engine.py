@@ -0,0 +1,339 @@
+# Headless chess rules shared by Chess.py and QuantamChess.py
+#
+# Nothing here imports pygame, so the rules can be used from tests, worker
+# processes and servers. Colors may be given as 'w'/'b' or 'white'/'black'.
+#
+# The module-level functions play on one default Position, which is what the
+# pygame front ends use. Anything hosting several games (server.py) creates
+# a Game per game instead.
+#
+# Quantum mode: superposed pieces are kept off the Position in a sparse
+# QuantumState (quantum.py). Ghosts do not block or attack. A move may not
+# land on a friendly ghost, and pawns may not land on any ghost. Any other
+# move onto an enemy ghost measures that square first, capturing the piece
+# if it turns out to be there.
+
+from bitboard import (COLOR_INDEX, KING, PAWN, PIECES, SQUARE_COORDS, bitboard_to_coords, has_any_legal_move,
+                      is_king_attacked, piece_moves)
+from position import CASTLES, CASTLING_MASK, DOUBLE_PUSH, KING_CASTLE, NULL_MOVE, PROMOTION, QUEEN_CASTLE, Position
+from notation import parse_fen, to_fen
+from quantum import QuantumState
+
+ROWS, COLS = 8, 8
+
+START_BOARD = [
+    ["br", "bn", "bb", "bq", "bk", "bb", "bn", "br"],
+    ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
+    ["", "", "", "", "", "", "", ""],
+    ["", "", "", "", "", "", "", ""],
+    ["", "", "", "", "", "", "", ""],
+    ["", "", "", "", "", "", "", ""],
+    ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
+    ["wr", "wn", "wb", "wq", "wk", "wb", "wn", "wr"]
+]
+
+def new_position():
+    return Position.from_grid(START_BOARD)
+
+
+class Game:
+    # One game: a Position and the QuantumState of its superposed pieces.
+    # Squares are 0..63 (row * 8 + col). The module-level functions below
+    # wrap a Game over the default position.
+    __slots__ = ("position", "quantum")
+
+    def __init__(self, position=None, quantum=None):
+        self.position = new_position() if position is None else position
+        self.quantum = QuantumState() if quantum is None else quantum
+
+    def key(self):
+        # Zobrist key of the whole game state, superposed squares included
+        return self.position.hash ^ self.quantum.hash
+
+    def _quantum_allows(self, move):
+        position = self.position
+        quantum = self.quantum
+        to_sq = (move >> 6) & 63
+        flag = move >> 12
+        if flag == KING_CASTLE or flag == QUEEN_CASTLE:
+            return not any(sq in quantum for sq in CASTLES[position.turn][flag - KING_CASTLE][5])
+        if to_sq not in quantum:
+            return True
+        return quantum.index_at(to_sq) // 6 != position.turn and position.squares[move & 63] % 6 != PAWN
+
+    def allowed_moves(self):
+        # Legal moves of the side to move, less those the quantum rules forbid
+        moves = self.position.legal_moves()
+        if not self.quantum:
+            return moves
+        return [move for move in moves if self._quantum_allows(move)]
+
+    def has_moves(self, side):
+        # Whether side has anything to play. For the side to move that is an
+        # allowed move or a ghost to measure; splits need no check of their
+        # own, as a piece splits along quiet moves allowed_moves holds, or
+        # from a ghost.
+        position = self.position
+        if side != position.turn:
+            return has_any_legal_move(position, side)
+        if not self.quantum:
+            return position.has_legal_move()
+        return self.quantum.has_color(side) or bool(self.allowed_moves())
+
+    def play(self, from_sq, to_sq, promotion=3):
+        # Play from_sq -> to_sq if it is allowed; pawns promote to promotion
+        # (0..3 for n, b, r, q). A move onto an enemy ghost measures it first.
+        # Returns the move played, NULL_MOVE when the measurement cost the
+        # turn, or None when the move is not allowed.
+        position = self.position
+        moves = [move for move in self.allowed_moves() if move & 63 == from_sq and (move >> 6) & 63 == to_sq]
+        if not moves:
+            return None
+        if to_sq in self.quantum:
+            # The measurement changes the board, and with it the legal moves
+            self.quantum.resolve(position, to_sq)
+            moves = [move for move in position.legal_moves() if move & 63 == from_sq and (move >> 6) & 63 == to_sq]
+        chosen = None
+        for move in moves:
+            flag = move >> 12
+            if chosen is None or (flag & PROMOTION and flag & 3 == promotion):
+                chosen = move
+        if chosen is None:
+            # The measured piece made the move illegal (e.g. it blocks the way
+            # now); the attempt still costs the turn
+            position.make_null_move()
+            return NULL_MOVE
+        position.make_move(chosen)
+        return chosen
+
+    def split_targets(self, sq):
+        # Squares the piece on sq, classical or one of its ghosts, can split
+        # to: its quiet moves onto squares holding no other ghost. A split
+        # takes the piece off the board and ghosts block nothing, so a piece
+        # whose removal leaves its king attacked (pinned, or not the answer
+        # to a check) cannot split.
+        position = self.position
+        quantum = self.quantum
+        ghost = sq in quantum
+        index = quantum.index_at(sq) if ghost else position.squares[sq]
+        if index < 0 or index // 6 != position.turn or index % 6 == KING:
+            return []
+        if not ghost:
+            position.remove(sq, PIECES[index])
+            exposed = is_king_attacked(position, position.turn)
+            position.put(sq, PIECES[index])
+            if exposed:
+                return []
+        elif is_king_attacked(position, position.turn):
+            return []
+        if ghost:
+            position.put(sq, PIECES[index])  # look at the moves as if it were there
+        targets = set()
+        for move in position.legal_moves():
+            to_sq = (move >> 6) & 63
+            if move & 63 == sq and move >> 12 <= DOUBLE_PUSH:
+                if to_sq not in quantum or quantum.owner[to_sq] == quantum.owner.get(sq):
+                    targets.add(to_sq)
+        if ghost:
+            position.remove(sq, PIECES[index])
+        return sorted(targets)
+
+    def split(self, sq, targets):
+        # Put the piece on sq into an even superposition over targets.
+        # Splitting ends the turn. Callers check targets with split_targets.
+        position = self.position
+        if sq not in self.quantum:
+            position.set_castling(position.castling & CASTLING_MASK[sq])
+        self.quantum.split(position, sq, targets)
+        position.make_null_move()
+
+    def measure(self, sq):
+        # Measure the superposed piece with a ghost on sq: it lands on one of
+        # its squares with its probability. Measuring ends the turn. Returns
+        # where it landed, or None if there is no ghost of the side to move
+        # on sq.
+        if self.quantum.index_at(sq) // 6 != self.position.turn:
+            return None
+        sq = self.quantum.measure(self.position, self.quantum.owner[sq])
+        self.position.make_null_move()
+        return sq
+
+    def status(self):
+        return GameStatus(self)
+
+
+position = Position.from_grid(START_BOARD)
+
+quantum = QuantumState()  # superposed pieces, kept off the classical board
+
+
+def reset(seed=None):
+    # New game; seed makes quantum measurements repeatable
+    global position
+    position = new_position()
+    quantum.clear()
+    if seed is not None:
+        quantum.seed(seed)
+
+
+def load_fen(fen, seed=None):
+    # New game from a FEN string; raises ValueError for a malformed one.
+    # FEN has no notion of superposition, so the quantum state starts empty.
+    global position
+    position = parse_fen(fen)
+    quantum.clear()
+    if seed is not None:
+        quantum.seed(seed)
+
+
+def load_state(fen, ghosts):
+    # Board from a FEN string plus superposed pieces as [(piece index,
+    # {sq: probability})], e.g. a state sent by server.py
+    load_fen(fen)
+    for index, dist in ghosts:
+        quantum.add(index, dist)
+
+
+def fen():
+    # FEN of the classical board; superposed pieces are not in it
+    return to_fen(position)
+
+
+def position_key():
+    # Zobrist key of the whole game state, superposed squares included
+    return position.hash ^ quantum.hash
+
+
+def side_to_move():
+    return 'black' if position.turn else 'white'
+
+
+def piece_at(row, col):
+    return position.piece_at(row * COLS + col)
+
+
+def set_square(row, col, piece):
+    position.place(row * COLS + col, piece)
+
+
+def get_possible_moves(piece, row, col):
+    return bitboard_to_coords(piece_moves(position, piece, row * COLS + col))
+
+
+def allowed_moves():
+    # Legal moves of the side to move, less those the quantum rules forbid
+    return Game(position, quantum).allowed_moves()
+
+
+def legal_moves_from(row, col):
+    sq = row * COLS + col
+    return [move for move in allowed_moves() if move & 63 == sq]
+
+
+def get_legal_moves(piece, row, col):
+    if COLOR_INDEX[piece[0]] != position.turn:
+        return []
+    destinations = {(move >> 6) & 63 for move in legal_moves_from(row, col)}
+    return [SQUARE_COORDS[sq] for sq in sorted(destinations)]
+
+
+def _play(from_sq, to_sq, promotion=3):
+    return Game(position, quantum).play(from_sq, to_sq, promotion)
+
+
+def move_piece(from_pos, to_pos):
+    # Play the legal move from_pos -> to_pos; pawns promote to a queen
+    return _play(from_pos[0] * COLS + from_pos[1], to_pos[0] * COLS + to_pos[1])
+
+
+def play_move(move):
+    return _play(move & 63, (move >> 6) & 63, (move >> 12) & 3)
+
+
+def current_position():
+    # The default Position; copy it before handing it to another thread
+    return position
+
+
+def find_king(color):
+    king_sq = position.king_square(COLOR_INDEX[color[0]])
+    if king_sq is None:
+        return None
+    return SQUARE_COORDS[king_sq]
+
+
+def is_in_check(color):
+    return is_king_attacked(position, COLOR_INDEX[color[0]])
+
+
+def has_any_moves(color):
+    return Game(position, quantum).has_moves(COLOR_INDEX[color[0]])
+
+
+# Game status. The front ends ask for it every frame, but it only changes
+# when the position does, so it is cached against position_key().
+
+class GameStatus:
+    __slots__ = ("key", "kings", "checks", "winner", "stalemate")
+
+    def __init__(self, game):
+        position = game.position
+        self.key = game.key()
+        self.kings = [position.king_square(side) is not None for side in (0, 1)]
+        self.checks = [is_king_attacked(position, side) for side in (0, 1)]
+        self.winner = None      # 'w' or 'b'
+        self.stalemate = False
+        if not self.kings[0]:
+            self.winner = 'b'
+        elif not self.kings[1]:
+            self.winner = 'w'
+        elif self.checks[0] and not game.has_moves(0):
+            self.winner = 'b'
+        elif self.checks[1] and not game.has_moves(1):
+            self.winner = 'w'
+        elif not game.has_moves(position.turn):
+            self.stalemate = True
+
+    def in_check(self, color):
+        return self.checks[COLOR_INDEX[color[0]]]
+
+    def has_king(self, color):
+        return self.kings[COLOR_INDEX[color[0]]]
+
+
+_status = None
+
+
+def game_status():
+    global _status
+    if _status is None or _status.key != position_key():
+        _status = GameStatus(Game(position, quantum))
+    return _status
+
+
+# Quantum mode
+
+def quantum_squares():
+    # {(row, col): (piece, probability)} for every superposed square
+    return {SQUARE_COORDS[sq]: (PIECES[index], p) for sq, index, p in quantum.ghosts()}
+
+
+def split_targets(row, col):
+    # Squares the piece on (row, col), classical or one of its ghosts, can
+    # split to: its quiet moves onto squares holding no other ghost
+    return [SQUARE_COORDS[sq] for sq in Game(position, quantum).split_targets(row * COLS + col)]
+
+
+def split(from_pos, targets):
+    # Put the piece on from_pos into an even superposition over targets.
+    # Splitting ends the turn.
+    Game(position, quantum).split(from_pos[0] * COLS + from_pos[1], [row * COLS + col for row, col in targets])
+
+
+def measure(row, col):
+    # Measure the superposed piece with a ghost on (row, col): it lands on
+    # one of its squares with its probability. Measuring ends the turn.
+    # Returns where it landed, or None if there is no ghost of the side to
+    # move on (row, col).
+    sq = Game(position, quantum).measure(row * COLS + col)
+    return None if sq is None else SQUARE_COORDS[sq]
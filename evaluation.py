@@ -0,0 +1,184 @@
+# Static evaluation: material plus piece-square tables, tapered between
+# middlegame and endgame
+#
+# Scores are in centipawns from the side to move's point of view. The tables
+# are written from White's side with a8 first, which is exactly the square
+# numbering of the board, so White reads them directly and Black reads them
+# mirrored (sq ^ 56).
+#
+# Every term is a sum over pieces, so Position keeps the middlegame score,
+# the endgame score and the game phase up to date in _add/_clear, the same
+# way it keeps the Zobrist hash. evaluate() only blends the three, which
+# makes it O(1) per node. Set CHECK_INCREMENTAL (or QC_CHECK_EVAL=1 in the
+# environment) to compare them against a full recompute on every call.
+
+import os
+
+from bitboard import BISHOP, KING, KNIGHT, PAWN, QUEEN, ROOK
+
+PIECE_VALUES = [0] * 6
+PIECE_VALUES[PAWN] = 100
+PIECE_VALUES[KNIGHT] = 320
+PIECE_VALUES[BISHOP] = 330
+PIECE_VALUES[ROOK] = 500
+PIECE_VALUES[QUEEN] = 900
+PIECE_VALUES[KING] = 0
+
+PST = [None] * 6
+PST[PAWN] = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+     5,  5, 10, 25, 25, 10,  5,  5,
+     0,  0,  0, 20, 20,  0,  0,  0,
+     5, -5,-10,  0,  0,-10, -5,  5,
+     5, 10, 10,-20,-20, 10, 10,  5,
+     0,  0,  0,  0,  0,  0,  0,  0,
+]
+PST[KNIGHT] = [
+    -50,-40,-30,-30,-30,-30,-40,-50,
+    -40,-20,  0,  0,  0,  0,-20,-40,
+    -30,  0, 10, 15, 15, 10,  0,-30,
+    -30,  5, 15, 20, 20, 15,  5,-30,
+    -30,  0, 15, 20, 20, 15,  0,-30,
+    -30,  5, 10, 15, 15, 10,  5,-30,
+    -40,-20,  0,  5,  5,  0,-20,-40,
+    -50,-40,-30,-30,-30,-30,-40,-50,
+]
+PST[BISHOP] = [
+    -20,-10,-10,-10,-10,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5, 10, 10,  5,  0,-10,
+    -10,  5,  5, 10, 10,  5,  5,-10,
+    -10,  0, 10, 10, 10, 10,  0,-10,
+    -10, 10, 10, 10, 10, 10, 10,-10,
+    -10,  5,  0,  0,  0,  0,  5,-10,
+    -20,-10,-10,-10,-10,-10,-10,-20,
+]
+PST[ROOK] = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+     5, 10, 10, 10, 10, 10, 10,  5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+    -5,  0,  0,  0,  0,  0,  0, -5,
+     0,  0,  0,  5,  5,  0,  0,  0,
+]
+PST[QUEEN] = [
+    -20,-10,-10, -5, -5,-10,-10,-20,
+    -10,  0,  0,  0,  0,  0,  0,-10,
+    -10,  0,  5,  5,  5,  5,  0,-10,
+     -5,  0,  5,  5,  5,  5,  0, -5,
+      0,  0,  5,  5,  5,  5,  0, -5,
+    -10,  5,  5,  5,  5,  5,  0,-10,
+    -10,  0,  5,  0,  0,  0,  0,-10,
+    -20,-10,-10, -5, -5,-10,-10,-20,
+]
+PST[KING] = [
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -30,-40,-40,-50,-50,-40,-40,-30,
+    -20,-30,-30,-40,-40,-30,-30,-20,
+    -10,-20,-20,-20,-20,-20,-20,-10,
+     20, 20,  0,  0,  0,  0, 20, 20,
+     20, 30, 10,  0,  0, 10, 30, 20,
+]
+
+# Endgame values: pawns gain as they get closer to promotion, the king
+# belongs in the centre, everything else keeps its middlegame table
+EG_PIECE_VALUES = [0] * 6
+EG_PIECE_VALUES[PAWN] = 120
+EG_PIECE_VALUES[KNIGHT] = 300
+EG_PIECE_VALUES[BISHOP] = 320
+EG_PIECE_VALUES[ROOK] = 520
+EG_PIECE_VALUES[QUEEN] = 920
+EG_PIECE_VALUES[KING] = 0
+
+EG_PST = PST[:]
+EG_PST[PAWN] = [
+     0,  0,  0,  0,  0,  0,  0,  0,
+    80, 80, 80, 80, 80, 80, 80, 80,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    30, 30, 30, 30, 30, 30, 30, 30,
+    15, 15, 15, 15, 15, 15, 15, 15,
+     5,  5,  5,  5,  5,  5,  5,  5,
+     0,  0,  0,  0,  0,  0,  0,  0,
+     0,  0,  0,  0,  0,  0,  0,  0,
+]
+EG_PST[KING] = [
+    -50,-40,-30,-20,-20,-30,-40,-50,
+    -30,-20,-10,  0,  0,-10,-20,-30,
+    -30,-10, 20, 30, 30, 20,-10,-30,
+    -30,-10, 30, 40, 40, 30,-10,-30,
+    -30,-10, 30, 40, 40, 30,-10,-30,
+    -30,-10, 20, 30, 30, 20,-10,-30,
+    -30,-30,  0,  0,  0,  0,-30,-30,
+    -50,-30,-30,-30,-30,-30,-30,-50,
+]
+
+# Game phase: 24 with all minor and major pieces on the board, 0 with none.
+# Promotions can push it past 24, so it is capped when blending.
+PHASE_WEIGHTS = [0] * 6
+PHASE_WEIGHTS[KNIGHT] = 1
+PHASE_WEIGHTS[BISHOP] = 1
+PHASE_WEIGHTS[ROOK] = 2
+PHASE_WEIGHTS[QUEEN] = 4
+TOTAL_PHASE = 24
+
+
+def _square_scores(values, tables):
+    # [piece index * 64 + sq]: value of that piece on that square from
+    # White's point of view (negative for Black pieces), flat like PIECE_KEYS
+    scores = []
+    for index in range(12):
+        kind = index % 6
+        if index < 6:
+            scores.extend(values[kind] + tables[kind][sq] for sq in range(64))
+        else:
+            scores.extend(-(values[kind] + tables[kind][sq ^ 56]) for sq in range(64))
+    return scores
+
+
+MG_SCORES = _square_scores(PIECE_VALUES, PST)
+EG_SCORES = _square_scores(EG_PIECE_VALUES, EG_PST)
+PIECE_PHASE = [PHASE_WEIGHTS[index % 6] for index in range(12)]
+
+CHECK_INCREMENTAL = os.environ.get("QC_CHECK_EVAL", "") not in ("", "0")
+
+
+def taper(mg, eg, phase):
+    # Blend the middlegame and endgame scores by the game phase
+    phase = min(phase, TOTAL_PHASE)
+    return (mg * phase + eg * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+
+
+def compute_terms(position):
+    # (mg, eg, phase) from scratch, for setting up and checking the values
+    # Position keeps incrementally
+    mg = eg = phase = 0
+    for index, pieces in enumerate(position.pieces):
+        base = index * 64
+        while pieces:
+            low = pieces & -pieces
+            pieces ^= low
+            sq = low.bit_length() - 1
+            mg += MG_SCORES[base + sq]
+            eg += EG_SCORES[base + sq]
+            phase += PIECE_PHASE[index]
+    return mg, eg, phase
+
+
+def check_terms(position):
+    expected = compute_terms(position)
+    actual = (position.mg, position.eg, position.phase)
+    if actual != expected:
+        raise AssertionError(f"incremental evaluation (mg, eg, phase) {actual} != recomputed {expected}")
+
+
+def evaluate(position):
+    if CHECK_INCREMENTAL:
+        check_terms(position)
+    score = taper(position.mg, position.eg, position.phase)
+    return -score if position.turn else score
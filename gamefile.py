@@ -0,0 +1,350 @@
+# Binary game archive with memory-mapped random access
+#
+#   python gamefile.py pack games.pgn games.qcg        PGN or selfplay.py JSONL in, archive out
+#   python gamefile.py pack --append more.pgn games.qcg     add to an existing archive
+#   python gamefile.py show games.qcg 1234 [40]        FEN (and ghosts) of game 1234 after 40 plies
+#
+# Layout, all little-endian:
+#
+#   header   magic "QCG1", version u16, reserved u16, game count u32, index offset u64
+#   games    per game: word count u32, FEN length u16, result u8, flags u8,
+#            the FEN (empty for the standard start, padded to an even length),
+#            then the words, u16 each
+#   index    one u64 file offset per game
+#
+# The header's count and index offset are only filled in by GameWriter.close;
+# while an archive is open for writing they are zero. An archive left like
+# that by a crash or an interrupted pack is recovered when it is opened for
+# writing again: the games are found by walking their records, and a game
+# cut off in the middle is dropped.
+#
+# A word is a Position move (from | to << 6 | flag << 12). Move flags 6 and 7
+# are unused by moves and mark quantum events instead:
+#
+#   flag 6, n = bits 6..11 > 0   split the piece on from evenly over the n
+#                                squares held in the next n words
+#   flag 6, n = 0                the ghost on from turned out not to be there
+#   flag 7                       the piece with a ghost on from collapsed onto to
+#
+# Quantum events never end the turn; a NULL_MOVE word does. A measurement is
+# a collapse word plus NULL_MOVE, a capture onto a ghost is the collapse (or
+# not-there) word followed by the move as played.
+#
+# GameFile maps the file and reads the index in place, so game N is found
+# without touching the games before it and replaying ply M costs M make_move
+# calls, with no parsing at all.
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from bitboard import PIECES
+from notation import START_FEN, open_pgn, parse_fen, read_games, replay, to_fen
+from position import CASTLING_MASK, NULL_MOVE, PROMOTION, parse_square, square_name
+from quantum import QuantumState
+
+MAGIC = b"QCG1"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIQ")
+GAME_HEADER = struct.Struct("<IHBB")
+
+RESULTS = ("*", "1-0", "0-1", "1/2-1/2")
+QUANTUM = 1  # game flag: the game has quantum events
+
+SPLIT = 6
+COLLAPSE = 7
+
+_SWAP = sys.byteorder != "little"
+
+
+def split_words(sq, targets):
+    return [sq | (len(targets) << 6) | (SPLIT << 12)] + list(targets)
+
+
+def absent_word(sq):
+    return sq | (SPLIT << 12)
+
+
+def collapse_word(sq, landed):
+    return sq | (landed << 6) | (COLLAPSE << 12)
+
+
+def apply_words(position, state, words, plies=None):
+    # Play words on position and state (a QuantumState), stopping after
+    # plies moves if given; returns the number of plies played
+    played = 0
+    i = 0
+    count = len(words)
+    while i < count:
+        # Every word, quantum events included, belongs to the ply ended by
+        # the next move or NULL_MOVE word, so the limit applies to all of them
+        if plies is not None and played == plies:
+            break
+        word = words[i]
+        i += 1
+        flag = word >> 12
+        if flag == SPLIT:
+            sq = word & 63
+            n = (word >> 6) & 63
+            if n:
+                if sq not in state:
+                    position.set_castling(position.castling & CASTLING_MASK[sq])
+                state.split(position, sq, list(words[i:i + n]))
+                i += n
+            else:
+                state.resolve(position, sq, False)
+            continue
+        if flag == COLLAPSE:
+            sq = word & 63
+            state.measure(position, state.owner[sq], (word >> 6) & 63)
+            continue
+        if word == NULL_MOVE:
+            position.make_null_move()
+        else:
+            position.make_move(word)
+        played += 1
+    return played
+
+
+class GameRecord:
+    __slots__ = ("words", "result", "fen", "flags")
+
+    def __init__(self, words, result, fen, flags):
+        self.words = words    # u16 sequence, a view into the mapped file
+        self.result = result
+        self.fen = fen        # start position, START_FEN when not stored
+        self.flags = flags
+
+    def __len__(self):
+        return len(self.words)
+
+    def replay(self, plies=None):
+        # (Position, QuantumState) after plies moves, or at the end
+        position = parse_fen(self.fen)
+        state = QuantumState()
+        apply_words(position, state, self.words, plies)
+        return position, state
+
+
+class GameWriter:
+    # Appends games to an archive; the index is written by close(). Opening
+    # an existing archive continues it, or recovers it if it was never
+    # closed.
+    def __init__(self, path):
+        self.offsets = array('Q')
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size >= HEADER.size:
+            self.file = open(path, "r+b")
+            magic, version, _, count, index_offset = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                self.file.close()
+                raise ValueError(f"{path} is not a game archive")
+            if HEADER.size <= index_offset and index_offset + count * 8 == size:
+                self.file.seek(index_offset)
+                self.offsets.frombytes(self.file.read(count * 8))
+                if _SWAP:
+                    self.offsets.byteswap()
+            else:
+                index_offset = self._recover(size)
+            self.file.seek(index_offset)
+            self.file.truncate()
+            # Mark the archive unfinished until close() writes the index
+            self.file.seek(0)
+            self.file.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+            self.file.seek(index_offset)
+        else:
+            self.file = open(path, "w+b")
+            self.file.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+
+    def _recover(self, size):
+        # Offsets of the complete games of an archive that was never closed;
+        # returns where the last of them ends
+        offset = HEADER.size
+        while offset + GAME_HEADER.size <= size:
+            self.file.seek(offset)
+            count, fen_length, result, _ = GAME_HEADER.unpack(self.file.read(GAME_HEADER.size))
+            end = offset + GAME_HEADER.size + fen_length + (fen_length & 1) + count * 2
+            if end > size or result >= len(RESULTS):
+                break
+            self.offsets.append(offset)
+            offset = end
+        return offset
+
+    def add(self, words, result="*", fen=None, flags=0):
+        words = array('H', words)
+        if _SWAP:
+            words.byteswap()
+        fen_bytes = b"" if fen is None or fen == START_FEN else fen.encode("ascii")
+        self.offsets.append(self.file.tell())
+        self.file.write(GAME_HEADER.pack(len(words), len(fen_bytes), RESULTS.index(result), flags))
+        self.file.write(fen_bytes + b"\0" * (len(fen_bytes) & 1))
+        self.file.write(words.tobytes())
+
+    def close(self):
+        index_offset = self.file.tell()
+        offsets = array('Q', self.offsets)
+        if _SWAP:
+            offsets.byteswap()
+        self.file.write(offsets.tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, len(self.offsets), index_offset))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GameFile:
+    # Read-only view of an archive; games are decoded on access
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.count, index_offset = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a game archive")
+        if index_offset < HEADER.size or index_offset + self.count * 8 != len(self.map):
+            raise ValueError(f"{path} was not closed; open it with GameWriter to recover it")
+        self.view = memoryview(self.map)
+        self.index = self.view[index_offset:index_offset + self.count * 8].cast('Q')
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, n):
+        if not 0 <= n < self.count:
+            raise IndexError(n)
+        offset = self.index[n]
+        if _SWAP:
+            offset = struct.unpack("<Q", struct.pack("=Q", offset))[0]
+        count, fen_length, result, flags = GAME_HEADER.unpack_from(self.map, offset)
+        start = offset + GAME_HEADER.size
+        fen = bytes(self.view[start:start + fen_length]).decode("ascii") if fen_length else START_FEN
+        start += fen_length + (fen_length & 1)
+        words = self.view[start:start + count * 2].cast('H')
+        if _SWAP:
+            words = array('H', words)
+            words.byteswap()
+        return GameRecord(words, RESULTS[result], fen, flags)
+
+    def __iter__(self):
+        for n in range(self.count):
+            yield self[n]
+
+    def close(self):
+        # Word views of records still in use keep the mapping alive until
+        # they are dropped
+        self.index.release()
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Importers
+
+def pgn_records(path):
+    # (words, result, fen, flags) for every legal game in a PGN file
+    with open_pgn(path) as f:
+        for game in read_games(f):
+            try:
+                _, moves = replay(game)
+            except ValueError:
+                continue
+            yield moves, game.result, game.headers.get("FEN"), 0
+
+
+def selfplay_words(record):
+    # Words for one selfplay.py record, replaying it to recover the move
+    # flags and the result of every collapse
+    position = parse_fen(START_FEN)
+    state = QuantumState()
+    present = {c["ply"]: c["present"] for c in record["collapses"] if c["kind"] == "capture"}
+    words = []
+    for ply, text in enumerate(record["moves"]):
+        if text[0] == "S":
+            sq = parse_square(text[1:3])
+            targets = [parse_square(text[i:i + 2]) for i in range(3, len(text), 2)]
+            words += split_words(sq, targets) + [NULL_MOVE]
+            apply_words(position, state, words[-len(targets) - 2:])
+            continue
+        if text[0] == "M":
+            words.append(collapse_word(parse_square(text[1:3]), parse_square(text[3:5])))
+            words.append(NULL_MOVE)
+            apply_words(position, state, words[-2:])
+            continue
+        from_sq = parse_square(text[0:2])
+        to_sq = parse_square(text[2:4])
+        promotion = "nbrq".index(text[4]) if len(text) > 4 else 3
+        if to_sq in state:
+            words.append(collapse_word(to_sq, to_sq) if present[ply] else absent_word(to_sq))
+            apply_words(position, state, words[-1:])
+        # The move as engine.play_move would have played it
+        chosen = NULL_MOVE
+        for move in position.legal_moves():
+            if move & 63 == from_sq and (move >> 6) & 63 == to_sq:
+                flag = move >> 12
+                if chosen == NULL_MOVE or (flag & PROMOTION and flag & 3 == promotion):
+                    chosen = move
+        words.append(chosen)
+        apply_words(position, state, words[-1:])
+    return words
+
+
+def selfplay_records(path):
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            quantum = any(text[0] in "SM" for text in record["moves"]) or record["collapses"]
+            yield selfplay_words(record), record["result"], None, QUANTUM if quantum else 0
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    append = args[:1] == ["pack"] and "--append" in args
+    if append:
+        args = [arg for arg in args if arg != "--append"]
+    if len(args) >= 3 and args[0] == "pack":
+        source, target = args[1], args[2]
+        if not append and os.path.exists(target):
+            os.remove(target)
+        records = selfplay_records(source) if source.endswith((".jsonl", ".json")) else pgn_records(source)
+        games = 0
+        words = 0
+        with GameWriter(target) as writer:
+            for game_words, result, fen, flags in records:
+                writer.add(game_words, result, fen, flags)
+                games += 1
+                words += len(game_words)
+        print(f"{games} games, {words} words: {os.path.getsize(source)} bytes in, "
+              f"{os.path.getsize(target)} bytes out")
+        return 0
+    if len(args) >= 3 and args[0] == "show":
+        with GameFile(args[1]) as games:
+            game = games[int(args[2])]
+            plies = int(args[3]) if len(args) > 3 else None
+            position, state = game.replay(plies)
+            print(to_fen(position), game.result)
+            for sq, index, probability in sorted(state.ghosts()):
+                print(f"  {PIECES[index]} {square_name(sq)} {probability:.3f}")
+        return 0
+    print("usage: python gamefile.py pack [--append] <games.pgn|selfplay.jsonl> <out.qcg>\n"
+          "       python gamefile.py show <games.qcg> <game> [plies]", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+# Monte Carlo expectation over quantum collapse outcomes
+#
+# Superposed pieces are independent, so a collapse outcome is one square
+# drawn per piece from its distribution. Outcomes are drawn a batch at a
+# time into an (N, 64) array of piece indices (-1 for empty), scored in
+# bulk by batcheval.evaluate_boards (material, piece-square tables, mobility
+# and king safety), and batches keep coming until the standard error of the
+# mean drops below a tolerance.
+
+import math
+
+import numpy as np
+
+from batcheval import evaluate_boards
+
+
+class Expectation:
+    __slots__ = ("mean", "variance", "samples", "stderr")
+
+    def __init__(self, mean, variance, samples, stderr):
+        self.mean = mean
+        self.variance = variance
+        self.samples = samples
+        self.stderr = stderr
+
+    def __repr__(self):
+        return f"Expectation(mean={self.mean:.1f}, variance={self.variance:.1f}, samples={self.samples}, stderr={self.stderr:.2f})"
+
+
+def sample_boards(position, state, count, rng):
+    # (count, 64) int8 boards, each with every superposed piece collapsed
+    boards = np.tile(np.frombuffer(position.squares, dtype=np.int8), (count, 1))
+    rows = np.arange(count)
+    for index, dist in state.pieces.values():
+        squares = np.fromiter(dist.keys(), dtype=np.intp, count=len(dist))
+        cumulative = np.cumsum(np.fromiter(dist.values(), dtype=np.float64, count=len(dist)))
+        picks = np.searchsorted(cumulative, rng.random(count) * cumulative[-1], side='right')
+        boards[rows, squares[np.minimum(picks, len(squares) - 1)]] = index
+    return boards
+
+
+def expected_score(position, state, rng=None, batch=1024, tolerance=2.0, max_samples=65536):
+    # Mean and variance of the evaluation over collapse outcomes. Stops once
+    # the standard error is within tolerance centipawns or after max_samples.
+    if rng is None:
+        rng = np.random.default_rng()
+    elif not isinstance(rng, np.random.Generator):
+        rng = np.random.default_rng(rng)
+
+    if not state:
+        score = float(evaluate_boards(np.frombuffer(position.squares, dtype=np.int8)[None], position.turn)[0])
+        return Expectation(score, 0.0, 1, 0.0)
+
+    total = 0.0
+    total_squares = 0.0
+    samples = 0
+    while True:
+        scores = evaluate_boards(sample_boards(position, state, batch, rng), position.turn).astype(np.float64)
+        total += scores.sum()
+        total_squares += (scores * scores).sum()
+        samples += batch
+        mean = total / samples
+        variance = max(total_squares / samples - mean * mean, 0.0) * samples / (samples - 1)
+        stderr = math.sqrt(variance / samples)
+        if stderr <= tolerance or samples >= max_samples:
+            return Expectation(mean, variance, samples, stderr)
@@ -0,0 +1,470 @@
+# FEN and PGN import/export
+#
+#   python notation.py games.pgn [more.pgn ...]    validate every game, list the illegal ones
+#
+# parse_fen/to_fen convert a Position to and from FEN. read_games streams PGN:
+# it takes any iterable of lines (an open file) and yields one PgnGame at a
+# time, so a collection of any size is never held in memory. replay plays a
+# game's SAN moves on a Position and raises IllegalMove at the first move
+# that is not legal there.
+#
+# SAN is resolved without generating the full move list: the candidate
+# movers come from the attack tables, and only the move actually played is
+# tested for leaving the king in check. format_game/write_games go the other
+# way, from moves to PGN text.
+
+import re
+import sys
+import time
+
+from bitboard import BISHOP, KING, KNIGHT, KNIGHT_ATTACKS, KING_ATTACKS, PAWN, QUEEN, ROOK, PIECES, \
+    bishop_attacks, is_king_attacked, queen_attacks, rook_attacks
+from position import (CAPTURE, CASTLES, DOUBLE_PUSH, EMPTY, EP_CAPTURE, KING_CASTLE, PROMOTION, PROMOTION_KINDS,
+                      QUEEN_CASTLE, QUIET, FILES, Position, parse_square, square_name)
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+CASTLING_CHARS = "KQkq"  # in castling-rights bit order
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+# Seven Tag Roster, written first and in this order
+ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+
+SAN_KINDS = {"N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN, "K": KING}
+KIND_LETTERS = {KNIGHT: "N", BISHOP: "B", ROOK: "R", QUEEN: "Q", KING: "K"}
+
+SAN_RE = re.compile(r"([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?$")
+TAG_RE = re.compile(r'\[\s*(\w+)\s+"(.*)"\s*\]')  # greedy: some files leave inner quotes unescaped
+# Comments, NAGs, variation brackets, move numbers, results, and everything
+# else as a SAN token
+TOKEN_RE = re.compile(r"\{[^}]*\}?|;[^\n]*|\$\d+|[()]|1-0|0-1|1/2-1/2|\*|\d+\.+|[^\s{}();$]+")
+
+_SAN_FIELDS = {}
+
+
+class IllegalMove(ValueError):
+    def __init__(self, ply, san, reason):
+        ValueError.__init__(self, f"ply {ply} {san!r}: {reason}")
+        self.ply = ply
+        self.san = san
+        self.reason = reason
+
+
+# FEN
+
+def parse_fen(fen):
+    fields = fen.split()
+    if not 1 <= len(fields) <= 6:
+        raise ValueError(f"bad FEN {fen!r}")
+    grid = []
+    for rank in fields[0].split("/"):
+        row = []
+        for char in rank:
+            if char.isdigit():
+                row.extend([""] * int(char))
+            elif char.lower() in "prnbqk":
+                row.append(("w" if char.isupper() else "b") + char.lower())
+            else:
+                raise ValueError(f"bad FEN piece {char!r}")
+        if len(row) != 8:
+            raise ValueError(f"bad FEN rank {rank!r}")
+        grid.append(row)
+    if len(grid) != 8:
+        raise ValueError(f"bad FEN placement {fields[0]!r}")
+    fields += ["w", "-", "-", "0", "1"][len(fields) - 1:]
+    if fields[1] not in ("w", "b"):
+        raise ValueError(f"bad FEN side to move {fields[1]!r}")
+    if fields[2] != "-" and any(char not in CASTLING_CHARS for char in fields[2]):
+        raise ValueError(f"bad FEN castling {fields[2]!r}")
+    castling = sum(1 << i for i, char in enumerate(CASTLING_CHARS) if char in fields[2])
+    if fields[3] != "-" and not re.match(r"[a-h][36]$", fields[3]):
+        raise ValueError(f"bad FEN en passant square {fields[3]!r}")
+    ep_square = parse_square(fields[3]) if fields[3] != "-" else -1
+    return Position.from_grid(grid, fields[1], castling, ep_square, int(fields[4]), int(fields[5]))
+
+
+def to_fen(position):
+    ranks = []
+    for row in range(8):
+        text = ""
+        empty = 0
+        for sq in range(row * 8, row * 8 + 8):
+            index = position.squares[sq]
+            if index == EMPTY:
+                empty += 1
+                continue
+            if empty:
+                text += str(empty)
+                empty = 0
+            letter = PIECES[index][1]
+            text += letter.upper() if index < 6 else letter
+        ranks.append(text + (str(empty) if empty else ""))
+    castling = "".join(char for i, char in enumerate(CASTLING_CHARS) if position.castling >> i & 1) or "-"
+    ep = square_name(position.ep_square) if position.ep_square >= 0 else "-"
+    return (f"{'/'.join(ranks)} {'b' if position.turn else 'w'} {castling} {ep} "
+            f"{position.halfmove} {position.fullmove}")
+
+
+# SAN
+
+def _attackers(position, kind, to_sq):
+    # Squares a piece of the side to move and of this kind could reach to_sq from
+    own = position.pieces[position.turn * 6 + kind]
+    if kind == KNIGHT:
+        return KNIGHT_ATTACKS[to_sq] & own
+    if kind == KING:
+        return KING_ATTACKS[to_sq] & own
+    if kind == BISHOP:
+        return bishop_attacks(to_sq, position.occupancy) & own
+    if kind == ROOK:
+        return rook_attacks(to_sq, position.occupancy) & own
+    return queen_attacks(to_sq, position.occupancy) & own
+
+
+def _is_safe(position, move):
+    # Whether the move leaves the mover's own king out of check
+    color = position.turn
+    position.make_move(move)
+    safe = not is_king_attacked(position, color)
+    position.unmake_move()
+    return safe
+
+
+def _castle(position, ply, san):
+    flag = KING_CASTLE if san.count("-") == 1 else QUEEN_CASTLE
+    right, king_from, king_to = CASTLES[position.turn][flag - KING_CASTLE][:3]
+    move = king_from | (king_to << 6) | (flag << 12)
+    if not position.castling & right or move not in position._special_moves():
+        raise IllegalMove(ply, san, "castling not allowed")
+    return move
+
+
+def _pawn_move(position, ply, san, file, capture, to_sq, promotion):
+    color = position.turn
+    pawn = color * 6 + PAWN
+    squares = position.squares
+    back = 8 if color == 0 else -8
+    to_row = to_sq // 8
+    if promotion is None and to_row in (0, 7):
+        raise IllegalMove(ply, san, "promotion piece missing")
+    if promotion is not None and to_row != (0 if color == 0 else 7):
+        raise IllegalMove(ply, san, "promotion off the last rank")
+
+    if capture and (file is None or file == to_sq % 8):
+        raise IllegalMove(ply, san, "pawn capture without a source file")
+    if file is not None and file != to_sq % 8:
+        if abs(file - to_sq % 8) != 1:
+            raise IllegalMove(ply, san, "pawn capture off an adjacent file")
+        from_sq = to_sq + back - to_sq % 8 + file
+        if squares[from_sq] != pawn:
+            raise IllegalMove(ply, san, "no pawn to capture with")
+        target = squares[to_sq]
+        if target == EMPTY and to_sq == position.ep_square:
+            return from_sq | (to_sq << 6) | (EP_CAPTURE << 12)
+        if target == EMPTY or target // 6 == color:
+            raise IllegalMove(ply, san, "nothing to capture")
+        flag = CAPTURE
+    else:
+        if squares[to_sq] != EMPTY:
+            raise IllegalMove(ply, san, "pawn push blocked")
+        from_sq = to_sq + back
+        flag = QUIET
+        if squares[from_sq] == EMPTY and to_row == (4 if color == 0 else 3):
+            from_sq += back
+            flag = DOUBLE_PUSH
+        if squares[from_sq] != pawn:
+            raise IllegalMove(ply, san, "no pawn to push")
+    if promotion is not None:
+        flag = (flag & CAPTURE) | PROMOTION | PROMOTION_KINDS.index(promotion)
+    return from_sq | (to_sq << 6) | (flag << 12)
+
+
+def _split_san(san):
+    # (kind letter, from file, from rank, capture, to square, promotion kind)
+    # or None; the set of well-formed SAN strings is small, so it is cached
+    fields = _SAN_FIELDS.get(san)
+    if fields is None:
+        match = SAN_RE.match(san.rstrip("+#!?"))
+        if match is None:
+            return None
+        letter, file, rank, capture, to_name, promotion = match.groups()
+        fields = (letter, FILES.index(file) if file else None, int(rank) if rank else None, bool(capture),
+                  parse_square(to_name), SAN_KINDS[promotion] if promotion else None)
+        _SAN_FIELDS[san] = fields
+    return fields
+
+
+def _resolve(position, san, ply):
+    # The move san names, not yet checked for leaving the king in check
+    fields = _split_san(san)
+    if fields is None:
+        text = san.rstrip("+#!?")
+        if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            return _castle(position, ply, text)
+        raise IllegalMove(ply, san, "not a move")
+    letter, file, rank, capture, to_sq, promotion = fields
+
+    if letter is None:
+        return _pawn_move(position, ply, san, file, capture, to_sq, promotion)
+    if promotion is not None:
+        raise IllegalMove(ply, san, "only pawns promote")
+    target = position.squares[to_sq]
+    if target != EMPTY and target // 6 == position.turn:
+        raise IllegalMove(ply, san, "square taken by own piece")
+    flag = QUIET if target == EMPTY else CAPTURE
+    candidates = []
+    attackers = _attackers(position, SAN_KINDS[letter], to_sq)
+    while attackers:
+        low = attackers & -attackers
+        attackers ^= low
+        from_sq = low.bit_length() - 1
+        if file is not None and from_sq % 8 != file:
+            continue
+        if rank is not None and 8 - from_sq // 8 != int(rank):
+            continue
+        candidates.append(from_sq | (to_sq << 6) | (flag << 12))
+    if len(candidates) > 1:
+        # Only one of them may be legal, e.g. when the others are pinned
+        candidates = [move for move in candidates if _is_safe(position, move)]
+        if len(candidates) > 1:
+            raise IllegalMove(ply, san, "ambiguous")
+    if not candidates:
+        raise IllegalMove(ply, san, "no piece can make it")
+    return candidates[0]
+
+
+def parse_san(position, san, ply=0):
+    # The legal move san stands for in position. ply only labels errors.
+    move = _resolve(position, san, ply)
+    if not _is_safe(position, move):
+        raise IllegalMove(ply, san, "leaves the king in check")
+    return move
+
+
+def play_san(position, san, ply=0):
+    # Make the move san stands for and return it. Legality is checked on
+    # the move as made rather than by a separate trial.
+    move = _resolve(position, san, ply)
+    color = position.turn
+    position.make_move(move)
+    if is_king_attacked(position, color):
+        position.unmake_move()
+        raise IllegalMove(ply, san, "leaves the king in check")
+    return move
+
+
+def move_to_san(position, move, legal=None):
+    # SAN for a legal move, with + or # when it checks or mates
+    from_sq = move & 63
+    to_sq = (move >> 6) & 63
+    flag = move >> 12
+    if flag == KING_CASTLE:
+        text = "O-O"
+    elif flag == QUEEN_CASTLE:
+        text = "O-O-O"
+    else:
+        index = position.squares[from_sq]
+        kind = index % 6
+        capture = bool(flag & CAPTURE)
+        if kind == PAWN:
+            text = (FILES[from_sq % 8] + "x" if capture else "") + square_name(to_sq)
+            if flag & PROMOTION:
+                text += "=" + KIND_LETTERS[PROMOTION_KINDS[flag & 3]]
+        else:
+            if legal is None:
+                legal = position.legal_moves()
+            others = [other & 63 for other in legal
+                      if (other >> 6) & 63 == to_sq and other & 63 != from_sq and position.squares[other & 63] == index]
+            hint = ""
+            if others:
+                if all(sq % 8 != from_sq % 8 for sq in others):
+                    hint = FILES[from_sq % 8]
+                elif all(sq // 8 != from_sq // 8 for sq in others):
+                    hint = str(8 - from_sq // 8)
+                else:
+                    hint = square_name(from_sq)
+            text = KIND_LETTERS[kind] + hint + ("x" if capture else "") + square_name(to_sq)
+    position.make_move(move)
+    if position.in_check():
+        text += "+" if position.has_legal_move() else "#"
+    position.unmake_move()
+    return text
+
+
+# PGN
+
+class PgnGame:
+    __slots__ = ("headers", "moves", "result", "line")
+
+    def __init__(self, headers, moves, result, line):
+        self.headers = headers  # {tag: value}
+        self.moves = moves      # SAN strings of the main line
+        self.result = result    # game termination marker, "*" if missing
+        self.line = line        # line number where the game starts
+
+    def __repr__(self):
+        return f"PgnGame({self.headers.get('White', '?')} - {self.headers.get('Black', '?')}, {len(self.moves)} moves)"
+
+
+def _movetext(text):
+    # (SAN tokens of the main line, result) from the movetext of one game
+    moves = []
+    result = "*"
+    depth = 0
+    for token in TOKEN_RE.findall(text):
+        first = token[0]
+        if first == "{" or first == ";" or first == "$":
+            continue
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth:
+            continue
+        elif token in RESULTS:
+            result = token
+        elif not first.isdigit():
+            moves.append(token)
+    return moves, result
+
+
+def read_games(lines):
+    # Yield one PgnGame per game in lines (e.g. an open PGN file), reading
+    # only as far as the game being returned
+    headers = {}
+    movetext = []
+    start = 0
+    number = 0
+    for number, line in enumerate(lines, 1):
+        if line.startswith("["):
+            if movetext:
+                yield PgnGame(headers, *_movetext("".join(movetext)), start)
+                headers = {}
+                movetext = []
+            match = TAG_RE.match(line)
+            if match is not None:
+                if not headers:
+                    start = number
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+            continue
+        if line.startswith("%") or not line.strip():
+            continue
+        if not movetext and not headers:
+            start = number
+        movetext.append(line)
+        # The result ends the movetext, which is all that separates games
+        # without tags; unless it sits inside an unclosed comment
+        if line.rstrip().endswith(RESULTS):
+            text = "".join(movetext)
+            if text.count("{") == text.count("}"):
+                yield PgnGame(headers, *_movetext(text), start)
+                headers = {}
+                movetext = []
+    if movetext or headers:
+        yield PgnGame(headers, *_movetext("".join(movetext)), start)
+
+
+def open_pgn(path):
+    # PGN files in the wild are mostly, but not always, UTF-8
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def start_position(game):
+    fen = game.headers.get("FEN")
+    return parse_fen(fen) if fen else parse_fen(START_FEN)
+
+
+def replay(game):
+    # Play every move of game; returns (final position, moves). Raises
+    # IllegalMove at the first illegal move and ValueError for a bad FEN tag.
+    position = start_position(game)
+    moves = []
+    for ply, san in enumerate(game.moves):
+        moves.append(play_san(position, san, ply))
+    return position, moves
+
+
+def validate(lines):
+    # Yield (game, error) for every game, error None when the game is legal
+    for game in read_games(lines):
+        try:
+            replay(game)
+        except ValueError as error:
+            yield game, error
+        else:
+            yield game, None
+
+
+def _tag(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def format_game(moves, headers=None, fen=None, result="*"):
+    # PGN text for moves (ints, from fen or the start position). The Seven
+    # Tag Roster comes first; movetext is wrapped at 80 columns.
+    headers = dict(headers or {})
+    headers.setdefault("Result", result)
+    if fen is not None and fen != START_FEN:
+        headers["SetUp"] = "1"
+        headers["FEN"] = fen
+    lines = [f'[{tag} "{_tag(headers.get(tag, "?"))}"]' for tag in ROSTER]
+    lines += [f'[{tag} "{_tag(value)}"]' for tag, value in headers.items() if tag not in ROSTER]
+    lines.append("")
+
+    position = parse_fen(fen) if fen else parse_fen(START_FEN)
+    tokens = []
+    for ply, move in enumerate(moves):
+        if position.turn == 0:
+            tokens.append(f"{position.fullmove}.")
+        elif ply == 0:
+            tokens.append(f"{position.fullmove}...")
+        tokens.append(move_to_san(position, move))
+        position.make_move(move)
+    tokens.append(headers["Result"])
+
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 80:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+
+def write_games(out, games):
+    # Write (moves, headers, fen, result) tuples to an open file one at a time
+    count = 0
+    for moves, headers, fen, result in games:
+        out.write(format_game(moves, headers, fen, result))
+        count += 1
+    return count
+
+
+def main(argv=None):
+    paths = sys.argv[1:] if argv is None else argv
+    if not paths:
+        print("usage: python notation.py games.pgn [more.pgn ...]", file=sys.stderr)
+        return 2
+    games = 0
+    plies = 0
+    illegal = 0
+    start = time.perf_counter()
+    for path in paths:
+        with open_pgn(path) as f:
+            for game, error in validate(f):
+                games += 1
+                plies += len(game.moves)
+                if error is not None:
+                    illegal += 1
+                    print(f"{path}:{game.line}: {game.headers.get('White', '?')} - "
+                          f"{game.headers.get('Black', '?')}: {error}")
+    elapsed = time.perf_counter() - start
+    rate = games / elapsed if elapsed > 0 else 0.0
+    print(f"{games} games, {plies} plies in {elapsed:.2f}s: {rate:.0f} games/s, "
+          f"{plies / elapsed if elapsed > 0 else 0:.0f} plies/s, {illegal} illegal", file=sys.stderr)
+    return 1 if illegal else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+# Lazy SMP: one search spread over several processes
+#
+#   python parallel_search.py --bench --depth 5                 speedup for 1, 2, 4 and 8 workers
+#   python parallel_search.py --bench --depth 5 --workers 1 4 --fen "<fen>"
+#
+# Every worker runs the ordinary iterative deepening Searcher (search.py) on
+# the same position. None of them splits the tree: they share one
+# transposition table in shared memory, so whatever one worker has searched
+# is a cutoff or a good first move for the others. The main searcher runs in
+# the calling process; helpers are long-lived processes that start a search
+# whenever the main one does. Each helper gets the root moves rotated by its
+# number, so they start in different parts of the tree instead of repeating
+# the main searcher's work. The table is lockless: torn entries fail
+# verification (transposition.py) and are simply missed.
+#
+# The main searcher decides when to stop. The helpers are stopped with it,
+# and the deepest completed result wins, the main searcher's on ties.
+#
+# With workers=1 there are no helpers and no shared memory: search() is
+# Searcher.search, so a depth-limited search gives the same move, score and
+# node count on every run. Tests and anything that needs reproducible
+# results should use that.
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+import search
+from notation import START_FEN, parse_fen
+from position import move_to_uci
+from search import MAX_PLY, SearchResult, Searcher
+from transposition import ENTRY_BYTES, TranspositionTable, entries_for
+
+# Positions for the speedup curve: the opening, two middlegames and an endgame
+BENCH_FENS = [
+    START_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+]
+HELPER_REPLY_TIME = 2.0  # seconds to wait for a stopped helper's result
+
+
+class _JobStop:
+    # Stop flag for one job, shaped like threading.Event for Searcher
+    __slots__ = ("stopped", "job_id")
+
+    def __init__(self, stopped, job_id):
+        self.stopped = stopped
+        self.job_id = job_id
+
+    def is_set(self):
+        return self.stopped.value >= self.job_id
+
+
+def _helper(number, buffer, jobs, results, stopped):
+    searcher = Searcher(tt=TranspositionTable(buffer=buffer))
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            job = jobs.get(timeout=1.0)
+        except queue.Empty:
+            if not parent.is_alive():
+                return  # the searcher that owned us was killed without close()
+            continue
+        if job is None:
+            return
+        job_id, generation, position, time_limit, max_depth, moves = job
+        # Table generation of the main searcher for this search, whether or
+        # not this helper gets to run it; search() starts with new_search()
+        searcher.tt.generation = (generation - 1) & 63
+        stop = _JobStop(stopped, job_id)
+        if stop.is_set():
+            searcher.tt.new_search()
+            results.put((job_id, number, None))
+            continue
+        shift = number % len(moves)
+        result = searcher.search(position, time_limit, max_depth, stop=stop, root_moves=moves[shift:] + moves[:shift])
+        results.put((job_id, number, result))
+
+
+class ParallelSearcher:
+    # Drop-in for search.Searcher: same search() arguments and result, so it
+    # can be handed to search.choose_move; analysis.AnalysisWorker(workers)
+    # runs one in its process
+    def __init__(self, workers=None, memory_mb=16):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.helpers = []
+        self.job_id = 0
+        if self.workers == 1:
+            self.searcher = Searcher(memory_mb=memory_mb)
+            return
+        self.buffer = multiprocessing.RawArray('B', ENTRY_BYTES * entries_for(memory_mb))
+        self.searcher = Searcher(tt=TranspositionTable(buffer=self.buffer))
+        self.results = multiprocessing.Queue()
+        self.stopped = multiprocessing.Value('q', 0, lock=False)  # highest stopped job id
+        for number in range(1, self.workers):
+            jobs = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_helper, name=f"search helper {number}",
+                                              args=(number, self.buffer, jobs, self.results, self.stopped),
+                                              daemon=True)
+            process.start()
+            self.helpers.append((process, jobs))
+
+    @property
+    def tt(self):
+        return self.searcher.tt
+
+    def search(self, position, time_limit=1.0, max_depth=MAX_PLY, on_iteration=None, stop=None, root_moves=None):
+        if not self.helpers:
+            return self.searcher.search(position, time_limit, max_depth, on_iteration, stop, root_moves)
+
+        moves = position.legal_moves() if root_moves is None else list(root_moves)
+        if len(moves) <= 1:
+            # Nothing to search, as in Searcher.search
+            return SearchResult(moves[0] if moves else None, 0, 0, 0, 0.0)
+        self.job_id += 1
+        # The helpers take their table generation from the job, so one that
+        # skips a search cannot drift from the main searcher
+        job = (self.job_id, (self.tt.generation + 1) & 63, position.copy(), time_limit, max_depth, moves)
+        for _, jobs in self.helpers:
+            jobs.put(job)
+        try:
+            result = self.searcher.search(position, time_limit, max_depth, on_iteration, stop, moves)
+        finally:
+            self.stopped.value = self.job_id
+
+        # Collect the helpers' results; a deeper completed iteration replaces
+        # the main one, and every worker's nodes count
+        nodes = result.nodes
+        best = result
+        waiting = len(self.helpers)
+        deadline = time.perf_counter() + HELPER_REPLY_TIME
+        while waiting:
+            try:
+                job_id, _, helper_result = self.results.get(timeout=max(deadline - time.perf_counter(), 0.001))
+            except queue.Empty:
+                break
+            if job_id != self.job_id:
+                continue  # left over from a search whose helpers timed out
+            waiting -= 1
+            if helper_result is None:
+                continue
+            nodes += helper_result.nodes
+            if helper_result.depth > best.depth and helper_result.move is not None:
+                best = helper_result
+        return SearchResult(best.move, best.score, best.depth, nodes, result.seconds)
+
+    def close(self):
+        for _, jobs in self.helpers:
+            jobs.put(None)
+        for process, _ in self.helpers:
+            process.join(1.0)
+            if process.is_alive():
+                process.terminate()
+        self.helpers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def choose_move(position, time_limit=1.0, workers=None, searcher=None):
+    # search.choose_move over a ParallelSearcher of workers processes; pass
+    # searcher to keep the helpers and the table between moves
+    if searcher is not None:
+        return search.choose_move(position, time_limit, searcher)
+    with ParallelSearcher(workers) as searcher:
+        return search.choose_move(position, time_limit, searcher)
+
+
+def bench(fens, depth, worker_counts, memory_mb=16):
+    # Time to finish depth on each position, per number of workers. Helpers
+    # are started before the clock runs, and every run gets a fresh table.
+    records = []
+    for workers in worker_counts:
+        total = 0.0
+        nodes = 0
+        moves = []
+        for fen in fens:
+            with ParallelSearcher(workers, memory_mb) as searcher:
+                position = parse_fen(fen)
+                start = time.perf_counter()
+                result = searcher.search(position, time_limit=1e9, max_depth=depth)
+                total += time.perf_counter() - start
+                nodes += result.nodes
+                moves.append(move_to_uci(result.move) if result.move is not None else None)
+        records.append({"workers": workers, "depth": depth, "positions": len(fens), "seconds": round(total, 3),
+                        "nodes": nodes, "nps": int(nodes / total) if total > 0 else 0, "moves": moves})
+    base = records[0]["seconds"]
+    for record in records:
+        record["speedup"] = round(base / record["seconds"], 2) if record["seconds"] > 0 else 0.0
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lazy SMP search across processes")
+    parser.add_argument("--bench", action="store_true", help="time to depth for each number of workers")
+    parser.add_argument("--fen", action="append", help="position to search (repeatable); default: a built-in set")
+    parser.add_argument("--depth", type=int, default=5)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--time", type=float, default=5.0, help="seconds per search without --bench")
+    parser.add_argument("--memory", type=int, default=16, help="transposition table size in MB")
+    parser.add_argument("--json", action="store_true", help="emit one JSON record per line")
+    args = parser.parse_args(argv)
+    fens = args.fen or BENCH_FENS
+
+    if args.bench:
+        print(f"{os.cpu_count()} cores", file=sys.stderr)
+        for record in bench(fens, args.depth, args.workers, args.memory):
+            if args.json:
+                print(json.dumps(record), flush=True)
+            else:
+                print(f"{record['workers']:>2} workers: depth {record['depth']} on {record['positions']} positions "
+                      f"in {record['seconds']:8.3f}s, {record['nodes']:>9} nodes, {record['nps']:>7} nps, "
+                      f"speedup {record['speedup']:.2f}", flush=True)
+        return 0
+
+    with ParallelSearcher(args.workers[0], args.memory) as searcher:
+        for fen in fens:
+            result = searcher.search(parse_fen(fen), args.time, args.depth)
+            move = move_to_uci(result.move) if result.move is not None else "none"
+            print(f"{move} score {result.score} depth {result.depth} nodes {result.nodes} nps {result.nps}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# Headless perft benchmark for the move generators
+#
+#   python perft.py                          run the reference suite
+#   python perft.py --fen "<fen>" --depth 3 --divide
+#   python perft.py --json > perft.jsonl     one JSON record per result
+#   python perft.py --depth 3 --check-eval   also verify the incremental
+#                                            evaluation terms at every node
+#
+# Perft counts the leaf nodes of the legal move tree to a fixed depth. The
+# counts are compared against published reference values, so any change in
+# the generator that adds or loses a move shows up as a mismatch. Chess.py and
+# QuantamChess.py both play by the rules in engine.py, built on Position.
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from evaluation import check_terms
+from notation import START_FEN, parse_fen
+from position import move_to_uci
+
+# Standard reference positions and their published node counts
+PERFT_SUITE = [
+    ("startpos", START_FEN, {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+]
+
+
+def perft(position, depth):
+    moves = position.legal_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        position.make_move(move)
+        nodes += perft(position, depth - 1)
+        position.unmake_move()
+    return nodes
+
+
+def perft_checked(position, depth):
+    # perft that compares Position's incremental evaluation terms with a full
+    # recompute at every node, leaves included, and again after each unmake
+    check_terms(position)
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in position.legal_moves():
+        position.make_move(move)
+        nodes += perft_checked(position, depth - 1)
+        position.unmake_move()
+        check_terms(position)
+    return nodes
+
+
+def divide(position, depth):
+    # Split perft: node count below each root move
+    results = {}
+    for move in position.legal_moves():
+        position.make_move(move)
+        results[move_to_uci(move)] = perft(position, depth - 1) if depth > 1 else 1
+        position.unmake_move()
+    return results
+
+
+def run(name, fen, depth, expected=None, split=False, check_eval=False):
+    position = parse_fen(fen)
+    start = time.perf_counter()
+    if split:
+        moves = divide(position, depth)
+        nodes = sum(moves.values())
+    else:
+        moves = None
+        nodes = perft_checked(position, depth) if check_eval else perft(position, depth) if depth > 0 else 1
+    elapsed = time.perf_counter() - start
+    record = {
+        "position": name,
+        "fen": fen,
+        "depth": depth,
+        "nodes": nodes,
+        "expected": expected,
+        "ok": expected is None or nodes == expected,
+        "seconds": round(elapsed, 6),
+        "nps": int(nodes / elapsed) if elapsed > 0 else 0,
+        "python": platform.python_version(),
+    }
+    if moves is not None:
+        record["divide"] = moves
+    return record
+
+
+def print_record(record):
+    status = "" if record["expected"] is None else ("  ok" if record["ok"] else f"  FAIL (expected {record['expected']})")
+    print(f"{record['position']:<12} depth {record['depth']}: {record['nodes']:>10} nodes "
+          f"{record['seconds']:>9.3f}s {record['nps']:>9} nps{status}")
+    for move, nodes in sorted(record.get("divide", {}).items()):
+        print(f"    {move}: {nodes}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft benchmark for the chess move generators")
+    parser.add_argument("--fen", help="run a single position instead of the reference suite")
+    parser.add_argument("--depth", type=int, help="depth for --fen, or maximum depth for the suite")
+    parser.add_argument("--divide", action="store_true", help="print node counts per root move")
+    parser.add_argument("--json", action="store_true", help="emit one JSON record per line")
+    parser.add_argument("--check-eval", action="store_true",
+                        help="check the incremental evaluation terms against a full recompute at every node")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        jobs = [("custom", args.fen, args.depth or 3, None)]
+    else:
+        max_depth = args.depth or 3
+        jobs = [(name, fen, depth, nodes)
+                for name, fen, counts in PERFT_SUITE
+                for depth, nodes in sorted(counts.items()) if depth <= max_depth]
+
+    failed = 0
+    for name, fen, depth, expected in jobs:
+        record = run(name, fen, depth, expected, args.divide, args.check_eval)
+        failed += not record["ok"]
+        if args.json:
+            print(json.dumps(record), flush=True)
+        else:
+            print_record(record)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
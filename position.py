@@ -0,0 +1,365 @@
+# Position: a complete game state with make/unmake
+#
+# The board is held twice: as the bitboards from bitboard.py (for move
+# generation and attack tests) and as a 64-entry signed byte mailbox of piece
+# indices (for "what stands on this square"). make_move pushes an undo record
+# onto the position's own history, so any number of independent positions can
+# live in one process and a search can walk the tree without copying.
+#
+# Moves are 16-bit ints: from square (6 bits), to square (6 bits) and a 4-bit
+# flag, see the move flags below. The Zobrist hash is kept up to date by every
+# board edit and move, and so are the middlegame and endgame material and
+# piece-square scores and the game phase that evaluation.evaluate blends.
+
+from array import array
+
+from bitboard import (COLOR_INDEX, KING, KNIGHT, PAWN, PAWN_ATTACKS, PIECE_INDEX, PIECES, QUEEN, ROOK, BISHOP,
+                      Bitboards, has_any_legal_move, is_king_attacked, is_square_attacked,
+                      legal_moves)
+from evaluation import EG_SCORES, MG_SCORES, PIECE_PHASE
+from zobrist import CASTLING_KEYS, EP_KEYS, PIECE_KEYS, SIDE_KEY, compute_hash
+
+EMPTY = -1
+
+# Move flags
+QUIET = 0
+DOUBLE_PUSH = 1
+KING_CASTLE = 2
+QUEEN_CASTLE = 3
+CAPTURE = 4
+EP_CAPTURE = 5
+PROMOTION = 8           # + 0..3 for knight, bishop, rook, queen; + CAPTURE when capturing
+NULL_MOVE = 0           # from == to == a8, never a real move
+
+PROMOTION_KINDS = [KNIGHT, BISHOP, ROOK, QUEEN]
+
+# Castling rights bits
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+
+# Rights that survive a move touching each square (king and rook home squares)
+CASTLING_MASK = [15] * 64
+CASTLING_MASK[60] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[63] = 15 & ~WHITE_KINGSIDE
+CASTLING_MASK[56] = 15 & ~WHITE_QUEENSIDE
+CASTLING_MASK[4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[7] = 15 & ~BLACK_KINGSIDE
+CASTLING_MASK[0] = 15 & ~BLACK_QUEENSIDE
+
+# (right, king from, king to, rook from, rook to, squares that must be empty,
+#  squares the king crosses that must not be attacked), per color
+CASTLES = [
+    [(WHITE_KINGSIDE, 60, 62, 63, 61, (61, 62), (60, 61, 62)),
+     (WHITE_QUEENSIDE, 60, 58, 56, 59, (59, 58, 57), (60, 59, 58))],
+    [(BLACK_KINGSIDE, 4, 6, 7, 5, (5, 6), (4, 5, 6)),
+     (BLACK_QUEENSIDE, 4, 2, 0, 3, (3, 2, 1), (4, 3, 2))],
+]
+
+FILES = "abcdefgh"
+
+
+def encode_move(from_sq, to_sq, flag=QUIET):
+    return from_sq | (to_sq << 6) | (flag << 12)
+
+
+def move_from(move):
+    return move & 63
+
+
+def move_to(move):
+    return (move >> 6) & 63
+
+
+def move_flag(move):
+    return move >> 12
+
+
+def square_name(sq):
+    return FILES[sq % 8] + str(8 - sq // 8)
+
+
+def parse_square(name):
+    return (8 - int(name[1])) * 8 + FILES.index(name[0])
+
+
+def move_to_uci(move):
+    text = square_name(move & 63) + square_name((move >> 6) & 63)
+    if move >> 12 & PROMOTION:
+        text += "nbrq"[(move >> 12) & 3]
+    return text
+
+
+class Position(Bitboards):
+    __slots__ = ("squares", "turn", "castling", "ep_square", "halfmove", "fullmove", "hash", "history",
+                 "mg", "eg", "phase")
+
+    def __init__(self):
+        Bitboards.__init__(self)
+        self.squares = array('b', [EMPTY] * 64)
+        self.turn = 0  # 0 white, 1 black
+        self.castling = 0
+        self.ep_square = -1
+        self.halfmove = 0
+        self.fullmove = 1
+        self.hash = 0
+        self.history = []
+        self.mg = 0     # evaluation terms from White's side, see evaluation.py
+        self.eg = 0
+        self.phase = 0
+
+    @classmethod
+    def from_grid(cls, grid, turn='w', castling=None, ep_square=-1, halfmove=0, fullmove=1):
+        position = cls()
+        for row in range(8):
+            for col in range(8):
+                if grid[row][col] != "":
+                    position.put(row * 8 + col, grid[row][col])
+        position.turn = COLOR_INDEX[turn[0]]
+        position.castling = position._home_castling() if castling is None else castling
+        position.ep_square = ep_square
+        position.halfmove = halfmove
+        position.fullmove = fullmove
+        position.hash = compute_hash(position)
+        return position
+
+    def _home_castling(self):
+        # Rights for every king and rook still standing on its home square
+        rights = 0
+        squares = self.squares
+        for color in (0, 1):
+            king = color * 6 + KING
+            rook = color * 6 + ROOK
+            for right, king_from, _, rook_from, _, _, _ in CASTLES[color]:
+                if squares[king_from] == king and squares[rook_from] == rook:
+                    rights |= right
+        return rights
+
+    def copy(self):
+        position = Position()
+        position.pieces = self.pieces[:]
+        position.occupied = self.occupied[:]
+        position.occupancy = self.occupancy
+        position.squares = array('b', self.squares)
+        position.turn = self.turn
+        position.castling = self.castling
+        position.ep_square = self.ep_square
+        position.halfmove = self.halfmove
+        position.fullmove = self.fullmove
+        position.hash = self.hash
+        position.history = self.history[:]
+        position.mg = self.mg
+        position.eg = self.eg
+        position.phase = self.phase
+        return position
+
+    # Square access. put/remove/place edit the board outside of make_move and
+    # are not recorded in the history.
+
+    def _add(self, sq, index):
+        mask = 1 << sq
+        self.pieces[index] |= mask
+        self.occupied[index // 6] |= mask
+        self.occupancy |= mask
+        self.squares[sq] = index
+        key = index * 64 + sq
+        self.hash ^= PIECE_KEYS[key]
+        self.mg += MG_SCORES[key]
+        self.eg += EG_SCORES[key]
+        self.phase += PIECE_PHASE[index]
+
+    def _clear(self, sq, index):
+        mask = ~(1 << sq)
+        self.pieces[index] &= mask
+        self.occupied[index // 6] &= mask
+        self.occupancy &= mask
+        self.squares[sq] = EMPTY
+        key = index * 64 + sq
+        self.hash ^= PIECE_KEYS[key]
+        self.mg -= MG_SCORES[key]
+        self.eg -= EG_SCORES[key]
+        self.phase -= PIECE_PHASE[index]
+
+    def put(self, sq, piece):
+        self._add(sq, PIECE_INDEX[piece])
+
+    def remove(self, sq, piece):
+        self._clear(sq, PIECE_INDEX[piece])
+
+    def piece_at(self, sq):
+        index = self.squares[sq]
+        return PIECES[index] if index != EMPTY else ""
+
+    def place(self, sq, piece):
+        index = self.squares[sq]
+        if index != EMPTY:
+            self._clear(sq, index)
+        if piece != "":
+            self._add(sq, PIECE_INDEX[piece])
+
+    def set_castling(self, castling):
+        self.hash ^= CASTLING_KEYS[self.castling] ^ CASTLING_KEYS[castling]
+        self.castling = castling
+
+    # Making and unmaking moves
+
+    def make_move(self, move):
+        from_sq = move & 63
+        to_sq = (move >> 6) & 63
+        flag = move >> 12
+        squares = self.squares
+        index = squares[from_sq]
+        captured = squares[to_sq]
+        self.history.append((move, captured, self.castling, self.ep_square, self.halfmove, self.hash))
+
+        if flag == EP_CAPTURE:
+            capture_sq = to_sq + 8 if self.turn == 0 else to_sq - 8
+            self._clear(capture_sq, squares[capture_sq])
+        elif captured != EMPTY:
+            self._clear(to_sq, captured)
+        self._clear(from_sq, index)
+        if flag & PROMOTION:
+            self._add(to_sq, self.turn * 6 + PROMOTION_KINDS[flag & 3])
+        else:
+            self._add(to_sq, index)
+        if flag == KING_CASTLE or flag == QUEEN_CASTLE:
+            _, _, _, rook_from, rook_to, _, _ = CASTLES[self.turn][flag - KING_CASTLE]
+            self._clear(rook_from, self.turn * 6 + ROOK)
+            self._add(rook_to, self.turn * 6 + ROOK)
+
+        key = self.hash ^ SIDE_KEY ^ CASTLING_KEYS[self.castling]
+        if self.ep_square >= 0:
+            key ^= EP_KEYS[self.ep_square & 7]
+        self.castling &= CASTLING_MASK[from_sq] & CASTLING_MASK[to_sq]
+        key ^= CASTLING_KEYS[self.castling]
+        if flag == DOUBLE_PUSH:
+            self.ep_square = (from_sq + to_sq) // 2
+            key ^= EP_KEYS[self.ep_square & 7]
+        else:
+            self.ep_square = -1
+        self.hash = key
+        if index % 6 == PAWN or captured != EMPTY or flag == EP_CAPTURE:
+            self.halfmove = 0
+        else:
+            self.halfmove += 1
+        if self.turn == 1:
+            self.fullmove += 1
+        self.turn ^= 1
+
+    def unmake_move(self):
+        move, captured, self.castling, self.ep_square, self.halfmove, key = self.history.pop()
+        self.turn ^= 1
+        if self.turn == 1:
+            self.fullmove -= 1
+        if move == NULL_MOVE:
+            self.hash = key
+            return
+        from_sq = move & 63
+        to_sq = (move >> 6) & 63
+        flag = move >> 12
+
+        if flag == KING_CASTLE or flag == QUEEN_CASTLE:
+            _, _, _, rook_from, rook_to, _, _ = CASTLES[self.turn][flag - KING_CASTLE]
+            self._clear(rook_to, self.turn * 6 + ROOK)
+            self._add(rook_from, self.turn * 6 + ROOK)
+        moved = self.squares[to_sq]
+        self._clear(to_sq, moved)
+        self._add(from_sq, self.turn * 6 + PAWN if flag & PROMOTION else moved)
+        if flag == EP_CAPTURE:
+            self._add(to_sq + 8 if self.turn == 0 else to_sq - 8, (self.turn ^ 1) * 6 + PAWN)
+        elif captured != EMPTY:
+            self._add(to_sq, captured)
+        self.hash = key
+
+    def make_null_move(self):
+        # Pass the turn, e.g. after a quantum collapse
+        self.history.append((NULL_MOVE, EMPTY, self.castling, self.ep_square, self.halfmove, self.hash))
+        self.hash ^= SIDE_KEY
+        if self.ep_square >= 0:
+            self.hash ^= EP_KEYS[self.ep_square & 7]
+        self.ep_square = -1
+        self.halfmove += 1
+        if self.turn == 1:
+            self.fullmove += 1
+        self.turn ^= 1
+
+    # Move generation
+
+    def legal_moves(self):
+        color = self.turn
+        squares = self.squares
+        moves = []
+        last_row = 0 if color == 0 else 7
+        for from_sq, destinations in legal_moves(self, color):
+            is_pawn = squares[from_sq] % 6 == PAWN
+            while destinations:
+                low = destinations & -destinations
+                destinations ^= low
+                to_sq = low.bit_length() - 1
+                flag = CAPTURE if squares[to_sq] != EMPTY else QUIET
+                if is_pawn:
+                    if to_sq // 8 == last_row:
+                        for promotion in range(4):
+                            moves.append(from_sq | (to_sq << 6) | ((PROMOTION | flag | promotion) << 12))
+                        continue
+                    if abs(to_sq - from_sq) == 16:
+                        flag = DOUBLE_PUSH
+                moves.append(from_sq | (to_sq << 6) | (flag << 12))
+        moves.extend(self._special_moves())
+        return moves
+
+    def _special_moves(self):
+        # En passant captures and castling, which the bitboard generator
+        # does not know about
+        color = self.turn
+        moves = []
+        if self.ep_square >= 0:
+            ep = self.ep_square
+            pawn = color * 6 + PAWN
+            capture_sq = ep + 8 if color == 0 else ep - 8
+            attackers = PAWN_ATTACKS[color ^ 1][ep] & self.pieces[pawn]
+            # The square can be taken by then if a quantum piece collapsed onto it
+            if self.squares[capture_sq] != (color ^ 1) * 6 + PAWN or self.squares[ep] != EMPTY:
+                attackers = 0
+            while attackers:
+                low = attackers & -attackers
+                attackers ^= low
+                from_sq = low.bit_length() - 1
+                # Try it: an en passant capture can uncover a check along the rank
+                self._clear(from_sq, pawn)
+                self._clear(capture_sq, (color ^ 1) * 6 + PAWN)
+                self._add(ep, pawn)
+                safe = not is_king_attacked(self, color)
+                self._clear(ep, pawn)
+                self._add(capture_sq, (color ^ 1) * 6 + PAWN)
+                self._add(from_sq, pawn)
+                if safe:
+                    moves.append(from_sq | (ep << 6) | (EP_CAPTURE << 12))
+        if self.castling:
+            king = color * 6 + KING
+            rook = color * 6 + ROOK
+            for flag, (right, king_from, king_to, rook_from, _, empty, path) in enumerate(CASTLES[color], KING_CASTLE):
+                if not self.castling & right:
+                    continue
+                if self.squares[king_from] != king or self.squares[rook_from] != rook:
+                    continue
+                if any(self.squares[sq] != EMPTY for sq in empty):
+                    continue
+                if any(is_square_attacked(self, sq, color ^ 1) for sq in path):
+                    continue
+                moves.append(king_from | (king_to << 6) | (flag << 12))
+        return moves
+
+    def has_legal_move(self):
+        return has_any_legal_move(self, self.turn) or bool(self._special_moves())
+
+    def in_check(self):
+        return is_king_attacked(self, self.turn)
+
+    def repetitions(self):
+        # How many times the current position occurred before, looking back
+        # only as far as the last capture or pawn move
+        count = 0
+        history = self.history
+        for back in range(2, min(self.halfmove, len(history)) + 1, 2):
+            if history[-back][5] == self.hash:
+                count += 1
+        return count
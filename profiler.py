@@ -0,0 +1,257 @@
+# Opt-in frame profiler for Chess.py and QuantamChess.py
+#
+#   python Chess.py --profile frames.jsonl        profile from the start, write
+#                                                 the samples on exit
+#   F3 in either game                             profiling and overlay on/off
+#   F4 in either game                             write the samples so far
+#   python profiler.py frames.jsonl               summarise an export
+#
+# Two kinds of measurement:
+#
+#   phases    the main loop marks where events, logic, render and flip begin;
+#             the time up to the next mark is added to that phase. Frames
+#             start with "wait", the time clock.tick sleeps.
+#   probes    the hot functions of the rules (move generation, check tests,
+#             trial moves and the engine calls the front ends make) are
+#             swapped for wrappers that count calls and time them. Every
+#             module that imported one by name gets the wrapper too.
+#
+# Nothing is wrapped while profiling is off: start() installs the probes and
+# stop() puts the original functions back, so the rules run exactly the code
+# they run without a profiler. The main loop only tests profile.active.
+#
+# Each frame is one sample, exported as a JSON line:
+#   {"frame": 12, "ms": 16.7, "phases": {"wait": 14.1, ...},
+#    "calls": {"bitboard.is_square_attacked": [count, ms], ...}}
+
+import argparse
+import json
+import sys
+import time
+from collections import deque
+
+import bitboard
+import engine
+import position
+
+# (category, owner, attribute): owner is a module or a class
+PROBES = [
+    ("movegen", bitboard, "piece_moves"),
+    ("movegen", bitboard, "legal_piece_moves"),
+    ("movegen", bitboard, "legal_moves"),
+    ("movegen", bitboard, "has_any_legal_move"),
+    ("movegen", position.Position, "legal_moves"),
+    ("movegen", position.Position, "has_legal_move"),
+    ("checks", bitboard, "attackers_to"),
+    ("checks", bitboard, "is_square_attacked"),
+    ("checks", bitboard, "is_king_attacked"),
+    ("trials", bitboard, "_leaves_king_safe"),
+    ("trials", position.Position, "make_move"),
+    ("trials", position.Position, "make_null_move"),
+    ("engine", engine, "game_status"),
+    ("engine", engine, "get_legal_moves"),
+    ("engine", engine, "get_possible_moves"),
+    ("engine", engine, "allowed_moves"),
+    ("engine", engine, "is_in_check"),
+    ("engine", engine, "has_any_moves"),
+    ("engine", engine, "split_targets"),
+    ("engine", engine, "quantum_squares"),
+]
+
+CATEGORIES = ("movegen", "checks", "trials")
+PHASES = ("wait", "events", "logic", "render", "flip")
+MAX_SAMPLES = 36000      # ten minutes at 60 frames/s
+OVERLAY_FRAMES = 30      # the overlay averages this many frames
+OVERLAY_EVERY = 15       # and is redrawn every this many frames
+
+
+def probe_name(owner, attribute):
+    return f"{getattr(owner, '__name__', owner)}.{attribute}"
+
+
+def _probe(calls, name, function):
+    perf_counter = time.perf_counter
+
+    def probe(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stat = calls[name]
+            stat[0] += 1
+            stat[1] += perf_counter() - start
+    probe.__wrapped__ = function
+    return probe
+
+
+class FrameProfiler:
+    __slots__ = ("active", "samples", "calls", "phases", "phase_name", "phase_start", "frame_start", "frames",
+                 "patches", "overlay_lines", "overlay_frame")
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.active = False
+        self.samples = deque(maxlen=max_samples)
+        self.calls = {probe_name(owner, attribute): [0, 0.0] for _, owner, attribute in PROBES}
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.phase_name = None
+        self.phase_start = 0.0
+        self.frame_start = None
+        self.frames = 0
+        self.patches = []       # (namespace, name, original) to put back
+        self.overlay_lines = []
+        self.overlay_frame = -OVERLAY_EVERY
+
+    def __len__(self):
+        return len(self.samples)
+
+    # Probes
+
+    def start(self):
+        if self.active:
+            return
+        for _, owner, attribute in PROBES:
+            original = vars(owner)[attribute]
+            wrapper = _probe(self.calls, probe_name(owner, attribute), original)
+            if isinstance(owner, type):
+                self.patches.append((owner, attribute, original))
+                setattr(owner, attribute, wrapper)
+                continue
+            # Rebind the name in every module that imported the function
+            for module in list(sys.modules.values()):
+                namespace = getattr(module, "__dict__", None)
+                if namespace is not None and namespace.get(attribute) is original:
+                    self.patches.append((module, attribute, original))
+                    setattr(module, attribute, wrapper)
+        self.active = True
+        self.frame_start = None
+
+    def stop(self):
+        for owner, attribute, original in reversed(self.patches):
+            setattr(owner, attribute, original)
+        self.patches = []
+        self.active = False
+        self.frame_start = None
+        self.overlay_lines = []
+
+    # Frames and phases
+
+    def frame(self):
+        # Close the previous frame, if one is open, and open a new one in
+        # the "wait" phase; call it right before clock.tick
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.phases[self.phase_name] += now - self.phase_start
+            self.samples.append({
+                "frame": self.frames,
+                "ms": round((now - self.frame_start) * 1000, 3),
+                "phases": {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()},
+                "calls": {name: [count, round(seconds * 1000, 3)]
+                          for name, (count, seconds) in self.calls.items() if count},
+            })
+            self.frames += 1
+        for name in self.phases:
+            self.phases[name] = 0.0
+        for stat in self.calls.values():
+            stat[0] = 0
+            stat[1] = 0.0
+        self.frame_start = self.phase_start = now
+        self.phase_name = "wait"
+
+    def phase(self, name):
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.phases[self.phase_name] += now - self.phase_start
+        self.phase_name = name
+        self.phase_start = now
+
+    # Output
+
+    def overlay(self):
+        # Lines of text summarising the last OVERLAY_FRAMES frames; they only
+        # change every OVERLAY_EVERY frames so the overlay stays readable
+        if self.frames - self.overlay_frame >= OVERLAY_EVERY and self.samples:
+            self.overlay_frame = self.frames
+            self.overlay_lines = summary_lines(list(self.samples)[-OVERLAY_FRAMES:])
+        return self.overlay_lines
+
+    def export(self, path):
+        with open(path, "w") as f:
+            for sample in self.samples:
+                f.write(json.dumps(sample) + "\n")
+        return len(self.samples)
+
+
+def _category(name):
+    for category, owner, attribute in PROBES:
+        if probe_name(owner, attribute) == name:
+            return category
+    return None
+
+
+def summary_lines(samples):
+    # Per-frame averages over samples: frame rate, time per phase, probe
+    # calls per category and the engine call that took longest
+    count = len(samples)
+    frame_ms = sum(sample["ms"] for sample in samples) / count
+    phases = {name: sum(sample["phases"].get(name, 0.0) for sample in samples) / count for name in PHASES}
+    busy = frame_ms - phases["wait"]
+    categories = dict.fromkeys(CATEGORIES, 0)
+    engine_ms = {}
+    for sample in samples:
+        for name, (calls, ms) in sample["calls"].items():
+            category = _category(name)
+            if category in categories:
+                categories[category] += calls
+            elif category == "engine":
+                engine_ms[name] = engine_ms.get(name, 0.0) + ms
+    lines = [
+        f"{1000 / frame_ms if frame_ms else 0:.0f} fps, busy {busy:.2f} ms/frame",
+        "  ".join(f"{name} {phases[name]:.2f}" for name in PHASES[1:]),
+        "  ".join(f"{name} {categories[name] / count:.1f}" for name in CATEGORIES) + " per frame",
+    ]
+    if engine_ms:
+        name = max(engine_ms, key=engine_ms.get)
+        lines.append(f"slowest call {name.split('.')[-1]} {engine_ms[name] / count:.2f} ms/frame")
+    return lines
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarise(samples, worst=5):
+    # Offline report of an export: per phase and per probe mean, p95 and
+    # max per frame, then the slowest frames
+    print(f"{len(samples)} frames, {sum(sample['ms'] for sample in samples) / 1000:.1f}s")
+    print(f"{'':34}{'mean':>10}{'p95':>10}{'max':>10}")
+    rows = [("frame ms", [sample["ms"] for sample in samples])]
+    rows += [(f"{name} ms", [sample["phases"].get(name, 0.0) for sample in samples]) for name in PHASES]
+    names = sorted({name for sample in samples for name in sample["calls"]}, key=lambda name: (_category(name) or "", name))
+    for name in names:
+        rows.append((f"{name} calls", [sample["calls"].get(name, [0, 0.0])[0] for sample in samples]))
+        rows.append((f"{name} ms", [sample["calls"].get(name, [0, 0.0])[1] for sample in samples]))
+    for label, values in rows:
+        print(f"{label:<34}{sum(values) / len(values):>10.2f}{_percentile(values, 0.95):>10.2f}{max(values):>10.2f}")
+    print("slowest frames:")
+    for sample in sorted(samples, key=lambda sample: sample["ms"] - sample["phases"].get("wait", 0.0))[-worst:][::-1]:
+        busy = {name: ms for name, ms in sample["phases"].items() if name != "wait" and ms >= 0.01}
+        print(f"  frame {sample['frame']}: {sample['ms']:.2f} ms, " + ", ".join(f"{name} {ms:.2f}" for name, ms in busy.items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarise a frame profile written by Chess.py or QuantamChess.py")
+    parser.add_argument("path", help="a .jsonl export (--profile PATH or F4 in the game)")
+    parser.add_argument("--worst", type=int, default=5, help="how many of the slowest frames to list")
+    args = parser.parse_args(argv)
+    with open(args.path) as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    if not samples:
+        print("no frames")
+        return 1
+    summarise(samples, args.worst)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+# Sparse quantum state for QuantamChess
+#
+# A superposed piece is not on the classical Position at all: it lives here
+# as a probability distribution {square: probability}. Splitting moves
+# probability mass, measuring samples one square and puts the piece back on
+# the board. Only squares with non-zero probability are stored, so the cost
+# grows with the number of ghost squares, not with the number of boards
+# they could collapse into.
+#
+# Invariants the engine keeps on top of this: a square holds at most one
+# superposed piece and never a classical piece at the same time, and kings
+# never split.
+
+import random
+
+from bitboard import PIECES
+from zobrist import ghost_key
+
+
+class QuantumState:
+    __slots__ = ("pieces", "owner", "rng", "hash", "next_id")
+
+    def __init__(self, seed=None, rng=None):
+        self.pieces = {}  # id -> (piece index, {sq: probability})
+        self.owner = {}   # sq -> id of the piece superposed there
+        # A server holding many games passes one shared rng instead of
+        # paying for a Mersenne Twister state per game
+        self.rng = random.Random(seed) if rng is None else rng
+        self.hash = 0     # XOR of the ghost keys of every occupied square
+        self.next_id = 0
+
+    def seed(self, seed):
+        self.rng.seed(seed)
+
+    def clear(self):
+        self.pieces.clear()
+        self.owner.clear()
+        self.hash = 0
+
+    def copy(self):
+        state = QuantumState()
+        state.pieces = {piece_id: (index, dict(dist)) for piece_id, (index, dist) in self.pieces.items()}
+        state.owner = dict(self.owner)
+        state.rng.setstate(self.rng.getstate())
+        state.hash = self.hash
+        state.next_id = self.next_id
+        return state
+
+    def __len__(self):
+        return len(self.pieces)
+
+    def __contains__(self, sq):
+        return sq in self.owner
+
+    def index_at(self, sq):
+        piece_id = self.owner.get(sq)
+        return -1 if piece_id is None else self.pieces[piece_id][0]
+
+    def piece_at(self, sq):
+        index = self.index_at(sq)
+        return PIECES[index] if index >= 0 else ""
+
+    def probability(self, sq):
+        piece_id = self.owner.get(sq)
+        return 0.0 if piece_id is None else self.pieces[piece_id][1][sq]
+
+    def ghosts(self):
+        # [(sq, piece index, probability)] for every superposed square
+        return [(sq, index, p) for index, dist in self.pieces.values() for sq, p in dist.items()]
+
+    def has_color(self, color):
+        return any(index // 6 == color for index, _ in self.pieces.values())
+
+    def _set(self, piece_id, sq, probability):
+        index, dist = self.pieces[piece_id]
+        if sq not in dist:
+            self.owner[sq] = piece_id
+            self.hash ^= ghost_key(index, sq)
+        dist[sq] = probability
+
+    def _drop(self, piece_id, sq):
+        index, dist = self.pieces[piece_id]
+        del dist[sq]
+        del self.owner[sq]
+        self.hash ^= ghost_key(index, sq)
+
+    def _collapse(self, position, piece_id, sq):
+        # The piece is on sq: take it out of the state and onto the board
+        index, dist = self.pieces[piece_id]
+        for other in list(dist):
+            self._drop(piece_id, other)
+        del self.pieces[piece_id]
+        position.put(sq, PIECES[index])
+
+    def add(self, index, dist):
+        # Superpose a piece given by its index over dist {sq: probability},
+        # e.g. when rebuilding a state received from a server; returns its id
+        piece_id = self.next_id
+        self.next_id += 1
+        self.pieces[piece_id] = (index, {})
+        for sq, probability in dist.items():
+            self._set(piece_id, sq, probability)
+        return piece_id
+
+    def split(self, position, sq, targets):
+        # Spread whatever is on sq (a classical piece or one superposed
+        # square of a piece) evenly over targets; returns the piece id
+        index = position.squares[sq]
+        if index >= 0:
+            position.remove(sq, PIECES[index])
+            piece_id = self.next_id
+            self.next_id += 1
+            self.pieces[piece_id] = (index, {})
+            mass = 1.0
+        else:
+            piece_id = self.owner[sq]
+            mass = self.pieces[piece_id][1][sq]
+            self._drop(piece_id, sq)
+        dist = self.pieces[piece_id][1]
+        share = mass / len(targets)
+        for target in targets:
+            self._set(piece_id, target, dist.get(target, 0.0) + share)
+        return piece_id
+
+    def measure(self, position, piece_id, sq=None):
+        # Sample where the piece is and put it there; returns the square.
+        # Passing sq forces the outcome, e.g. when replaying a recorded game.
+        if sq is None:
+            dist = self.pieces[piece_id][1]
+            squares = list(dist)
+            sq = self.rng.choices(squares, [dist[s] for s in squares])[0]
+        self._collapse(position, piece_id, sq)
+        return sq
+
+    def resolve(self, position, sq, present=None):
+        # Measure only whether the piece superposed on sq is there. If it is,
+        # it collapses onto sq; if not, sq is dropped and the rest of its
+        # distribution renormalised. Returns True when it was there. present
+        # forces the outcome.
+        piece_id = self.owner[sq]
+        dist = self.pieces[piece_id][1]
+        if present is None:
+            present = self.rng.random() * sum(dist.values()) < dist[sq]
+        if present:
+            self._collapse(position, piece_id, sq)
+            return True
+        self._drop(piece_id, sq)
+        if len(dist) == 1:
+            self._collapse(position, piece_id, next(iter(dist)))
+        else:
+            rest = sum(dist.values())
+            for other in dist:
+                dist[other] /= rest
+        return False
@@ -0,0 +1,154 @@
+# Dirty-rectangle board renderer shared by Chess.py and QuantamChess.py
+#
+# The front ends describe each frame as 64 cells plus a list of overlays
+# (text drawn over the board) and the renderer redraws only the squares
+# whose contents changed since the last frame. It returns the rects that
+# were touched, for pygame.display.update(rects), so an idle board costs
+# almost nothing.
+#
+# A cell is (piece, ghosts, borders): the piece string or None, a tuple of
+# (piece, probability) ghosts drawn more transparent the less likely they
+# are, and a tuple of (color, width)
+# outlines. An overlay is (surface, (x, y)); text surfaces come from text()
+# so the same message is the same surface from frame to frame.
+
+import pygame
+
+GHOST_MIN_ALPHA = 48
+
+
+class BoardRenderer:
+    def __init__(self, images, square_size, light, dark):
+        self.images = images
+        self.square_size = square_size
+        self.light = light
+        self.dark = dark
+        self.background = None
+        self.ghosts = {}
+        self.fonts = {}
+        self.texts = {}
+        self.cells = None
+        self.overlays = []
+        self.invalidate()
+
+    def resize(self, images, square_size):
+        self.images = images
+        self.square_size = square_size
+        self.invalidate()
+
+    def invalidate(self):
+        # Redraw everything on the next frame, e.g. after a resize
+        size = self.square_size
+        self.background = pygame.Surface((8 * size, 8 * size))
+        self.background.fill(self.light)
+        for row in range(8):
+            for col in range(8):
+                if (row + col) % 2 == 1:
+                    self.background.fill(self.dark, (col * size, row * size, size, size))
+        self.ghosts.clear()
+        self.cells = None
+        self.overlays = []
+
+    def ghost(self, piece, probability):
+        # Transparent copy of a piece; alpha comes in steps of 16 so only a
+        # handful of copies are ever made
+        alpha = max(GHOST_MIN_ALPHA, min(255, round(probability * 255 / 16) * 16))
+        surface = self.ghosts.get((piece, alpha))
+        if surface is None:
+            surface = self.images[piece].copy()
+            surface.set_alpha(alpha)
+            self.ghosts[(piece, alpha)] = surface
+        return surface
+
+    def text(self, text, size, color, font="Arial", bold=True):
+        key = (text, size, color, font, bold)
+        surface = self.texts.get(key)
+        if surface is None:
+            font_key = (font, size, bold)
+            if font_key not in self.fonts:
+                self.fonts[font_key] = pygame.font.SysFont(font, size, bold=bold)
+            surface = self.texts[key] = self.fonts[font_key].render(text, True, color)
+        return surface
+
+    def panel(self, lines, size=18, color=(255, 255, 0), background=(0, 0, 0, 192), font=None):
+        # Lines of text on a translucent box, not cached: for text that keeps
+        # changing, like the profiler overlay, text() would keep every string
+        font_key = (font, size, False)
+        if font_key not in self.fonts:
+            self.fonts[font_key] = pygame.font.SysFont(font, size)
+        rendered = [self.fonts[font_key].render(line, True, color) for line in lines]
+        width = max((surface.get_width() for surface in rendered), default=0) + 8
+        height = sum(surface.get_height() for surface in rendered) + 8
+        surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        surface.fill(background)
+        y = 4
+        for line in rendered:
+            surface.blit(line, (4, y))
+            y += line.get_height()
+        return surface
+
+    def square_rect(self, sq):
+        size = self.square_size
+        return pygame.Rect((sq % 8) * size, (sq // 8) * size, size, size)
+
+    def _covered(self, rect):
+        # Squares under a screen rect
+        size = self.square_size
+        first_col, last_col = max(rect.left // size, 0), min((rect.right - 1) // size, 7)
+        first_row, last_row = max(rect.top // size, 0), min((rect.bottom - 1) // size, 7)
+        return {row * 8 + col for row in range(first_row, last_row + 1) for col in range(first_col, last_col + 1)}
+
+    def render(self, win, cells, overlays):
+        if self.cells is None:
+            dirty = set(range(64))
+        else:
+            previous = self.cells
+            dirty = {sq for sq in range(64) if cells[sq] != previous[sq]}
+
+        overlay_rects = [surface.get_rect(topleft=pos) for surface, pos in overlays]
+        if overlays != self.overlays:
+            # Squares under overlays that moved, changed or went away
+            for surface, pos in self.overlays:
+                dirty |= self._covered(surface.get_rect(topleft=pos))
+            for rect in overlay_rects:
+                dirty |= self._covered(rect)
+        # An overlay over a redrawn square is redrawn whole, so squares under
+        # it must be clean too or its alpha edges would blend twice
+        touched = [False] * len(overlays)
+        grown = True
+        while grown:
+            grown = False
+            for i, rect in enumerate(overlay_rects):
+                if not touched[i]:
+                    covered = self._covered(rect)
+                    if covered & dirty:
+                        touched[i] = True
+                        if not covered <= dirty:
+                            dirty |= covered
+                            grown = True
+
+        rects = []
+        if self.cells is None:
+            # Full redraw: also clear whatever lies outside the board
+            win.fill(self.light)
+            rects.append(win.get_rect())
+        images = self.images
+        for sq in sorted(dirty):
+            rect = self.square_rect(sq)
+            win.blit(self.background, rect, rect)
+            piece, ghosts, borders = cells[sq]
+            for ghost, probability in ghosts:
+                win.blit(self.ghost(ghost, probability), rect)
+            if piece is not None:
+                win.blit(images[piece], rect)
+            for color, width in borders:
+                pygame.draw.rect(win, color, rect, width)
+            if self.cells is not None:
+                rects.append(rect)
+        for i, (surface, pos) in enumerate(overlays):
+            if touched[i]:
+                win.blit(surface, pos)
+
+        self.cells = cells
+        self.overlays = overlays
+        return rects
@@ -0,0 +1,264 @@
+# Alpha-beta search for the computer opponent
+#
+# Negamax alpha-beta with iterative deepening under a time budget. Moves are
+# ordered by the transposition table move, then captures by MVV-LVA (most
+# valuable victim, least valuable attacker), then killer moves (quiet moves
+# that caused a cutoff at the same ply) and the history heuristic. Leaves
+# are resolved with a capture-only quiescence search so the evaluation is
+# never taken in the middle of an exchange.
+
+import time
+
+import tablebase
+from evaluation import PIECE_VALUES, evaluate
+from position import CAPTURE, PROMOTION
+from transposition import EXACT, LOWER, UPPER, TranspositionTable
+
+MATE = 30000
+INFINITY = 32000
+MAX_PLY = 64
+MATE_BOUND = MATE - MAX_PLY
+
+# MVV-LVA victim/attacker values by piece kind; the king is never a victim
+ORDER_VALUES = PIECE_VALUES[:5] + [10000]
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchResult:
+    __slots__ = ("move", "score", "depth", "nodes", "seconds")
+
+    def __init__(self, move, score, depth, nodes, seconds):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+
+    @property
+    def nps(self):
+        return int(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+    def __repr__(self):
+        return f"SearchResult(move={self.move}, score={self.score}, depth={self.depth}, nodes={self.nodes}, nps={self.nps})"
+
+
+def _to_tt(score, ply):
+    # Mate scores are stored relative to the node, not the root
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def _from_tt(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class Searcher:
+    def __init__(self, tt=None, memory_mb=16):
+        self.tt = tt if tt is not None else TranspositionTable(memory_mb)
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history = [[0] * 64 for _ in range(12)]
+        self.nodes = 0
+        self.deadline = 0.0
+        self.stop = None
+
+    def search(self, position, time_limit=1.0, max_depth=MAX_PLY, on_iteration=None, stop=None, root_moves=None):
+        # Best move for the side to move. on_iteration(result) is called after
+        # every completed depth. stop is anything with is_set() (e.g. a
+        # threading.Event); once set, the search ends early with the deepest
+        # completed result. root_moves restricts the moves considered at the
+        # root (quantum mode forbids some legal moves).
+        start = time.perf_counter()
+        self.deadline = start + time_limit
+        self.stop = stop
+        self.nodes = 0
+        self.tt.new_search()
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        for table in self.history:
+            for sq in range(64):
+                table[sq] //= 8
+
+        moves = position.legal_moves() if root_moves is None else list(root_moves)
+        result = SearchResult(moves[0] if moves else None, 0, 0, 0, 0.0)
+        if len(moves) <= 1:
+            result.seconds = time.perf_counter() - start
+            return result
+
+        for depth in range(1, max_depth + 1):
+            try:
+                score, move = self._root(position, moves, depth)
+            except SearchTimeout:
+                break
+            result = SearchResult(move, score, depth, self.nodes, time.perf_counter() - start)
+            if on_iteration is not None:
+                on_iteration(result)
+            # Try the best move first next iteration
+            moves.remove(move)
+            moves.insert(0, move)
+            if abs(score) >= MATE_BOUND:
+                break
+            # Another iteration takes several times longer than this one
+            if time.perf_counter() - start > time_limit * 0.5:
+                break
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def _root(self, position, moves, depth):
+        alpha = -INFINITY
+        best = moves[0]
+        for move in moves:
+            position.make_move(move)
+            try:
+                score = -self._negamax(position, depth - 1, -INFINITY, -alpha, 1)
+            finally:
+                position.unmake_move()
+            if score > alpha:
+                alpha = score
+                best = move
+        self.tt.store(position.hash, best, alpha, depth, EXACT)
+        return alpha, best
+
+    def _check_time(self):
+        if time.perf_counter() > self.deadline or (self.stop is not None and self.stop.is_set()):
+            raise SearchTimeout()
+
+    def _negamax(self, position, depth, alpha, beta, ply):
+        self.nodes += 1
+        if not self.nodes & 255:
+            self._check_time()
+        if position.halfmove >= 100 or position.repetitions():
+            return 0
+
+        in_check = position.in_check()
+        if in_check and ply < MAX_PLY:
+            depth += 1
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiesce(position, alpha, beta, ply)
+
+        key = position.hash
+        tt_move = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_move, tt_score, tt_depth, bound = entry
+            if tt_depth >= depth:
+                tt_score = _from_tt(tt_score, ply)
+                if bound == EXACT or (bound == LOWER and tt_score >= beta) or (bound == UPPER and tt_score <= alpha):
+                    return tt_score
+
+        moves = position.legal_moves()
+        if not moves:
+            return -MATE + ply if in_check else 0
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = 0
+        for move in self._order(position, moves, tt_move, ply):
+            position.make_move(move)
+            try:
+                score = -self._negamax(position, depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                position.unmake_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if not (move >> 12) & CAPTURE:
+                            killers = self.killers[ply]
+                            if killers[0] != move:
+                                killers[1] = killers[0]
+                                killers[0] = move
+                            self.history[position.squares[move & 63]][(move >> 6) & 63] += depth * depth
+                        break
+
+        if best_score >= beta:
+            bound = LOWER
+        elif best_score > original_alpha:
+            bound = EXACT
+        else:
+            bound = UPPER
+        self.tt.store(key, best_move, _to_tt(best_score, ply), depth, bound)
+        return best_score
+
+    def _quiesce(self, position, alpha, beta, ply):
+        self.nodes += 1
+        if not self.nodes & 255:
+            self._check_time()
+        stand_pat = evaluate(position)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+
+        squares = position.squares
+        captures = []
+        for move in position.legal_moves():
+            flag = move >> 12
+            if flag & CAPTURE or flag == PROMOTION + 3:
+                captures.append(move)
+        captures.sort(key=lambda move: self._capture_score(squares, move), reverse=True)
+        for move in captures:
+            position.make_move(move)
+            try:
+                score = -self._quiesce(position, -beta, -alpha, ply + 1)
+            finally:
+                position.unmake_move()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    @staticmethod
+    def _capture_score(squares, move):
+        victim = squares[(move >> 6) & 63]
+        # En passant lands on an empty square but always takes a pawn
+        victim_value = ORDER_VALUES[victim % 6] if victim >= 0 else ORDER_VALUES[0]
+        return 10 * victim_value - ORDER_VALUES[squares[move & 63] % 6]
+
+    def _order(self, position, moves, tt_move, ply):
+        squares = position.squares
+        killers = self.killers[ply]
+        history = self.history
+        scored = []
+        for move in moves:
+            flag = move >> 12
+            if move == tt_move:
+                score = 1 << 30
+            elif flag & CAPTURE:
+                score = (1 << 28) + self._capture_score(squares, move)
+            elif flag & PROMOTION:
+                score = (1 << 27) + (flag & 3)
+            elif move == killers[0]:
+                score = (1 << 26) + 1
+            elif move == killers[1]:
+                score = 1 << 26
+            else:
+                score = history[squares[move & 63]][(move >> 6) & 63]
+            scored.append((score, move))
+        scored.sort(reverse=True)
+        return [move for _, move in scored]
+
+
+def choose_move(position, time_limit=1.0, searcher=None):
+    # Pick a move for the side to move; returns a SearchResult. Endgames the
+    # tablebases cover (tablebase.py) are answered from them without a search.
+    found = tablebase.best_move(position)
+    if found is not None:
+        move, result, plies = found
+        score = MATE - plies if result == tablebase.WIN else -MATE + plies if result == tablebase.LOSS else 0
+        return SearchResult(move, score, 0, 0, 0.0)
+    if searcher is None:
+        searcher = Searcher()
+    return searcher.search(position, time_limit)
@@ -0,0 +1,244 @@
+# Headless self-play across a process pool
+#
+#   python selfplay.py --games 200 --out games.jsonl
+#   python selfplay.py --games 200 --rules quantum --white engine --black random --depth 2 --out q.jsonl
+#   python selfplay.py --games 200 --white engine --black engine --book book.bin --tablebases
+#
+# Plays N games on the engine rules, classical (Chess.py) or quantum
+# (QuantamChess.py), with random or engine players. Game i uses seed + i,
+# so a game replays identically whichever worker picks it up (engine
+# players are depth-limited for the same reason). Every finished game is
+# appended to the output as one JSON line straight away. Rerunning with the
+# same --out skips games already in the file, so an interrupted run resumes
+# where it stopped.
+#
+# Moves are UCI strings ("e2e4", "e7e8q"); quantum actions are written
+# "S" + from + targets for a split ("Sg1f3h3") and "M" + ghost + landing
+# square for a measurement ("Mf3h3").
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import engine
+import tablebase
+from book import Book
+from position import CAPTURE, move_to_uci, square_name
+from search import Searcher
+
+PLAYERS = ("random", "engine")
+
+
+def _ghosts_of(color):
+    return [sq for sq, index, _ in engine.quantum.ghosts() if index // 6 == color]
+
+
+def _random_split(rng):
+    # A random split for the side to move, or None if nothing can split
+    position = engine.position
+    color = position.turn
+    candidates = [sq for sq in range(64) if position.squares[sq] >= 0 and position.squares[sq] // 6 == color]
+    candidates += _ghosts_of(color)
+    rng.shuffle(candidates)
+    for sq in candidates:
+        targets = engine.split_targets(sq // 8, sq % 8)
+        if len(targets) >= 2:
+            return sq, rng.sample(targets, 2)
+    return None
+
+
+_books = {}
+
+
+def _book(path):
+    # One open Book per path and worker process
+    if path not in _books:
+        _books[path] = Book(path)
+    return _books[path]
+
+
+def _choose(player, rng, searcher, config):
+    # ("move", move) | ("split", sq, targets) | ("measure", sq) | None
+    color = engine.position.turn
+    ghosts = _ghosts_of(color)
+    moves = engine.allowed_moves()
+    if config["rules"] == "quantum" and player == "random":
+        roll = rng.random()
+        if ghosts and roll < config["measure_rate"]:
+            return ("measure", rng.choice(ghosts))
+        if roll > 1.0 - config["split_rate"]:
+            split = _random_split(rng)
+            if split is not None:
+                return ("split",) + split
+    if not moves:
+        return ("measure", rng.choice(ghosts)) if ghosts else None
+    if player == "random":
+        return ("move", rng.choice(moves))
+    if config["book"] and not engine.quantum:
+        move = _book(config["book"]).choose(engine.position, rng)
+        if move in moves:
+            return ("move", move)
+    if config["tablebases"] and not engine.quantum:
+        found = tablebase.best_move(engine.position, moves)
+        if found is not None:
+            return ("move", found[0])
+    result = searcher.search(engine.position, config["movetime"], max_depth=config["depth"], root_moves=moves)
+    return ("move", result.move)
+
+
+def _termination():
+    # (result, termination) once the game is over, else None
+    status = engine.game_status()
+    if status.winner is not None:
+        reason = "checkmate" if status.kings[0] and status.kings[1] else "king-captured"
+        return ("1-0" if status.winner == 'w' else "0-1"), reason
+    if status.stalemate:
+        return "1/2-1/2", "stalemate"
+    if engine.position.halfmove >= 100:
+        return "1/2-1/2", "fifty-move"
+    if engine.position.repetitions() >= 2:
+        return "1/2-1/2", "repetition"
+    return None
+
+
+def play_game(task):
+    game_id, seed, config = task
+    rng = random.Random(seed)
+    engine.reset(seed)
+    players = (config["white"], config["black"])
+    searcher = Searcher(memory_mb=1) if "engine" in players else None
+    moves = []
+    collapses = []
+    start = time.perf_counter()
+
+    while True:
+        ended = _termination()
+        if ended is not None:
+            result, termination = ended
+            break
+        if len(moves) >= config["max_plies"]:
+            result, termination = "1/2-1/2", "max-plies"
+            break
+        action = _choose(players[engine.position.turn], rng, searcher, config)
+        if action is None:
+            # Only moves the quantum rules forbid are left
+            result, termination = "1/2-1/2", "no-moves"
+            break
+
+        ply = len(moves)
+        if action[0] == "move":
+            move = action[1]
+            to_sq = (move >> 6) & 63
+            on_ghost = to_sq in engine.quantum
+            played = engine.play_move(move)
+            moves.append(move_to_uci(move))
+            if on_ghost:
+                present = played is not None and bool((played >> 12) & CAPTURE)
+                collapses.append({"ply": ply, "kind": "capture", "square": square_name(to_sq), "present": present})
+        elif action[0] == "split":
+            _, sq, targets = action
+            engine.split((sq // 8, sq % 8), targets)
+            moves.append("S" + square_name(sq) + "".join(square_name(row * 8 + col) for row, col in targets))
+        else:
+            sq = action[1]
+            row, col = engine.measure(sq // 8, sq % 8)
+            moves.append("M" + square_name(sq) + square_name(row * 8 + col))
+            collapses.append({"ply": ply, "kind": "measure", "square": square_name(sq),
+                              "landed": square_name(row * 8 + col)})
+
+    return {
+        "game": game_id,
+        "seed": seed,
+        "rules": config["rules"],
+        "white": config["white"],
+        "black": config["black"],
+        "result": result,
+        "termination": termination,
+        "plies": len(moves),
+        "moves": moves,
+        "collapses": collapses,
+        "seconds": round(time.perf_counter() - start, 4),
+        "worker": os.getpid(),
+    }
+
+
+def finished_games(path):
+    # Game ids already in the output. A half-written last line from an
+    # interrupted run is cut off so appending starts on a clean line.
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            done.add(json.loads(line)["game"])
+        except (ValueError, KeyError):
+            continue
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless self-play across a process pool")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--rules", choices=("classical", "quantum"), default="classical")
+    parser.add_argument("--white", choices=PLAYERS, default="random")
+    parser.add_argument("--black", choices=PLAYERS, default="random")
+    parser.add_argument("--seed", type=int, default=0, help="game i is played with seed + i")
+    parser.add_argument("--depth", type=int, default=2, help="engine search depth")
+    parser.add_argument("--movetime", type=float, default=10.0, help="engine time cap per move in seconds")
+    parser.add_argument("--max-plies", type=int, default=300)
+    parser.add_argument("--split-rate", type=float, default=0.1, help="quantum rules: chance a random player splits")
+    parser.add_argument("--measure-rate", type=float, default=0.1, help="quantum rules: chance a random player measures")
+    parser.add_argument("--book", help="opening book for engine players (see book.py)")
+    parser.add_argument("--tablebases", action="store_true", help="engine players play endgames from tablebase.py")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--out", default="selfplay.jsonl")
+    args = parser.parse_args(argv)
+
+    config = {"rules": args.rules, "white": args.white, "black": args.black, "depth": args.depth,
+              "movetime": args.movetime, "max_plies": args.max_plies, "split_rate": args.split_rate,
+              "measure_rate": args.measure_rate, "book": args.book, "tablebases": args.tablebases}
+    done = finished_games(args.out)
+    tasks = [(game_id, args.seed + game_id, config) for game_id in range(args.games) if game_id not in done]
+    if done:
+        print(f"resuming: {len(done)} games already in {args.out}, {len(tasks)} to play", file=sys.stderr)
+
+    results = {"1-0": 0, "0-1": 0, "1/2-1/2": 0}
+    plies = 0
+    start = time.perf_counter()
+    with open(args.out, "a") as out:
+        if args.workers == 1:
+            records = map(play_game, tasks)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(args.workers)
+            records = pool.imap_unordered(play_game, tasks)
+        try:
+            for record in records:
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                results[record["result"]] += 1
+                plies += record["plies"]
+        finally:
+            if pool is not None:
+                pool.terminate()
+    elapsed = time.perf_counter() - start
+
+    games = len(tasks)
+    rate = games / elapsed if elapsed > 0 else 0.0
+    print(f"{games} games in {elapsed:.2f}s: {rate:.2f} games/s, {rate / args.workers:.2f} games/s per core "
+          f"({args.workers} workers), {plies / max(games, 1):.1f} plies/game")
+    print(f"white {results['1-0']}  black {results['0-1']}  draws {results['1/2-1/2']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,476 @@
+# Asyncio game server hosting many concurrent games
+#
+#   python server.py [--host 127.0.0.1] [--port 8765]
+#   python server.py --bench 5000                 memory per game and request latency
+#   python QuantamChess.py --connect 127.0.0.1:8765 [game]
+#
+# The protocol is newline-delimited JSON over TCP, one object per line.
+#
+#   client -> server
+#     {"op": "new", "rules": "quantum"}        open a game and play white ("classical" allows no splits)
+#     {"op": "join", "game": 7}                take black in game 7
+#     {"op": "move", "move": "e7e8q"}          UCI; a pawn promotes to a queen when no letter is given
+#     {"op": "split", "from": "g1", "to": ["f3", "h3"]}
+#     {"op": "measure", "square": "f3"}
+#     {"op": "state"}                          send the state again
+#
+#   server -> client
+#     {"op": "state", "game": 7, "color": "white", "rules": "quantum", "fen": "...",
+#      "ghosts": [["wn", {"f3": 0.5, "h3": 0.5}]], "last": "g1f3", "opponent": true,
+#      "status": "playing" | "check" | "1-0" | "0-1" | "1/2-1/2"}
+#     {"op": "error", "message": "..."}
+#
+# The server is authoritative: every request is checked against the rules of
+# its game (an engine.Game), measurements are sampled here, and both players
+# are sent the new state after every change. A game is just a Position and a
+# QuantumState, and all games share one random source, so an idle game costs
+# about as much as its board. Requests are handled synchronously between
+# awaits, so the games need no locks.
+
+import argparse
+import asyncio
+import json
+import queue
+import random
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+from bitboard import PIECE_INDEX, PIECES
+from engine import Game, GameStatus, new_position
+from notation import parse_fen, to_fen
+from position import move_to_uci, parse_square, square_name
+from quantum import QuantumState
+
+HOST = "127.0.0.1"
+PORT = 8765
+COLORS = ("white", "black")
+
+
+class RequestError(Exception):
+    pass
+
+
+class ServerGame:
+    __slots__ = ("id", "game", "rules", "players", "last", "status")
+
+    def __init__(self, game_id, rules, rng):
+        self.id = game_id
+        self.game = Game(new_position(), QuantumState(rng=rng))
+        self.rules = rules
+        self.players = [None, None]  # Player per color
+        self.last = None             # last action, as in selfplay.py records
+        self.status = "playing"
+
+
+class Player:
+    # One connection; writer is anything with write(bytes)
+    __slots__ = ("writer", "game", "color")
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.game = None
+        self.color = None
+
+    def send(self, message):
+        self.writer.write(message if isinstance(message, bytes) else _encode(message))
+
+
+def _encode(message):
+    return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+
+def _square(name):
+    if not isinstance(name, str) or len(name) != 2 or name[0] not in "abcdefgh" or name[1] not in "12345678":
+        raise RequestError(f"bad square {name!r}")
+    return parse_square(name)
+
+
+def status(game):
+    position = game.position
+    result = GameStatus(game)
+    if result.winner is not None:
+        return "1-0" if result.winner == 'w' else "0-1"
+    if result.stalemate or position.halfmove >= 100 or position.repetitions() >= 2:
+        return "1/2-1/2"
+    return "check" if result.checks[position.turn] else "playing"
+
+
+async def _read_line(reader):
+    # The next line, b"" at the end of the stream, or None for a line longer
+    # than the stream limit, which is skipped whole even if the rest of it
+    # has not arrived yet
+    overrun = False
+    while True:
+        try:
+            line = await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            line = e.partial
+        except asyncio.LimitOverrunError as e:
+            await reader.readexactly(e.consumed)
+            overrun = True
+            continue
+        return None if overrun else line
+
+
+class GameServer:
+    def __init__(self, rng=None):
+        self.games = {}
+        self.next_id = 1
+        # Outcomes are drawn from the OS, so clients cannot predict them
+        self.rng = random.SystemRandom() if rng is None else rng
+        self.requests = 0
+        self.seconds = 0.0
+
+    def state(self, server_game, color):
+        return self._state(server_game, to_fen(server_game.game.position), color)
+
+    def _state(self, server_game, fen, color):
+        return {"op": "state", "game": server_game.id, "color": COLORS[color], "rules": server_game.rules,
+                "fen": fen,
+                "ghosts": [[PIECES[index], {square_name(sq): p for sq, p in dist.items()}]
+                           for index, dist in server_game.game.quantum.pieces.values()],
+                "last": server_game.last, "opponent": server_game.players[color ^ 1] is not None,
+                "status": server_game.status}
+
+    def broadcast(self, server_game):
+        fen = to_fen(server_game.game.position)
+        for color, player in enumerate(server_game.players):
+            if player is not None:
+                player.send(self._state(server_game, fen, color))
+
+    def changed(self, server_game, last):
+        # After a move, split or measurement: rate the game once, tell both
+        server_game.last = last
+        server_game.status = status(server_game.game)
+        self.broadcast(server_game)
+
+    def handle(self, player, request):
+        # Apply one request from player and send the replies
+        start = time.perf_counter()
+        try:
+            if not isinstance(request, dict):
+                raise RequestError("requests are JSON objects")
+            op = request.get("op")
+            handler = getattr(self, "_op_" + op, None) if isinstance(op, str) else None
+            if handler is None:
+                raise RequestError(f"unknown op {op!r}")
+            handler(player, request)
+        except RequestError as e:
+            player.send({"op": "error", "message": str(e)})
+        self.requests += 1
+        self.seconds += time.perf_counter() - start
+
+    def leave(self, player):
+        server_game = player.game
+        if server_game is None:
+            return
+        server_game.players[player.color] = None
+        player.game = None
+        if server_game.players == [None, None]:
+            del self.games[server_game.id]
+        else:
+            self.broadcast(server_game)
+
+    def _op_new(self, player, request):
+        rules = request.get("rules", "quantum")
+        if not isinstance(rules, str) or rules not in ("quantum", "classical"):
+            raise RequestError(f"unknown rules {rules!r}")
+        self.leave(player)
+        server_game = ServerGame(self.next_id, rules, self.rng)
+        self.next_id += 1
+        self.games[server_game.id] = server_game
+        self._seat(player, server_game, 0)
+
+    def _op_join(self, player, request):
+        game_id = request.get("game")
+        server_game = self.games.get(game_id) if isinstance(game_id, int) and not isinstance(game_id, bool) else None
+        if server_game is None:
+            raise RequestError(f"no game {game_id!r}")
+        if player.game is server_game:
+            # leave() would end the game before the player sat down again
+            raise RequestError(f"already in game {server_game.id}")
+        if None not in server_game.players:
+            raise RequestError(f"game {server_game.id} is full")
+        self.leave(player)
+        self._seat(player, server_game, server_game.players.index(None))
+
+    def _seat(self, player, server_game, color):
+        server_game.players[color] = player
+        player.game = server_game
+        player.color = color
+        self.broadcast(server_game)
+
+    def _op_state(self, player, request):
+        if player.game is None:
+            raise RequestError("not in a game")
+        player.send(self.state(player.game, player.color))
+
+    def _turn(self, player):
+        # The game, once it is player's turn to act in it
+        server_game = player.game
+        if server_game is None:
+            raise RequestError("not in a game")
+        if None in server_game.players:
+            raise RequestError("waiting for an opponent")
+        if server_game.game.position.turn != player.color:
+            raise RequestError("not your turn")
+        if server_game.status not in ("playing", "check"):
+            raise RequestError("the game is over")
+        return server_game
+
+    def _op_move(self, player, request):
+        server_game = self._turn(player)
+        text = request.get("move")
+        if not isinstance(text, str) or len(text) not in (4, 5) or (len(text) == 5 and text[4] not in "nbrq"):
+            raise RequestError(f"bad move {text!r}")
+        from_sq, to_sq = _square(text[0:2]), _square(text[2:4])
+        promotion = "nbrq".index(text[4]) if len(text) == 5 else 3
+        move = server_game.game.play(from_sq, to_sq, promotion)
+        if move is None:
+            raise RequestError(f"illegal move {text}")
+        self.changed(server_game, move_to_uci(move) if move else text)
+
+    def _op_split(self, player, request):
+        server_game = self._turn(player)
+        if server_game.rules != "quantum":
+            raise RequestError("splits need quantum rules")
+        sq = _square(request.get("from"))
+        targets = request.get("to")
+        if not isinstance(targets, list) or len(targets) != 2:
+            raise RequestError("a split needs two target squares")
+        targets = [_square(name) for name in targets]
+        allowed = server_game.game.split_targets(sq)
+        if targets[0] == targets[1] or any(target not in allowed for target in targets):
+            raise RequestError("illegal split")
+        server_game.game.split(sq, targets)
+        self.changed(server_game, "S" + square_name(sq) + "".join(square_name(target) for target in targets))
+
+    def _op_measure(self, player, request):
+        server_game = self._turn(player)
+        sq = _square(request.get("square"))
+        landed = server_game.game.measure(sq)
+        if landed is None:
+            raise RequestError(f"no ghost of yours on {square_name(sq)}")
+        self.changed(server_game, "M" + square_name(sq) + square_name(landed))
+
+    async def serve_client(self, reader, writer):
+        player = Player(writer)
+        try:
+            while True:
+                line = await _read_line(reader)
+                if line is None:
+                    player.send({"op": "error", "message": "request too long"})
+                    await writer.drain()
+                    continue
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except (ValueError, RecursionError):
+                    player.send({"op": "error", "message": "bad JSON"})
+                    await writer.drain()
+                    continue
+                self.handle(player, request)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.leave(player)
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT, ready=None):
+        server = await asyncio.start_server(self.serve_client, host, port, limit=1 << 16)
+        if ready is not None:
+            ready(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+
+# Client side, for the pygame front end: a blocking socket with a reader
+# thread, polled once per frame like analysis.AnalysisWorker
+
+class GameClient:
+    def __init__(self, host=HOST, port=PORT):
+        self.socket = socket.create_connection((host, port))
+        self.messages = queue.Queue()
+        self.thread = threading.Thread(target=self._read, name="client", daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        try:
+            for line in self.socket.makefile("rb"):
+                self.messages.put(json.loads(line))
+        except (OSError, ValueError):
+            pass
+        self.messages.put(None)  # connection closed
+
+    def send(self, **request):
+        self.socket.sendall(_encode(request))
+
+    def poll(self):
+        # Messages received since the last call; None marks a closed connection
+        found = []
+        while True:
+            try:
+                found.append(self.messages.get_nowait())
+            except queue.Empty:
+                return found
+
+    def close(self):
+        self.socket.close()
+
+
+def ghosts_of(message):
+    # [(piece index, {sq: probability})] of a state message, for engine.load_state
+    return [(PIECE_INDEX[piece], {parse_square(name): p for name, p in dist.items()})
+            for piece, dist in message["ghosts"]]
+
+
+# Benchmark
+
+class _NullWriter:
+    __slots__ = ("bytes",)
+
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench(games, requests=20000, seed=0):
+    rng = random.Random(seed)
+    server = GameServer(rng)
+
+    # Memory of idle games with both players seated
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    pairs = []
+    for _ in range(games):
+        white, black = Player(_NullWriter()), Player(_NullWriter())
+        server.handle(white, {"op": "new", "rules": "quantum"})
+        server.handle(black, {"op": "join", "game": white.game.id})
+        pairs.append((white, black))
+    per_game = (tracemalloc.get_traced_memory()[0] - before) / games
+    tracemalloc.stop()
+    print(f"{games} idle games: {per_game:.0f} bytes per game (both players seated)")
+
+    # Request latency: random actions in random games, each request checked
+    # and both players sent the new state
+    timings = {"move": [], "split": [], "measure": []}
+    for _ in range(requests):
+        white, black = rng.choice(pairs)
+        server_game = white.game
+        game = server_game.game
+        if server_game.status not in ("playing", "check"):
+            server.handle(white, {"op": "new", "rules": "quantum"})
+            server.handle(black, {"op": "join", "game": white.game.id})
+            continue
+        player = (white, black)[game.position.turn]
+        ghosts = [sq for sq, index, _ in game.quantum.ghosts() if index // 6 == player.color]
+        roll = rng.random()
+        if ghosts and roll < 0.05:
+            request = {"op": "measure", "square": square_name(rng.choice(ghosts))}
+        else:
+            request = None
+            if roll > 0.9:
+                own = [sq for sq in range(64) if game.position.squares[sq] >= 0
+                       and game.position.squares[sq] // 6 == player.color] + ghosts
+                sq = rng.choice(own)
+                targets = game.split_targets(sq)
+                if len(targets) >= 2:
+                    request = {"op": "split", "from": square_name(sq),
+                               "to": [square_name(target) for target in rng.sample(targets, 2)]}
+            if request is None:
+                moves = game.allowed_moves()
+                if not moves:
+                    continue
+                request = {"op": "move", "move": move_to_uci(rng.choice(moves))}
+        start = time.perf_counter()
+        server.handle(player, request)
+        timings[request["op"]].append(time.perf_counter() - start)
+    for op, values in timings.items():
+        if values:
+            print(f"{op:8} {len(values):6} requests  mean {sum(values) / len(values) * 1e6:6.0f}us  "
+                  f"p50 {_percentile(values, 0.5) * 1e6:6.0f}us  p99 {_percentile(values, 0.99) * 1e6:6.0f}us")
+    return per_game, timings
+
+
+async def _round_trips(clients=100, moves=20, seed=0):
+    # Real sockets on localhost: pairs of clients play random classical
+    # games; returns the request/reply round-trip times
+    rng = random.Random(seed)
+    server = GameServer(rng)
+    ready = asyncio.get_running_loop().create_future()
+    task = asyncio.ensure_future(server.serve(HOST, 0, ready.set_result))
+    port = await ready
+    times = []
+
+    async def request(reader, writer, message):
+        start = time.perf_counter()
+        writer.write(_encode(message))
+        reply = json.loads(await reader.readline())
+        times.append(time.perf_counter() - start)
+        return reply
+
+    async def pair():
+        white = await asyncio.open_connection(HOST, port)
+        black = await asyncio.open_connection(HOST, port)
+        state = await request(*white, {"op": "new", "rules": "classical"})
+        await request(*black, {"op": "join", "game": state["game"]})
+        await white[0].readline()  # white's copy of the join
+        sides = (white, black)
+        for _ in range(moves):
+            position = parse_fen(state["fen"])
+            legal = position.legal_moves()
+            if not legal or state["status"] not in ("playing", "check"):
+                break
+            mover = sides[position.turn]
+            state = await request(*mover, {"op": "move", "move": move_to_uci(rng.choice(legal))})
+            await sides[position.turn ^ 1][0].readline()
+        for reader, writer in sides:
+            writer.close()
+
+    await asyncio.gather(*(pair() for _ in range(clients // 2)))
+    task.cancel()
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host quantum chess games over TCP")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--bench", type=int, metavar="GAMES", help="measure memory and latency instead of serving")
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        bench(args.bench)
+        for clients in (2, 100):
+            start = time.perf_counter()
+            times = asyncio.run(_round_trips(clients))
+            elapsed = time.perf_counter() - start
+            print(f"sockets, {clients // 2} games at once: {len(times)} round trips, {len(times) / elapsed:.0f}/s  "
+                  f"p50 {_percentile(times, 0.5) * 1e6:.0f}us  p99 {_percentile(times, 0.99) * 1e6:.0f}us")
+        return 0
+
+    server = GameServer()
+    print(f"serving on {args.host}:{args.port}", file=sys.stderr)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    if server.requests:
+        print(f"{server.requests} requests, {server.seconds / server.requests * 1e6:.0f}us each", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,644 @@
+# Endgame tablebases by retrograde analysis
+#
+#   python tablebase.py build KQK KRK KPK [KQKR ...] [--workers N]
+#   python tablebase.py probe "<FEN>"
+#
+# A table covers one material set, written strong side first ("KQKR" is king
+# and queen against king and rook), and holds for every position with either
+# side to move whether the side to move wins, draws or loses, and in how many
+# moves it mates or gets mated. Positions are indexed by the squares of their
+# pieces, with the strong king folded onto a1-d1-d4 (or onto files a-d when
+# there are pawns) by the board's symmetries.
+#
+# Generation starts from the mates and walks backwards: a position is won if
+# some move reaches a lost one, and lost once every move reaches a won one.
+# Each position keeps a count of its moves not yet known to lose, and
+# captures and promotions, which leave the table, are looked up in the
+# smaller tables built before it. The first pass over all positions and the
+# predecessor generation of every step are spread over a process pool.
+#
+# Files hold one byte per position: the result in the top two bits (draw,
+# win, loss, or unused index) and the distance to mate in moves in the low
+# six, so a table with a mate longer than 63 moves fails to build. Castling
+# rights and en passant are not modelled: probes skip positions that still
+# have castling rights, and ignore an en passant capture the position allows.
+
+import argparse
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from array import array
+
+from bitboard import (BISHOP, KING, KING_ATTACKS, KNIGHT, KNIGHT_ATTACKS, PAWN, PAWN_ATTACKS, QUEEN, ROOK,
+                      bishop_attacks, queen_attacks, rook_attacks)
+from position import EMPTY
+
+TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tables")
+MAGIC = b"QCT1"
+HEADER = struct.Struct("<4sHH8sQ")  # magic, version, piece count, name, positions
+
+LETTERS = "PRNBQK"   # by piece kind
+ORDER = "KQRBNP"     # order of the pieces in a material name
+
+DRAW, WIN, LOSS, UNUSED = 0, 1, 2, 3
+
+# Folds of the board as square maps, identity first. Pawnless tables use all
+# eight, tables with pawns only the left-right mirror.
+_FOLDS = [lambda r, c: (r, c), lambda r, c: (r, 7 - c), lambda r, c: (7 - r, c), lambda r, c: (7 - r, 7 - c),
+          lambda r, c: (c, r), lambda r, c: (c, 7 - r), lambda r, c: (7 - c, r), lambda r, c: (7 - c, 7 - r)]
+SYMMETRIES = [[(lambda r, c: r * 8 + c)(*fold(sq // 8, sq % 8)) for sq in range(64)] for fold in _FOLDS]
+# a1-d1-d4 for pawnless tables, files a-d with pawns
+TRIANGLE = [sq for sq in range(64) if sq % 8 <= 3 and 7 - sq // 8 <= 3 and sq % 8 >= 7 - sq // 8]
+LEFT_HALF = [sq for sq in range(64) if sq % 8 <= 3]
+
+# Non-king pieces that cannot mate on their own: K+minor against a bare king
+_MINORS = {"", "N", "B"}
+
+
+def _side_letters(kinds):
+    return "K" + "".join(sorted((LETTERS[kind] for kind in kinds if kind != KING), key=ORDER.index))
+
+
+def _strength(letters):
+    return len(letters), [-ORDER.index(char) for char in letters]
+
+
+def material_name(white, black):
+    # (name, flipped) for the kinds of each side; flipped when black is the
+    # strong side and the table has the colors the other way round
+    white_letters = _side_letters(white)
+    black_letters = _side_letters(black)
+    if _strength(black_letters) > _strength(white_letters):
+        return black_letters + white_letters, True
+    return white_letters + black_letters, False
+
+
+def is_drawn_material(name):
+    # Only kings, or a lone minor piece against a bare king
+    second = name.index("K", 1)
+    strong, weak = name[1:second], name[second + 1:]
+    return weak == "" and strong in _MINORS
+
+
+def parse_name(name):
+    # [(color, kind)] in table order: both kings first, then the rest
+    name = name.upper()
+    second = name.index("K", 1)
+    if name[0] != "K" or any(char not in LETTERS for char in name):
+        raise ValueError(f"bad material {name!r}")
+    strong, weak = name[1:second], name[second + 1:]
+    return [(0, KING), (1, KING)] + [(0, LETTERS.index(c)) for c in strong] + [(1, LETTERS.index(c)) for c in weak]
+
+
+class Layout:
+    # How the positions of one material set map to table indices
+    __slots__ = ("name", "pieces", "domain", "folds", "king_index", "size", "runs")
+
+    def __init__(self, name):
+        self.name = name
+        self.pieces = parse_name(name)
+        pawns = any(kind == PAWN for _, kind in self.pieces)
+        domain = LEFT_HALF if pawns else TRIANGLE
+        self.domain = domain
+        self.king_index = {sq: i for i, sq in enumerate(domain)}
+        symmetries = SYMMETRIES[:2] if pawns else SYMMETRIES
+        # folds[sq]: the symmetries that move a strong king on sq into the domain
+        self.folds = [[t for t in symmetries if t[sq] in self.king_index] for sq in range(64)]
+        self.size = 2 * len(domain) * 64 ** (len(self.pieces) - 1)
+        # Runs of identical pieces, whose squares are kept sorted so that
+        # swapping two of them gives the same index
+        self.runs = []
+        start = 2
+        for i in range(3, len(self.pieces) + 1):
+            if i == len(self.pieces) or self.pieces[i] != self.pieces[start]:
+                if i - start > 1:
+                    self.runs.append((start, i))
+                start = i
+
+    def index(self, stm, squares):
+        # Smallest index over the symmetric images of the position
+        best = -1
+        king_index = self.king_index
+        for t in self.folds[squares[0]]:
+            mapped = [t[sq] for sq in squares]
+            for start, end in self.runs:
+                mapped[start:end] = sorted(mapped[start:end])
+            index = stm * len(king_index) + king_index[mapped[0]]
+            for sq in mapped[1:]:
+                index = index * 64 + sq
+            if best < 0 or index < best:
+                best = index
+        return best
+
+    def decode(self, index):
+        # (side to move, squares) of an index
+        squares = []
+        for _ in range(len(self.pieces) - 1):
+            squares.append(index & 63)
+            index >>= 6
+        kings = len(self.domain)
+        squares.append(self.domain[index % kings])
+        squares.reverse()
+        return index // kings, squares
+
+
+# Move generation on piece lists. A position is (stm, squares) with the
+# pieces in Layout order; piece i has color and kind pieces[i].
+
+def _attacks(kind, color, sq, occupied):
+    if kind == KNIGHT:
+        return KNIGHT_ATTACKS[sq]
+    if kind == KING:
+        return KING_ATTACKS[sq]
+    if kind == BISHOP:
+        return bishop_attacks(sq, occupied)
+    if kind == ROOK:
+        return rook_attacks(sq, occupied)
+    if kind == QUEEN:
+        return queen_attacks(sq, occupied)
+    return PAWN_ATTACKS[color][sq]
+
+
+def _attacked(pieces, squares, target, by_color, skip=-1):
+    # Whether a piece of by_color (other than piece skip) attacks target
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    for i, (color, kind) in enumerate(pieces):
+        if color == by_color and i != skip and _attacks(kind, color, squares[i], occupied) >> target & 1:
+            return True
+    return False
+
+
+def _legal(pieces, stm, squares):
+    if len(set(squares)) != len(squares):
+        return False
+    for (_, kind), sq in zip(pieces, squares):
+        if kind == PAWN and (sq < 8 or sq >= 56):
+            return False
+    # The side that just moved may not be in check
+    return not _attacked(pieces, squares, squares[stm ^ 1], stm)
+
+
+def _moves(pieces, stm, squares):
+    # Yield (piece, to square, captured piece or -1, promotion kind or -1)
+    # for every pseudo-legal move of the side to move
+    occupied = 0
+    owner = {}
+    for i, sq in enumerate(squares):
+        occupied |= 1 << sq
+        owner[sq] = i
+    for i, (color, kind) in enumerate(pieces):
+        if color != stm:
+            continue
+        sq = squares[i]
+        if kind == PAWN:
+            step = -8 if color == 0 else 8
+            targets = []
+            one = sq + step
+            if not occupied >> one & 1:
+                targets.append(one)
+                if (48 <= sq < 56 if color == 0 else 8 <= sq < 16) and not occupied >> (one + step) & 1:
+                    targets.append(one + step)
+            attacks = PAWN_ATTACKS[color][sq] & occupied
+            while attacks:
+                low = attacks & -attacks
+                attacks ^= low
+                targets.append(low.bit_length() - 1)
+            for to in targets:
+                captured = owner.get(to, -1)
+                if captured >= 0 and pieces[captured][0] == stm:
+                    continue
+                if to < 8 or to >= 56:
+                    for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                        yield i, to, captured, promotion
+                else:
+                    yield i, to, captured, -1
+            continue
+        attacks = _attacks(kind, color, sq, occupied)
+        while attacks:
+            low = attacks & -attacks
+            attacks ^= low
+            to = low.bit_length() - 1
+            captured = owner.get(to, -1)
+            if captured >= 0 and pieces[captured][0] == stm:
+                continue
+            yield i, to, captured, -1
+
+
+def _unmoves(pieces, stm, squares):
+    # Yield the squares of every position, with the other side to move, that
+    # reaches this one by a move that stays in the table (no capture, no
+    # promotion)
+    mover = stm ^ 1
+    occupied = 0
+    for sq in squares:
+        occupied |= 1 << sq
+    for i, (color, kind) in enumerate(pieces):
+        if color != mover:
+            continue
+        sq = squares[i]
+        if kind == PAWN:
+            back = 8 if color == 0 else -8
+            sources = []
+            one = sq + back
+            if 8 <= one < 56 and not occupied >> one & 1:
+                sources.append(one)
+                two = one + back
+                if (32 <= sq < 40 if color == 0 else 24 <= sq < 32) and not occupied >> two & 1:
+                    sources.append(two)
+        else:
+            attacks = _attacks(kind, color, sq, occupied) & ~occupied
+            sources = []
+            while attacks:
+                low = attacks & -attacks
+                attacks ^= low
+                sources.append(low.bit_length() - 1)
+        for source in sources:
+            before = squares[:]
+            before[i] = source
+            if not _attacked(pieces, before, before[stm], mover):
+                yield before
+
+
+# Lookups, in tables on disk, of positions given as piece lists
+
+class Table:
+    __slots__ = ("layout", "file", "map")
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _, _, name, size = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a tablebase")
+        self.layout = Layout(name.rstrip(b"\0").decode("ascii"))
+        if size != self.layout.size or len(self.map) != HEADER.size + size:
+            raise ValueError(f"{path} is truncated")
+
+    def code(self, stm, squares):
+        return self.map[HEADER.size + self.layout.index(stm, squares)]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+_tables = {}
+
+
+def table(name, directory=TABLE_DIR):
+    # The table for a material name, or None if it has not been built
+    key = (name, directory)
+    if key not in _tables:
+        path = os.path.join(directory, name + ".qct")
+        _tables[key] = Table(path) if os.path.exists(path) else None
+    return _tables[key]
+
+
+def _encode(result, plies):
+    # The table byte of a result and its distance in plies
+    if result == WIN:
+        moves = (plies + 1) // 2
+    elif result == LOSS:
+        moves = plies // 2
+    else:
+        return result << 6
+    if moves > 63:
+        raise ValueError(f"mate in {moves} moves does not fit in a table byte")
+    return result << 6 | moves
+
+
+def decode(code):
+    # (result for the side to move, distance in plies) of a table byte
+    result = code >> 6
+    moves = code & 63
+    if result == WIN:
+        return WIN, 2 * moves - 1
+    if result == LOSS:
+        return LOSS, 2 * moves
+    return result, 0
+
+
+def probe_pieces(pieces, stm, directory=TABLE_DIR):
+    # (result, plies) for [(color, kind, sq)] with stm to move, or None
+    # when the material has no table
+    white = [kind for color, kind, _ in pieces if color == 0]
+    black = [kind for color, kind, _ in pieces if color == 1]
+    name, flipped = material_name(white, black)
+    if is_drawn_material(name):
+        return DRAW, 0
+    found = table(name, directory)
+    if found is None:
+        return None
+    if flipped:
+        # Swap colors and mirror the ranks so the strong side is white
+        pieces = [(color ^ 1, kind, sq ^ 56) for color, kind, sq in pieces]
+        stm ^= 1
+    squares = []
+    for color, kind in found.layout.pieces:
+        for i, piece in enumerate(pieces):
+            if piece is not None and piece[0] == color and piece[1] == kind:
+                squares.append(piece[2])
+                pieces = pieces[:i] + [None] + pieces[i + 1:]
+                break
+    return decode(found.code(stm, squares))
+
+
+def _flip(outcome):
+    # A child's result seen from the parent, one ply further from mate
+    if outcome is None:
+        return None
+    result, plies = outcome
+    if result == WIN:
+        return LOSS, plies + 1
+    if result == LOSS:
+        return WIN, plies + 1
+    return DRAW, 0
+
+
+# Generation. Workers build the Layout once and keep it in a global.
+
+_layout = None
+_directory = TABLE_DIR
+
+
+def _init_worker(name, directory):
+    global _layout, _directory
+    _layout = Layout(name)
+    _directory = directory
+
+
+def _first_pass(span):
+    # For indices start..end: the in-table move count (phantom +1 when a
+    # capture or promotion draws or wins), the worst exit loss and the best
+    # exit win in plies, and the status (0 open, 1 unused, 2 mated, 3 stalemate)
+    start, end = span
+    layout = _layout
+    pieces = layout.pieces
+    counts = bytearray(end - start)
+    exit_loss = bytearray(end - start)
+    exit_win = bytearray(end - start)
+    status = bytearray(end - start)
+    for offset in range(end - start):
+        index = start + offset
+        stm, squares = layout.decode(index)
+        if layout.index(stm, squares) != index or not _legal(pieces, stm, squares):
+            status[offset] = 1
+            continue
+        children = set()
+        phantom = False
+        any_move = False
+        for i, to, captured, promotion in _moves(pieces, stm, squares):
+            after = squares[:]
+            after[i] = to
+            king = after[stm]
+            if _attacked(pieces, after, king, stm ^ 1, captured):
+                continue
+            any_move = True
+            if captured < 0 and promotion < 0:
+                children.add(layout.index(stm ^ 1, after))
+                continue
+            rest = [(color, promotion if j == i and promotion >= 0 else kind, after[j])
+                    for j, (color, kind) in enumerate(pieces) if j != captured]
+            outcome = _flip(probe_pieces(rest, stm ^ 1, _directory))
+            if outcome is None:
+                raise RuntimeError(f"{layout.name}: no table for a capture or promotion")
+            result, plies = outcome
+            if result == LOSS:
+                exit_loss[offset] = max(exit_loss[offset], plies)
+            else:
+                phantom = True
+                if result == WIN and (not exit_win[offset] or plies < exit_win[offset]):
+                    exit_win[offset] = plies
+        counts[offset] = len(children) + phantom
+        if not any_move:
+            status[offset] = 2 if _attacked(pieces, squares, squares[stm], stm ^ 1) else 3
+    return start, bytes(counts), bytes(exit_loss), bytes(exit_win), bytes(status)
+
+
+def _predecessors(indices):
+    # Distinct predecessor indices of each index
+    layout = _layout
+    pieces = layout.pieces
+    found = []
+    for index in indices:
+        stm, squares = layout.decode(index)
+        found.append(sorted({layout.index(stm ^ 1, before) for before in _unmoves(pieces, stm, squares)}))
+    return found
+
+
+def _chunks(items, count):
+    size = max(1, -(-len(items) // count))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def generate(name, directory=TABLE_DIR, workers=None, log=None):
+    # Build one table; tables it captures or promotes into must exist.
+    # Returns (positions, seconds).
+    start_time = time.perf_counter()
+    layout = Layout(name)
+    workers = workers or os.cpu_count() or 1
+    size = layout.size
+    pool = multiprocessing.Pool(workers, _init_worker, (name, directory)) if workers > 1 else None
+    _init_worker(name, directory)
+    try:
+        step = 1 << 14
+        spans = [(i, min(i + step, size)) for i in range(0, size, step)]
+        counts = bytearray(size)
+        exit_loss = bytearray(size)
+        exit_win = bytearray(size)
+        status = bytearray(size)
+        for start, *columns in (pool.imap_unordered(_first_pass, spans) if pool else map(_first_pass, spans)):
+            end = start + len(columns[0])
+            counts[start:end], exit_loss[start:end], exit_win[start:end], status[start:end] = columns
+
+        result = bytearray(size)   # DRAW until decided
+        plies = array('H', bytes(2 * size))
+        buckets = {}
+        for index in range(size):
+            state = status[index]
+            if state == 1:
+                result[index] = UNUSED
+            elif state == 2:
+                result[index] = LOSS
+                buckets.setdefault(0, []).append(index)
+            elif state == 3:
+                continue
+            elif exit_win[index]:
+                buckets.setdefault(exit_win[index], []).append(index)
+            elif counts[index] == 0:
+                # Only captures or promotions, all of them losing
+                result[index] = LOSS
+                plies[index] = exit_loss[index]
+                buckets.setdefault(exit_loss[index], []).append(index)
+        if log:
+            log(f"{name}: first pass over {size} positions in {time.perf_counter() - start_time:.1f}s")
+
+        depth = 0
+        while buckets:
+            frontier = []
+            for index in dict.fromkeys(buckets.pop(depth, [])):
+                if result[index] == DRAW:
+                    # An exit win no faster win has beaten
+                    result[index] = WIN
+                    plies[index] = depth
+                elif plies[index] != depth:
+                    continue
+                frontier.append(index)
+            if frontier:
+                if pool and len(frontier) > 256:
+                    lists = [found for chunk in pool.map(_predecessors, _chunks(frontier, workers * 4))
+                             for found in chunk]
+                else:
+                    lists = _predecessors(frontier)
+                for index, predecessors in zip(frontier, lists):
+                    if result[index] == LOSS:
+                        for before in predecessors:
+                            if result[before] == DRAW:
+                                result[before] = WIN
+                                plies[before] = depth + 1
+                                buckets.setdefault(depth + 1, []).append(before)
+                    else:
+                        for before in predecessors:
+                            if result[before] != DRAW or status[before]:
+                                continue
+                            counts[before] -= 1
+                            if counts[before] == 0:
+                                result[before] = LOSS
+                                plies[before] = max(depth + 1, exit_loss[before])
+                                buckets.setdefault(plies[before], []).append(before)
+            depth += 1
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    try:
+        packed = bytearray(_encode(result[index], plies[index]) for index in range(size))
+    except ValueError as error:
+        raise ValueError(f"{name}: {error}") from None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + ".qct")
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, 1, len(layout.pieces), name.encode("ascii"), size))
+        f.write(packed)
+    os.replace(path + ".tmp", path)
+    _tables.pop((name, directory), None)
+    return size, time.perf_counter() - start_time
+
+
+def dependencies(name):
+    # Materials a table captures or promotes into, strongest first
+    pieces = parse_name(name)
+    found = []
+    for i, (color, kind) in enumerate(pieces):
+        if kind == KING:
+            continue
+        rest = pieces[:i] + pieces[i + 1:]
+        options = [rest]
+        if kind == PAWN:
+            options += [pieces[:i] + [(color, promotion)] + pieces[i + 1:] for promotion in (QUEEN, ROOK, BISHOP, KNIGHT)]
+        for option in options:
+            child, _ = material_name([k for c, k in option if c == 0], [k for c, k in option if c == 1])
+            if not is_drawn_material(child) and child not in found:
+                found.append(child)
+    return found
+
+
+def build(names, directory=TABLE_DIR, workers=None, log=print):
+    # Build tables and, first, any smaller ones they need
+    done = set()
+
+    def visit(name):
+        if name in done:
+            return
+        done.add(name)
+        for child in dependencies(name):
+            visit(child)
+        if table(name, directory) is None or name in names:
+            positions, seconds = generate(name, directory, workers, log)
+            log(f"{name}: {positions} positions in {seconds:.1f}s")
+
+    for name in names:
+        visit(name)
+
+
+# Probing from a Position
+
+def probe(position, directory=TABLE_DIR):
+    # (result, plies) for the side to move, or None when there is no table
+    if position.castling or bin(position.occupancy).count("1") > 5:
+        return None
+    pieces = [(index // 6, index % 6, sq) for sq, index in enumerate(position.squares) if index != EMPTY]
+    return probe_pieces(pieces, position.turn, directory)
+
+
+def best_move(position, moves=None, directory=TABLE_DIR):
+    # (move, result, plies) of the best move by the tables among moves (all
+    # legal moves by default), or None if the position or any child is not
+    # covered. Wins are taken by the fastest mate, losses by the slowest.
+    if probe(position, directory) is None:
+        return None
+    best = None
+    best_key = None
+    for move in position.legal_moves() if moves is None else moves:
+        position.make_move(move)
+        outcome = _flip(probe(position, directory))
+        position.unmake_move()
+        if outcome is None:
+            return None
+        result, plies = outcome
+        key = (-plies,) if result == WIN else (-1000,) if result == DRAW else (-2000 + plies,)
+        key = (2 if result == WIN else 1 if result == DRAW else 0,) + key
+        if best_key is None or key > best_key:
+            best = (move, result, plies)
+            best_key = key
+    return best
+
+
+def describe(outcome):
+    result, plies = outcome
+    if result == WIN:
+        return f"win, mate in {(plies + 1) // 2}"
+    if result == LOSS:
+        return f"loss, mated in {plies // 2}" if plies else "checkmated"
+    return "draw"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build and probe endgame tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_command = commands.add_parser("build", help="build tables, e.g. KQK KRK KPK KQKR")
+    build_command.add_argument("names", nargs="+")
+    build_command.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    build_command.add_argument("--dir", default=TABLE_DIR)
+    probe_command = commands.add_parser("probe", help="look up a position")
+    probe_command.add_argument("fen")
+    probe_command.add_argument("--dir", default=TABLE_DIR)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        build([name.upper() for name in args.names], args.dir, args.workers)
+        return 0
+
+    from notation import parse_fen
+    from position import move_to_uci
+    position = parse_fen(args.fen)
+    position.set_castling(0)
+    outcome = probe(position, args.dir)
+    if outcome is None:
+        print("no table for this material")
+        return 1
+    print(describe(outcome))
+    best = best_move(position, directory=args.dir)
+    if best is not None:
+        print(f"best {move_to_uci(best[0])}: {describe(best[1:])}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
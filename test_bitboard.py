@@ -0,0 +1,90 @@
+# Bitboard move generation against a square-by-square reference
+#
+#   python -m pytest -q
+#
+# reference_moves walks the board the way the grid generator in Chess.py
+# did before the bitboards. On random boards piece_moves must give the same
+# destinations for every piece.
+
+import random
+
+import pytest
+
+from bitboard import PIECES, Bitboards, bitboard_to_coords, piece_moves
+
+START = [
+    ["br", "bn", "bb", "bq", "bk", "bb", "bn", "br"],
+    ["bp"] * 8,
+    [""] * 8,
+    [""] * 8,
+    [""] * 8,
+    [""] * 8,
+    ["wp"] * 8,
+    ["wr", "wn", "wb", "wq", "wk", "wb", "wn", "wr"],
+]
+
+STEPS = {
+    'r': ([(-1, 0), (1, 0), (0, -1), (0, 1)], True),
+    'b': ([(-1, -1), (-1, 1), (1, -1), (1, 1)], True),
+    'q': ([(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)], True),
+    'n': ([(-2, -1), (-2, 1), (2, -1), (2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2)], False),
+    'k': ([(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)], False),
+}
+
+
+def reference_moves(grid, piece, row, col):
+    color = piece[0]
+    moves = set()
+    if piece[1] == 'p':
+        step, home = (-1, 6) if color == 'w' else (1, 1)
+        r = row + step
+        if not 0 <= r < 8:
+            return moves
+        if grid[r][col] == "":
+            moves.add((r, col))
+            if row == home and grid[r + step][col] == "":
+                moves.add((r + step, col))
+        for c in (col - 1, col + 1):
+            if 0 <= c < 8 and grid[r][c] != "" and grid[r][c][0] != color:
+                moves.add((r, c))
+        return moves
+    directions, slides = STEPS[piece[1]]
+    for dr, dc in directions:
+        r, c = row + dr, col + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            if grid[r][c] == "" or grid[r][c][0] != color:
+                moves.add((r, c))
+            if grid[r][c] != "" or not slides:
+                break
+            r += dr
+            c += dc
+    return moves
+
+
+def random_grid(rng, density):
+    return [[rng.choice(PIECES) if rng.random() < density else "" for _ in range(8)] for _ in range(8)]
+
+
+def check_grid(grid):
+    bitboards = Bitboards.from_grid(grid)
+    for row in range(8):
+        for col in range(8):
+            piece = grid[row][col]
+            if piece:
+                moves = bitboard_to_coords(piece_moves(bitboards, piece, row * 8 + col))
+                assert len(moves) == len(set(moves))
+                assert set(moves) == reference_moves(grid, piece, row, col), (piece, row, col)
+
+
+def test_start_position():
+    check_grid(START)
+    bitboards = Bitboards.from_grid(START)
+    white = [piece_moves(bitboards, START[sq // 8][sq % 8], sq) for sq in range(48, 64)]
+    assert sum(bin(moves).count("1") for moves in white) == 20
+
+
+@pytest.mark.parametrize("density", [0.1, 0.3, 0.6])
+def test_random_boards(density):
+    rng = random.Random(density)
+    for _ in range(200):
+        check_grid(random_grid(rng, density))
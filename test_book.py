@@ -0,0 +1,105 @@
+# Opening book build, probe and merge
+#
+#   python -m pytest -q
+#
+# A book built from a handful of known games must hold exactly the moves
+# those games played, weighted by how many games played them.
+
+import random
+
+import pytest
+
+from book import Book, build_book, count_moves, merge_books, open_book, write_book
+from gamefile import GameWriter
+from notation import START_FEN, format_game, parse_fen, play_san
+from position import move_to_uci
+
+GAMES = [
+    "e4 e5 Nf3 Nc6 Bb5 a6",
+    "e4 e5 Nf3 Nc6 Bc4 Bc5",
+    "e4 c5 Nf3 d6 d4 cxd4",
+    "d4 d5 c4 e6 Nc3 Nf6",
+]
+
+
+def moves_of(game):
+    position = parse_fen(START_FEN)
+    return [play_san(position, san, ply) for ply, san in enumerate(game.split())]
+
+
+def write_pgn(path):
+    with open(path, "w") as f:
+        for game in GAMES:
+            f.write(format_game(moves_of(game), result="*"))
+    return str(path)
+
+
+def book_moves(book, fen=START_FEN, sans=()):
+    position = parse_fen(fen)
+    for ply, san in enumerate(sans):
+        play_san(position, san, ply)
+    return {move_to_uci(move): weight for move, weight in book.probe(position.hash)}
+
+
+def test_build_and_probe(tmp_path):
+    pgn = write_pgn(tmp_path / "games.pgn")
+    path = str(tmp_path / "book.bin")
+    assert build_book(path, [pgn], plies=4) == len(count_moves([pgn], 4))
+    with Book(path) as book:
+        assert book_moves(book) == {"e2e4": 3, "d2d4": 1}
+        assert book_moves(book, sans=["e4"]) == {"e7e5": 2, "c7c5": 1}
+        assert book_moves(book, sans=["e4", "e5", "Nf3"]) == {"b8c6": 2}
+        # Past the book depth
+        assert book_moves(book, sans=["e4", "e5", "Nf3", "Nc6"]) == {}
+        keys = list(book.keys)
+        assert keys == sorted(keys)
+
+
+def test_min_count_and_qcg_source(tmp_path):
+    archive = str(tmp_path / "games.qcg")
+    with GameWriter(archive) as writer:
+        for game in GAMES:
+            writer.add(moves_of(game))
+    path = str(tmp_path / "book.bin")
+    build_book(path, [archive], plies=6, min_count=2)
+    with Book(path) as book:
+        assert book_moves(book) == {"e2e4": 3}
+        assert book_moves(book, sans=["e4", "e5", "Nf3", "Nc6"]) == {}
+        assert book_moves(book, sans=["e4", "e5"]) == {"g1f3": 2}
+
+
+def test_choose_follows_the_weights(tmp_path):
+    path = str(tmp_path / "book.bin")
+    build_book(path, [write_pgn(tmp_path / "games.pgn")], plies=2)
+    rng = random.Random(18)
+    with Book(path) as book:
+        position = parse_fen(START_FEN)
+        picks = [move_to_uci(book.choose(position, rng)) for _ in range(2000)]
+        assert set(picks) == {"e2e4", "d2d4"}
+        assert 0.7 < picks.count("e2e4") / len(picks) < 0.8
+        position.make_move(book.choose(position, rng))
+        position.make_move(position.legal_moves()[0])
+        assert book.choose(position, rng) is None
+
+
+def test_merge_adds_weights(tmp_path):
+    pgn = write_pgn(tmp_path / "games.pgn")
+    first, second, merged = (str(tmp_path / name) for name in ("a.bin", "b.bin", "merged.bin"))
+    build_book(first, [pgn], plies=2)
+    build_book(second, [pgn], plies=4)
+    merge_books(merged, [first, second])
+    with Book(merged) as book:
+        assert book_moves(book) == {"e2e4": 6, "d2d4": 2}
+        assert book_moves(book, sans=["e4", "e5"]) == {"g1f3": 2}
+
+
+def test_bad_books(tmp_path):
+    assert open_book(str(tmp_path / "missing.bin")) is None
+    path = tmp_path / "book.bin"
+    path.write_bytes(b"QCB1" + bytes(20))
+    with pytest.raises(ValueError):
+        Book(str(path))
+    assert open_book(str(path)) is None
+    assert write_book(str(path), []) == 0
+    with Book(str(path)) as book:
+        assert len(book) == 0 and book.probe(0) == []
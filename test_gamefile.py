@@ -0,0 +1,153 @@
+# Game archive round trips
+#
+#   python -m pytest -q
+#
+# Games written with GameWriter must read back from GameFile word for word,
+# and replaying a record must give the positions the game went through,
+# quantum events included.
+
+import random
+
+import pytest
+
+from bitboard import PIECE_INDEX
+from gamefile import GameFile, GameWriter, NULL_MOVE, collapse_word, main, split_words
+from notation import START_FEN, parse_fen, to_fen
+from perft import PERFT_SUITE
+from position import move_to_uci, parse_square
+
+
+def random_game(fen, rng, plies=60):
+    # (moves, FEN after every ply)
+    position = parse_fen(fen)
+    moves = []
+    fens = [to_fen(position)]
+    for _ in range(plies):
+        legal = position.legal_moves()
+        if not legal:
+            break
+        moves.append(rng.choice(legal))
+        position.make_move(moves[-1])
+        fens.append(to_fen(position))
+    return moves, fens
+
+
+def uci(position, text):
+    return next(move for move in position.legal_moves() if move_to_uci(move) == text)
+
+
+def write(path, games):
+    with GameWriter(path) as writer:
+        for moves, result, fen in games:
+            writer.add(moves, result, fen)
+
+
+def test_round_trip(tmp_path):
+    rng = random.Random(17)
+    games = []
+    for name, fen, _ in PERFT_SUITE:
+        for result in ("1-0", "0-1", "1/2-1/2", "*"):
+            moves, fens = random_game(fen, rng)
+            games.append((moves, result, fen, fens))
+    path = str(tmp_path / "games.qcg")
+    write(path, [(moves, result, fen) for moves, result, fen, _ in games])
+    with GameFile(path) as archive:
+        assert len(archive) == len(games)
+        for record, (moves, result, fen, fens) in zip(archive, games):
+            assert list(record.words) == moves
+            assert record.result == result and record.fen == fen
+            for plies in sorted({0, 1, len(moves) // 2, len(moves)}):
+                position, state = record.replay(plies)
+                assert to_fen(position) == fens[plies] and not len(state)
+            assert to_fen(record.replay()[0]) == fens[-1]
+        with pytest.raises(IndexError):
+            archive[len(games)]
+
+
+def test_quantum_words(tmp_path):
+    # 1. Ng1 splits to f3 and h3, 1... e5, 2. the knight is measured on f3
+    position = parse_fen(START_FEN)
+    words = split_words(parse_square("g1"), [parse_square("f3"), parse_square("h3")]) + [NULL_MOVE]
+    position.make_null_move()
+    words.append(uci(position, "e7e5"))
+    words += [collapse_word(parse_square("h3"), parse_square("f3")), NULL_MOVE]
+    path = str(tmp_path / "quantum.qcg")
+    write(path, [(words, "*", None)])
+    with GameFile(path) as archive:
+        record = archive[0]
+        assert record.fen == START_FEN
+        position, state = record.replay(1)
+        assert sorted(state.ghosts()) == [(parse_square("f3"), PIECE_INDEX["wn"], 0.5),
+                                          (parse_square("h3"), PIECE_INDEX["wn"], 0.5)]
+        assert position.squares[parse_square("g1")] < 0 and position.turn == 1
+        position, state = record.replay()
+        assert not len(state)
+        assert position.squares[parse_square("f3")] == PIECE_INDEX["wn"]
+        assert position.squares[parse_square("e5")] == PIECE_INDEX["bp"]
+        assert position.turn == 1
+
+
+def test_replay_stops_before_the_next_ply(tmp_path):
+    # The quantum words of a ply are not played when the limit falls before it
+    position = parse_fen(START_FEN)
+    words = [uci(position, "e2e4")]
+    words += split_words(parse_square("b8"), [parse_square("a6"), parse_square("c6")]) + [NULL_MOVE]
+    path = str(tmp_path / "quantum.qcg")
+    write(path, [(words, "*", None)])
+    with GameFile(path) as archive:
+        position, state = archive[0].replay(1)
+        assert not len(state) and position.turn == 1
+        assert position.squares[parse_square("b8")] == PIECE_INDEX["bn"]
+        position, state = archive[0].replay(2)
+        assert len(state) == 1 and position.turn == 0
+
+
+def test_reopen_appends(tmp_path):
+    rng = random.Random(1)
+    first = [random_game(START_FEN, rng)[0] for _ in range(3)]
+    path = str(tmp_path / "games.qcg")
+    write(path, [(moves, "*", None) for moves in first[:2]])
+    write(path, [(first[2], "1-0", None)])
+    with GameFile(path) as archive:
+        assert [list(record.words) for record in archive] == first
+        assert [record.result for record in archive] == ["*", "*", "1-0"]
+
+
+def test_not_an_archive(tmp_path):
+    path = tmp_path / "games.qcg"
+    path.write_bytes(b"not a game archive at all")
+    with pytest.raises(ValueError):
+        GameFile(str(path))
+    with pytest.raises(ValueError):
+        GameWriter(str(path))
+
+
+def test_recover_unclosed(tmp_path):
+    # A writer that never got to close(): the header still says no games,
+    # and the last game was cut off while it was written
+    rng = random.Random(2)
+    games = [random_game(START_FEN, rng)[0] for _ in range(4)]
+    path = str(tmp_path / "games.qcg")
+    write(path, [(games[0], "1-0", None)])
+    writer = GameWriter(path)
+    for moves in games[1:3]:
+        writer.add(moves, "*", None)
+    writer.file.close()
+    with pytest.raises(ValueError):
+        GameFile(path)
+    with open(path, "ab") as f:
+        f.write(b"\x30\x00\x00\x00")
+    write(path, [(games[3], "0-1", None)])
+    with GameFile(path) as archive:
+        assert [list(record.words) for record in archive] == [games[0], games[1], games[2], games[3]]
+        assert [record.result for record in archive] == ["1-0", "*", "*", "0-1"]
+
+
+def test_pack_truncates_unless_appending(tmp_path):
+    source = tmp_path / "games.pgn"
+    source.write_text('[Result "1-0"]\n\n1. e4 e5 2. Qh5 Nc6 3. Bc4 Nf6 4. Qxf7# 1-0\n')
+    target = str(tmp_path / "games.qcg")
+    for argv, count in ((["pack"], 1), (["pack"], 1), (["pack", "--append"], 2)):
+        assert main(argv + [str(source), target]) == 0
+        with GameFile(target) as archive:
+            assert len(archive) == count
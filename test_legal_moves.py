@@ -0,0 +1,111 @@
+# Legal move generation from pins and checkers against the slow path
+#
+#   python -m pytest -q
+#
+# bitboard.legal_moves works out checkers and pins once per position; the
+# trial path plays every pseudo-legal move and looks for check. Over random
+# games, from the start and from the perft positions, and over random boards
+# the two must agree square for square.
+
+import random
+
+import pytest
+
+from bitboard import PIECES, Bitboards, _filter_by_trial, _own_pieces, has_any_legal_move, legal_moves, piece_moves
+from notation import parse_fen
+from perft import PERFT_SUITE
+
+START = [
+    ["br", "bn", "bb", "bq", "bk", "bb", "bn", "br"],
+    ["bp"] * 8,
+    [""] * 8,
+    [""] * 8,
+    [""] * 8,
+    [""] * 8,
+    ["wp"] * 8,
+    ["wr", "wn", "wb", "wq", "wk", "wb", "wn", "wr"],
+]
+
+
+def grid_of(rows):
+    # "rnbqkbnr" style rows, one letter per square and "." for empty
+    return [["" if char == "." else ("w" if char.isupper() else "b") + char.lower() for char in row] for row in rows]
+
+
+def by_trial(bitboards, color):
+    moves = []
+    for piece, sq in _own_pieces(bitboards, color):
+        destinations = _filter_by_trial(bitboards, piece, sq, piece_moves(bitboards, piece, sq))
+        if destinations:
+            moves.append((sq, destinations))
+    return sorted(moves)
+
+
+def check_side(bitboards, color):
+    expected = by_trial(bitboards, color)
+    assert sorted(legal_moves(bitboards, color)) == expected
+    assert has_any_legal_move(bitboards, color) == bool(expected)
+    return expected
+
+
+def test_random_games():
+    rng = random.Random(3)
+    for _ in range(20):
+        bitboards = Bitboards.from_grid(START)
+        color = 0
+        for _ in range(120):
+            moves = check_side(bitboards, color)
+            if not moves:
+                break
+            from_sq, destinations = rng.choice(moves)
+            to_sq = rng.choice([sq for sq in range(64) if destinations >> sq & 1])
+            piece = bitboards.piece_at(from_sq)
+            captured = bitboards.piece_at(to_sq)
+            if captured:
+                bitboards.remove(to_sq, captured)
+            bitboards.remove(from_sq, piece)
+            bitboards.put(to_sq, piece)
+            color ^= 1
+
+
+@pytest.mark.parametrize("name, fen", [(name, fen) for name, fen, _ in PERFT_SUITE],
+                         ids=[name for name, _, _ in PERFT_SUITE])
+def test_perft_position_games(name, fen):
+    # Positions with castling rights, en passant and promotions on the way
+    rng = random.Random(name)
+    for _ in range(10):
+        position = parse_fen(fen)
+        for _ in range(80):
+            check_side(position, position.turn)
+            moves = position.legal_moves()
+            if not moves:
+                break
+            position.make_move(rng.choice(moves))
+
+
+@pytest.mark.parametrize("density", [0.1, 0.25, 0.5])
+def test_random_boards(density):
+    # One king a side and random pieces around them: checks, double checks
+    # and pins come up far more often than in games
+    rng = random.Random(density)
+    others = [piece for piece in PIECES if piece[1] != 'k']
+    for _ in range(300):
+        bitboards = Bitboards()
+        squares = rng.sample(range(64), 2)
+        bitboards.put(squares[0], "wk")
+        bitboards.put(squares[1], "bk")
+        for sq in range(64):
+            if sq not in squares and rng.random() < density:
+                bitboards.put(sq, rng.choice(others))
+        for color in (0, 1):
+            check_side(bitboards, color)
+
+
+def test_checkmate_and_stalemate_have_no_moves():
+    # Fool's mate, then a king stalemated by a queen
+    mate = grid_of(["rnb.kbnr", "pppp.ppp", "........", "....p...", "......Pq", ".....P..", "PPPPP..P", "RNBQKBNR"])
+    stalemate = grid_of([".......k", ".....Q..", "......K.", "........", "........", "........", "........",
+                         "........"])
+    for grid, color in ((mate, 0), (stalemate, 1)):
+        bitboards = Bitboards.from_grid(grid)
+        assert legal_moves(bitboards, color) == check_side(bitboards, color) == []
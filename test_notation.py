@@ -0,0 +1,80 @@
+# FEN and PGN round trips
+#
+#   python -m pytest -q
+#
+# Random games from the perft positions are written out as FEN and PGN and
+# read back; every position and move must survive the trip unchanged.
+
+import io
+import random
+
+import pytest
+
+from notation import IllegalMove, format_game, parse_fen, parse_san, read_games, replay, to_fen, validate, \
+    write_games
+from perft import PERFT_SUITE
+
+SUITE_IDS = [name for name, _, _ in PERFT_SUITE]
+
+
+def random_game(fen, rng, plies=80):
+    position = parse_fen(fen)
+    moves = []
+    for _ in range(plies):
+        legal = position.legal_moves()
+        if not legal:
+            break
+        moves.append(rng.choice(legal))
+        position.make_move(moves[-1])
+    return position, moves
+
+
+@pytest.mark.parametrize("name, fen", [(name, fen) for name, fen, _ in PERFT_SUITE], ids=SUITE_IDS)
+def test_fen_round_trip(name, fen):
+    assert to_fen(parse_fen(fen)) == fen
+    rng = random.Random(name)
+    position = parse_fen(fen)
+    for _ in range(60):
+        moves = position.legal_moves()
+        if not moves:
+            break
+        position.make_move(rng.choice(moves))
+        copy = parse_fen(to_fen(position))
+        assert to_fen(copy) == to_fen(position)
+        assert copy.squares == position.squares and copy.hash == position.hash
+
+
+@pytest.mark.parametrize("name, fen", [(name, fen) for name, fen, _ in PERFT_SUITE], ids=SUITE_IDS)
+def test_pgn_round_trip(name, fen):
+    rng = random.Random(name)
+    games = [random_game(fen, rng) for _ in range(5)]
+    out = io.StringIO()
+    headers = {"White": 'a "quoted" name', "Event": "test"}
+    assert write_games(out, ((moves, headers, fen, "*") for _, moves in games)) == len(games)
+    read = list(read_games(io.StringIO(out.getvalue())))
+    assert len(read) == len(games)
+    for game, (position, moves) in zip(read, games):
+        assert game.headers["White"] == headers["White"]
+        final, replayed = replay(game)
+        assert replayed == moves
+        assert to_fen(final) == to_fen(position)
+
+
+def test_san_disambiguation_and_promotion():
+    position = parse_fen("1k6/4P3/8/8/8/8/6K1/R6R w - - 0 1")
+    assert parse_san(position, "Rad1") != parse_san(position, "Rhd1")
+    with pytest.raises(IllegalMove):
+        parse_san(position, "Rd1")
+    promotions = {parse_san(position, f"e8={letter}") for letter in "NBRQ"}
+    assert len(promotions) == 4
+
+
+def test_validate_reports_illegal_games():
+    text = ('[White "a"]\n\n1. e4 e5 2. Nf3 Nc6 1-0\n\n'
+            '[White "b"]\n\n1. e4 e5 2. Ke3 *\n\n'
+            '1. d4 d5 2. Qxd5 0-1\n')
+    errors = [(game.headers.get("White"), error) for game, error in validate(io.StringIO(text))]
+    assert [white for white, _ in errors] == ["a", "b", None]
+    assert errors[0][1] is None
+    assert isinstance(errors[1][1], IllegalMove) and errors[1][1].ply == 2
+    assert isinstance(errors[2][1], IllegalMove) and errors[2][1].ply == 2
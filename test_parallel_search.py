@@ -0,0 +1,37 @@
+# Lazy SMP search
+#
+#   python -m pytest -q
+#
+# With one worker ParallelSearcher must be Searcher exactly; with helpers it
+# must still return a legal move from a completed depth, and find a mate.
+
+import pytest
+
+from notation import START_FEN, parse_fen
+from parallel_search import ParallelSearcher
+from position import move_to_uci
+from search import Searcher
+
+FENS = [START_FEN, "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"]
+
+
+@pytest.mark.parametrize("fen", FENS)
+def test_one_worker_is_searcher(fen):
+    expected = Searcher().search(parse_fen(fen), time_limit=1e9, max_depth=3)
+    with ParallelSearcher(1) as searcher:
+        result = searcher.search(parse_fen(fen), time_limit=1e9, max_depth=3)
+    assert (result.move, result.score, result.depth, result.nodes) == \
+        (expected.move, expected.score, expected.depth, expected.nodes)
+
+
+def test_helpers():
+    with ParallelSearcher(2) as searcher:
+        assert len(searcher.helpers) == 1
+        for fen in FENS:
+            position = parse_fen(fen)
+            result = searcher.search(position, time_limit=1e9, max_depth=3)
+            assert result.depth == 3 and result.move in position.legal_moves()
+        result = searcher.search(parse_fen("7k/8/6K1/8/8/8/8/1Q6 w - - 0 1"), time_limit=1e9, max_depth=3)
+        assert move_to_uci(result.move) == "b1b8"
+        processes = [process for process, _ in searcher.helpers]
+    assert not searcher.helpers and not any(process.is_alive() for process in processes)
@@ -0,0 +1,39 @@
+# Perft regression tests for the move generator
+#
+#   python -m pytest -q
+#
+# Node counts of the legal move tree against the published reference values
+# in perft.PERFT_SUITE. Any change that adds or loses a move somewhere in
+# the tree changes a count.
+
+import pytest
+
+from notation import START_FEN, parse_fen
+from perft import PERFT_SUITE, divide, perft
+
+# Deep enough to reach castling, en passant, promotions and discovered checks
+# in every suite position, shallow enough to keep the run under a minute
+DEPTHS = {"startpos": 4, "kiwipete": 4, "position3": 4, "position4": 3, "position5": 3, "position6": 3}
+
+
+@pytest.mark.parametrize("name, fen, counts", PERFT_SUITE, ids=[name for name, _, _ in PERFT_SUITE])
+def test_perft_suite(name, fen, counts):
+    position = parse_fen(fen)
+    for depth in range(1, DEPTHS[name] + 1):
+        assert perft(position, depth) == counts[depth], f"{name} depth {depth}"
+
+
+def test_perft_leaves_position_unchanged():
+    position = parse_fen(PERFT_SUITE[1][1])
+    before = (position.squares.tobytes(), position.pieces[:], position.turn, position.castling, position.ep_square)
+    perft(position, 3)
+    assert (position.squares.tobytes(), position.pieces[:], position.turn, position.castling,
+            position.ep_square) == before
+    assert not position.history
+
+
+def test_divide_sums_to_perft():
+    position = parse_fen(START_FEN)
+    moves = divide(position, 3)
+    assert len(moves) == 20
+    assert sum(moves.values()) == 8902
@@ -0,0 +1,63 @@
+# make_move / unmake_move round trips
+#
+#   python -m pytest -q
+#
+# Random games from the perft positions: after every move the incremental
+# hash and evaluation terms must match a recomputation, and unmaking the
+# move must restore every field of the position exactly.
+
+import random
+
+import pytest
+
+from evaluation import check_terms
+from notation import parse_fen
+from perft import PERFT_SUITE
+from position import DOUBLE_PUSH, move_flag
+from zobrist import compute_hash
+
+GAMES = 20
+PLIES = 60
+
+
+def snapshot(position):
+    return (position.squares.tobytes(), position.pieces[:], position.occupied[:], position.occupancy,
+            position.turn, position.castling, position.ep_square, position.halfmove, position.fullmove,
+            position.hash, position.mg, position.eg, position.phase, len(position.history))
+
+
+@pytest.mark.parametrize("name, fen", [(name, fen) for name, fen, _ in PERFT_SUITE],
+                         ids=[name for name, _, _ in PERFT_SUITE])
+def test_make_unmake_round_trip(name, fen):
+    rng = random.Random(name)
+    for _ in range(GAMES):
+        position = parse_fen(fen)
+        start = snapshot(position)
+        for _ in range(PLIES):
+            moves = position.legal_moves()
+            if not moves:
+                break
+            # Every move here is made and unmade before one is played on
+            for move in moves:
+                before = snapshot(position)
+                position.make_move(move)
+                assert position.hash == compute_hash(position)
+                check_terms(position)
+                position.unmake_move()
+                assert snapshot(position) == before
+            position.make_move(rng.choice(moves))
+        while position.history:
+            position.unmake_move()
+        assert snapshot(position) == start
+
+
+def test_null_move_round_trip():
+    # After a double push, so the null move also clears the en passant square
+    position = parse_fen(PERFT_SUITE[1][1])
+    position.make_move(next(move for move in position.legal_moves() if move_flag(move) == DOUBLE_PUSH))
+    before = snapshot(position)
+    position.make_null_move()
+    assert position.hash == compute_hash(position)
+    assert position.ep_square == -1 and position.turn != before[4]
+    position.unmake_move()
+    assert snapshot(position) == before
@@ -0,0 +1,128 @@
+# Quantum state and the quantum rules of the engine
+#
+#   python -m pytest -q
+#
+# QuantumState must keep its distributions normalised, its square owners
+# and its Zobrist key in step with the ghosts; the engine must apply the
+# split, measure and capture rules on top of it.
+
+import pytest
+
+import engine
+from bitboard import PIECE_INDEX
+from position import move_to_uci, parse_square
+from quantum import QuantumState
+from zobrist import ghost_key
+
+
+def sq(name):
+    return parse_square(name)
+
+
+def check_state(state):
+    key = 0
+    for piece_id, (index, dist) in state.pieces.items():
+        assert dist and sum(dist.values()) == pytest.approx(1.0)
+        for square in dist:
+            assert state.owner[square] == piece_id
+            key ^= ghost_key(index, square)
+    assert len(state.owner) == sum(len(dist) for _, dist in state.pieces.values())
+    assert state.hash == key
+
+
+def test_split_and_split_again():
+    position = engine.new_position()
+    state = QuantumState(seed=1)
+    state.split(position, sq("g1"), [sq("f3"), sq("h3")])
+    assert position.squares[sq("g1")] < 0
+    assert state.probability(sq("f3")) == state.probability(sq("h3")) == 0.5
+    state.split(position, sq("f3"), [sq("e5"), sq("g5")])
+    assert sorted(state.ghosts()) == [(sq("e5"), PIECE_INDEX["wn"], 0.25), (sq("g5"), PIECE_INDEX["wn"], 0.25),
+                                      (sq("h3"), PIECE_INDEX["wn"], 0.5)]
+    assert len(state) == 1
+    check_state(state)
+
+
+def test_measure_and_resolve():
+    for seed in range(20):
+        position = engine.new_position()
+        state = QuantumState(seed=seed)
+        piece_id = state.split(position, sq("b1"), [sq("a3"), sq("c3")])
+        copy = state.copy()
+        landed = state.measure(position, piece_id)
+        assert landed in (sq("a3"), sq("c3")) and position.squares[landed] == PIECE_INDEX["wn"]
+        assert not len(state) and state.hash == 0
+        # The copy keeps its own distributions and random source
+        assert len(copy) == 1 and copy.measure(position.copy(), piece_id) == landed
+
+    outcomes = set()
+    for seed in range(40):
+        position = engine.new_position()
+        state = QuantumState(seed=seed)
+        state.split(position, sq("b1"), [sq("a3"), sq("c3")])
+        state.split(position, sq("c3"), [sq("d5"), sq("e4")])
+        if state.resolve(position, sq("a3")):
+            outcomes.add("a3")
+            assert not len(state) and position.squares[sq("a3")] == PIECE_INDEX["wn"]
+            continue
+        assert state.probability(sq("d5")) == state.probability(sq("e4")) == 0.5
+        check_state(state)
+        # With one square left after this, the knight ends up on the board
+        present = state.resolve(position, sq("d5"))
+        landed = sq("d5") if present else sq("e4")
+        outcomes.add("d5" if present else "e4")
+        assert not len(state) and position.squares[landed] == PIECE_INDEX["wn"]
+    assert outcomes == {"a3", "d5", "e4"}
+
+
+def test_engine_split_rules():
+    engine.reset(seed=13)
+    assert engine.split_targets(7, 4) == []                    # kings never split
+    assert engine.split_targets(1, 4) == []                    # not black's turn
+    assert engine.split_targets(7, 6) == [(5, 5), (5, 7)]
+    engine.split((7, 6), [(5, 5), (5, 7)])
+    assert engine.side_to_move() == "black"
+    assert engine.quantum_squares() == {(5, 5): ("wn", 0.5), (5, 7): ("wn", 0.5)}
+    engine.move_piece((1, 4), (3, 4))
+    allowed = {move_to_uci(move) for move in engine.allowed_moves()}
+    # No pawn lands on a ghost, no piece on a friendly one
+    assert "f2f3" not in allowed and "h2h3" not in allowed and "g2g3" in allowed
+    # Quiet moves only: the capture on e5 is not a split target
+    assert engine.split_targets(5, 5) == [(3, 6), (4, 3), (4, 7), (7, 6)]
+    assert engine.measure(1, 1) is None
+    landed = engine.measure(5, 5)
+    assert landed in ((5, 5), (5, 7)) and engine.piece_at(*landed) == "wn"
+    assert engine.side_to_move() == "black" and not engine.quantum_squares()
+
+
+def test_pinned_pieces_do_not_split():
+    # The rook on e2 shields its king from the rook on e8; off the board as
+    # ghosts it would shield nothing
+    engine.load_fen("4r2k/8/8/8/8/8/4R3/4K1N1 w - - 0 1")
+    assert engine.split_targets(6, 4) == []
+    assert engine.split_targets(7, 6) == [(5, 5), (5, 7)]
+    engine.load_fen("7k/8/8/8/8/8/4R3/4K3 w - - 0 1")
+    assert len(engine.split_targets(6, 4)) == 13
+    # In check, a ghost cannot split either, not even to a square where the
+    # piece would block the check
+    engine.load_fen("4r2k/8/8/8/8/8/8/4K3 w - - 0 1")
+    engine.quantum.add(PIECE_INDEX["wn"], {sq("f3"): 0.5, sq("h3"): 0.5})
+    assert engine.split_targets(5, 5) == []
+
+
+def test_status_follows_the_quantum_rules():
+    # Black's only legal move, a7-a6, lands on a white ghost, so it is
+    # stalemate; with a ghost of its own to measure black could still play
+    engine.load_fen("7k/p4Q2/8/P7/8/8/8/2K5 b - - 0 1")
+    assert not engine.game_status().stalemate
+    engine.quantum.add(PIECE_INDEX["wn"], {sq("a6"): 0.5, sq("c6"): 0.5})
+    assert not engine.allowed_moves() and not engine.has_any_moves("black")
+    status = engine.game_status()
+    assert status.stalemate and status.winner is None
+    engine.quantum.add(PIECE_INDEX["bn"], {sq("d5"): 0.5, sq("e5"): 0.5})
+    assert engine.has_any_moves("black") and not engine.game_status().stalemate
+    # Mate: the only answer to the check, c7-c6, is a pawn onto a ghost
+    engine.load_fen("3bkb2/2p1ppp1/8/1B6/8/8/8/6K1 b - - 0 1")
+    assert engine.game_status().winner is None
+    engine.quantum.add(PIECE_INDEX["wn"], {sq("c6"): 0.5, sq("a4"): 0.5})
+    assert engine.game_status().winner == "w"
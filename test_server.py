@@ -0,0 +1,190 @@
+# Game server protocol
+#
+#   python -m pytest -q
+#
+# Requests go straight to GameServer.handle with players whose writers
+# collect the replies; one test runs the same protocol over a real socket.
+
+import asyncio
+import json
+import random
+
+from notation import START_FEN
+from server import GameServer, Player
+
+
+class Inbox:
+    # A Player writer that keeps the decoded messages
+    def __init__(self):
+        self.messages = []
+
+    def write(self, data):
+        self.messages.extend(json.loads(line) for line in data.splitlines())
+
+    def take(self):
+        messages, self.messages = self.messages, []
+        return messages
+
+
+def connect(server):
+    inbox = Inbox()
+    return Player(inbox), inbox
+
+
+def table(rules="quantum"):
+    # A server with one game and both players seated, inboxes emptied
+    server = GameServer(random.Random(20))
+    white, white_inbox = connect(server)
+    black, black_inbox = connect(server)
+    server.handle(white, {"op": "new", "rules": rules})
+    server.handle(black, {"op": "join", "game": white.game.id})
+    white_inbox.take()
+    black_inbox.take()
+    return server, (white, white_inbox), (black, black_inbox)
+
+
+def error(inbox):
+    messages = inbox.take()
+    assert len(messages) == 1 and messages[0]["op"] == "error", messages
+    return messages[0]["message"]
+
+
+def test_new_and_join():
+    server = GameServer(random.Random(20))
+    white, white_inbox = connect(server)
+    black, black_inbox = connect(server)
+    server.handle(white, {"op": "new", "rules": "classical"})
+    [state] = white_inbox.take()
+    assert state["op"] == "state" and state["color"] == "white" and state["rules"] == "classical"
+    assert state["fen"] == START_FEN and state["status"] == "playing" and not state["opponent"]
+    server.handle(black, {"op": "join", "game": state["game"]})
+    [white_state] = white_inbox.take()
+    [black_state] = black_inbox.take()
+    assert white_state["opponent"] and black_state["opponent"] and black_state["color"] == "black"
+    third, third_inbox = connect(server)
+    server.handle(third, {"op": "join", "game": state["game"]})
+    assert "full" in error(third_inbox)
+    server.handle(third, {"op": "join", "game": 999})
+    assert "no game" in error(third_inbox)
+    server.handle(third, {"op": "fly"})
+    assert "unknown op" in error(third_inbox)
+    server.handle(third, {"op": "new", "rules": "chess960"})
+    assert "unknown rules" in error(third_inbox)
+
+
+def test_malformed_requests():
+    server = GameServer(random.Random(20))
+    player, inbox = connect(server)
+    for request in ([1, 2], {"op": 5}, {"op": ["new"]}, {"op": "new", "rules": ["quantum"]},
+                    {"op": "join", "game": True}, {"op": "join", "game": [1]}, {"op": "join", "game": "1"}):
+        server.handle(player, request)
+        error(inbox)
+    assert player.game is None and not server.games
+
+
+def test_moves_and_turns():
+    server, (white, white_inbox), (black, black_inbox) = table("classical")
+    server.handle(black, {"op": "move", "move": "e7e5"})
+    assert "not your turn" in error(black_inbox)
+    server.handle(white, {"op": "move", "move": "e2e5"})
+    assert "illegal move" in error(white_inbox)
+    server.handle(white, {"op": "move", "move": "e2"})
+    assert "bad move" in error(white_inbox)
+    server.handle(white, {"op": "move", "move": "e2e4"})
+    for inbox in (white_inbox, black_inbox):
+        [state] = inbox.take()
+        assert state["last"] == "e2e4" and state["fen"].split()[1] == "b"
+    server.handle(black, {"op": "split", "from": "g8", "to": ["f6", "h6"]})
+    assert "quantum" in error(black_inbox)
+
+
+def test_fools_mate_ends_the_game():
+    server, (white, white_inbox), (black, black_inbox) = table("classical")
+    players = (white, black)
+    for ply, move in enumerate(["f2f3", "e7e5", "g2g4", "d8h4"]):
+        server.handle(players[ply % 2], {"op": "move", "move": move})
+    [state] = white_inbox.take()[-1:]
+    assert state["status"] == "0-1"
+    server.handle(white, {"op": "move", "move": "a2a3"})
+    assert "over" in error(white_inbox)
+
+
+def test_split_and_measure():
+    server, (white, white_inbox), (black, black_inbox) = table("quantum")
+    server.handle(white, {"op": "split", "from": "g1", "to": ["f3", "f3"]})
+    assert "illegal split" in error(white_inbox)
+    server.handle(white, {"op": "split", "from": "g1", "to": ["f3", "h3"]})
+    [state] = black_inbox.take()
+    assert state["ghosts"] == [["wn", {"f3": 0.5, "h3": 0.5}]] and state["last"] == "Sg1f3h3"
+    white_inbox.take()
+    server.handle(black, {"op": "move", "move": "e7e5"})
+    white_inbox.take()
+    server.handle(white, {"op": "measure", "square": "e2"})
+    assert "no ghost" in error(white_inbox)
+    server.handle(white, {"op": "measure", "square": "f3"})
+    [state] = black_inbox.take()[-1:]
+    assert state["ghosts"] == [] and state["last"] in ("Mf3f3", "Mf3h3")
+
+
+def test_leaving():
+    server, (white, white_inbox), (black, black_inbox) = table()
+    game_id = white.game.id
+    server.leave(black)
+    [state] = white_inbox.take()
+    assert not state["opponent"]
+    server.handle(white, {"op": "move", "move": "e2e4"})
+    assert "waiting" in error(white_inbox)
+    server.handle(black, {"op": "state"})
+    assert "not in a game" in error(black_inbox)
+    server.leave(white)
+    assert game_id not in server.games
+
+
+def test_join_own_game():
+    server, (white, white_inbox), (black, black_inbox) = table()
+    game_id = white.game.id
+    server.handle(white, {"op": "join", "game": game_id})
+    assert "already in game" in error(white_inbox)
+    server.leave(black)
+    white_inbox.take()
+    server.handle(white, {"op": "join", "game": game_id})
+    assert "already in game" in error(white_inbox)
+    assert white.game is server.games[game_id] and white.color == 0
+    server.handle(black, {"op": "join", "game": game_id})
+    assert black.game is white.game and black.color == 1
+
+
+def test_socket_round_trip():
+    async def session():
+        server = GameServer(random.Random(20))
+        ready = asyncio.get_running_loop().create_future()
+        task = asyncio.ensure_future(server.serve("127.0.0.1", 0, ready.set_result))
+        port = await ready
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b'{"op": "new", "rules": "classical"}\n')
+        state = json.loads(await reader.readline())
+        writer.write(b"this is not JSON\n")
+        reply = json.loads(await reader.readline())
+        # Over the limit before its end has even been sent
+        writer.write(b'{"op": "state", "pad": "' + b"x" * 70000)
+        await writer.drain()
+        await asyncio.sleep(0.05)
+        writer.write(b'"}\n')
+        too_long = json.loads(await reader.readline())
+        writer.write(b"[" * 50000 + b"\n")
+        nested = json.loads(await reader.readline())
+        writer.write(b'{"op": "state"}\n')
+        again = json.loads(await reader.readline())
+        writer.close()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return state, reply, too_long, nested, again
+
+    state, reply, too_long, nested, again = asyncio.run(session())
+    assert state["op"] == "state" and state["color"] == "white"
+    assert reply == nested == {"op": "error", "message": "bad JSON"}
+    assert too_long == {"op": "error", "message": "request too long"}
+    assert again == state
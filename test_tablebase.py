@@ -0,0 +1,82 @@
+# Endgame tablebase generation and probing
+#
+#   python -m pytest -q
+#
+# KQK is built into a temporary directory once. Every probe must agree with
+# the best of its children, and the longest win must be the known mate in 10.
+
+import random
+
+import pytest
+
+from notation import parse_fen
+from tablebase import DRAW, HEADER, LOSS, UNUSED, WIN, _encode, best_move, build, decode, describe, probe, table
+
+
+@pytest.fixture(scope="module")
+def tables(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("tables"))
+    build(["KQK"], directory, workers=1, log=lambda message: None)
+    return directory
+
+
+def random_kqk(rng):
+    while True:
+        squares = rng.sample(range(64), 3)
+        grid = ["1"] * 64
+        for sq, letter in zip(squares, "KQk"):
+            grid[sq] = letter
+        placement = "/".join("".join(grid[row * 8:row * 8 + 8]) for row in range(8))
+        position = parse_fen(f"{placement} {rng.choice('wb')} - - 0 1")
+        # Skip positions where the side not to move is in check
+        position.turn ^= 1
+        illegal = position.in_check()
+        position.turn ^= 1
+        if not illegal:
+            return position
+
+
+def test_longest_mate(tables):
+    found = table("KQK", tables)
+    codes = found.map[HEADER.size:]
+    wins = [decode(code)[1] for code in codes if code >> 6 == WIN]
+    assert max(wins) == 19  # mate in 10
+    assert describe((WIN, max(wins))) == "win, mate in 10"
+
+
+def test_mate_in_one(tables):
+    position = parse_fen("7k/8/6K1/8/8/8/8/1Q6 w - - 0 1")
+    assert probe(position, tables) == (WIN, 1)
+    move, result, plies = best_move(position, directory=tables)
+    assert (result, plies) == (WIN, 1)
+    position.make_move(move)
+    assert probe(position, tables) == (LOSS, 0)
+    assert position.in_check() and not position.legal_moves()
+
+
+def test_probes_agree_with_children(tables):
+    rng = random.Random(19)
+    for _ in range(300):
+        position = random_kqk(rng)
+        outcome = probe(position, tables)
+        if not position.legal_moves():
+            assert outcome == ((LOSS, 0) if position.in_check() else (DRAW, 0))
+            continue
+        best = best_move(position, directory=tables)
+        assert outcome == best[1:]
+
+
+def test_uncovered_material(tables):
+    assert probe(parse_fen("8/8/3k4/8/8/2NK4/8/8 w - - 0 1"), tables) == (DRAW, 0)
+    assert probe(parse_fen("8/8/3k4/8/8/2RK4/8/8 w - - 0 1"), tables) is None
+    assert probe(parse_fen("4k3/8/8/8/8/8/8/R3K3 w Q - 0 1"), tables) is None
+
+
+def test_encode_limits():
+    # 63 moves is the most the low six bits hold, either way round
+    for result, plies in ((WIN, 1), (WIN, 125), (LOSS, 0), (LOSS, 126), (DRAW, 0)):
+        assert decode(_encode(result, plies)) == (result, plies)
+    assert _encode(UNUSED, 0) >> 6 == UNUSED
+    for result, plies in ((WIN, 127), (LOSS, 128), (LOSS, 300)):
+        with pytest.raises(ValueError):
+            _encode(result, plies)
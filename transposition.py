@@ -0,0 +1,110 @@
+# Fixed-size transposition table
+#
+# Entries live in two flat arrays of unsigned 64-bit ints sized from a memory
+# budget, so the table never grows and can be backed by any buffer (e.g.
+# shared memory). Each entry packs
+#
+#   move (16 bits) | score + 32768 (16 bits) | depth (8 bits) | bound (2 bits) | generation (6 bits)
+#
+# and the key slot holds key ^ data, so a torn write from another process
+# simply fails verification instead of returning a wrong entry.
+#
+# Replacement: entries come in buckets of two. The first slot keeps the
+# deepest result (unless it is from an older search), the second slot always
+# takes the newest one.
+
+from array import array
+
+EXACT, LOWER, UPPER = 1, 2, 3  # 0 marks an empty slot
+
+ENTRY_BYTES = 16
+MASK64 = (1 << 64) - 1
+
+
+def entries_for(memory_mb):
+    # Largest power-of-two number of entries that fits the budget
+    entries = max(2, int(memory_mb * 1024 * 1024) // ENTRY_BYTES)
+    return 1 << (entries.bit_length() - 1)
+
+
+def _pack(move, score, depth, bound, generation):
+    return (move & 0xFFFF) | ((score + 32768) & 0xFFFF) << 16 | min(max(depth, 0), 255) << 32 \
+        | bound << 40 | (generation & 63) << 42
+
+
+class TranspositionTable:
+    __slots__ = ("size", "mask", "keys", "data", "generation", "probes", "hits", "stores")
+
+    def __init__(self, memory_mb=16, buffer=None):
+        if buffer is None:
+            self.size = entries_for(memory_mb)
+            self.keys = array('Q', bytes(8 * self.size))
+            self.data = array('Q', bytes(8 * self.size))
+        else:
+            # buffer is a writable memoryview of 16 * size bytes, size a power of two
+            view = memoryview(buffer).cast('B')
+            self.size = len(view) // ENTRY_BYTES
+            self.keys = view[:8 * self.size].cast('Q')
+            self.data = view[8 * self.size:16 * self.size].cast('Q')
+        self.mask = (self.size - 1) & ~1  # first slot of a bucket
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def new_search(self):
+        self.generation = (self.generation + 1) & 63
+
+    def clear(self):
+        for i in range(self.size):
+            self.keys[i] = 0
+            self.data[i] = 0
+        self.generation = 0
+
+    def probe(self, key):
+        # (move, score, depth, bound) or None
+        self.probes += 1
+        key &= MASK64
+        slot = key & self.mask
+        for i in (slot, slot + 1):
+            data = self.data[i]
+            if data and self.keys[i] ^ data == key:
+                self.hits += 1
+                return (data & 0xFFFF, ((data >> 16) & 0xFFFF) - 32768, (data >> 32) & 0xFF, (data >> 40) & 3)
+        return None
+
+    def store(self, key, move, score, depth, bound):
+        key &= MASK64
+        slot = key & self.mask
+        keys = self.keys
+        datas = self.data
+        generation = self.generation
+
+        # Same position: update in place, keeping a known best move
+        for i in (slot, slot + 1):
+            old = datas[i]
+            if old and keys[i] ^ old == key:
+                if not move:
+                    move = old & 0xFFFF
+                if depth >= (old >> 32) & 0xFF or bound == EXACT or (old >> 42) & 63 != generation:
+                    data = _pack(move, score, depth, bound, generation)
+                    keys[i] = key ^ data
+                    datas[i] = data
+                    self.stores += 1
+                return
+
+        deep = datas[slot]
+        if not deep or depth >= (deep >> 32) & 0xFF or (deep >> 42) & 63 != generation:
+            i = slot
+        else:
+            i = slot + 1
+        data = _pack(move, score, depth, bound, generation)
+        keys[i] = key ^ data
+        datas[i] = data
+        self.stores += 1
+
+    def hashfull(self):
+        # Permille of the first 1000 slots used by the current search
+        sample = min(1000, self.size)
+        used = sum(1 for i in range(sample) if self.data[i] and (self.data[i] >> 42) & 63 == self.generation)
+        return used * 1000 // sample
@@ -0,0 +1,38 @@
+# Zobrist keys
+#
+# A position's hash is the XOR of one random 64-bit key per (piece, square)
+# plus keys for castling rights, the en passant file and the side to move, so
+# every move updates it with a handful of XORs. Superposed squares from
+# quantum mode get their own set of keys on top of the classical ones.
+# The keys come from a fixed seed so hashes are stable across runs and
+# processes (opening books and shared tables depend on that).
+
+import random
+
+_rng = random.Random(0x5EED_C4E55)
+
+PIECE_KEYS = [_rng.getrandbits(64) for _ in range(12 * 64)]      # index * 64 + square
+CASTLING_KEYS = [_rng.getrandbits(64) for _ in range(16)]
+EP_KEYS = [_rng.getrandbits(64) for _ in range(8)]                # by file
+SIDE_KEY = _rng.getrandbits(64)                                   # black to move
+GHOST_KEYS = [_rng.getrandbits(64) for _ in range(12 * 64)]      # superposed piece on square
+CASTLING_KEYS[0] = 0
+
+
+def compute_hash(position):
+    # Full recompute, used when a position is set up and to check the
+    # incremental hash
+    key = 0
+    for sq, index in enumerate(position.squares):
+        if index >= 0:
+            key ^= PIECE_KEYS[index * 64 + sq]
+    key ^= CASTLING_KEYS[position.castling]
+    if position.ep_square >= 0:
+        key ^= EP_KEYS[position.ep_square & 7]
+    if position.turn:
+        key ^= SIDE_KEY
+    return key
+
+
+def ghost_key(piece_index, sq):
+    return GHOST_KEYS[piece_index * 64 + sq]